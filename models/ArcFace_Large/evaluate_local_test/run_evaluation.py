@@ -10,11 +10,16 @@ import faiss
 import insightface
 from tqdm import tqdm
 from google.cloud import storage
-from config import (
+from models.embedder.formats import AnnotationStore, STORE_FILE
+from models.embedder import apply_occlusion
+from models.ArcFace_Large.evaluate_local_test.config import (
     BUCKET_NAME, BASE_FOLDER_GCS, LOCAL_DATA_DIR, 
     FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE
 )
 
+# Uruchamianie z katalogu głównego repozytorium:
+#   python -m models.ArcFace_Large.evaluate_local_test.run_evaluation
+
 # --- 1. INICJALIZACJA MODELU I GCS ---
 
 def initialize_services():
@@ -68,6 +73,40 @@ def download_blob(blob, destination_folder):
         print(f"Warning: Nie udało się pobrać {blob.name}: {e}")
         return None
 
+def load_annotation_store(bucket):
+    """
+    Pobiera magazyn adnotacji podziału (<BASE_FOLDER_GCS>/annotations.store z s_04_upload) -
+    dla zdjęć bez pliku .json w GCS. Zwraca AnnotationStore albo None, gdy go nie ma.
+    """
+    blob = bucket.blob(f"{BASE_FOLDER_GCS}/{STORE_FILE}")
+    try:
+        if not blob.exists():
+            return None
+        blob.download_to_filename(os.path.join(LOCAL_DATA_DIR, STORE_FILE))
+        return AnnotationStore(LOCAL_DATA_DIR)
+    except Exception as e:
+        print(f"Warning: Nie udało się pobrać magazynu adnotacji {blob.name}: {e}")
+        return None
+
+def load_annotation(json_blob, jpg_blob, store):
+    """Adnotacja zdjęcia: z pliku .json w GCS, a gdy go nie ma - z magazynu adnotacji."""
+    if json_blob:
+        local_json_path = download_blob(json_blob, LOCAL_DATA_DIR)
+        if not local_json_path:
+            return None
+        try:
+            with open(local_json_path, 'r') as jf:
+                return json.load(jf)
+        except Exception as e:
+            tqdm.write(f"Warning: Błąd odczytu JSON {local_json_path}: {e}")
+            return None
+        finally:
+            os.remove(local_json_path)
+    if store is None:
+        return None
+    key = os.path.splitext(jpg_blob.name[len(BASE_FOLDER_GCS) + 1:])[0]
+    return store.get(key)
+
 # --- 2. NOWA FUNKCJA POMOCNICZA ---
 
 def discover_file_structure(bucket):
@@ -196,45 +235,10 @@ def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
 
 # --- 4. TESTOWANIE Z OKLUZJĄ (ZMODYFIKOWANE) ---
 
-def apply_occlusion(image, landmarks_dict, bbox):
-    """Nakłada pasek okluzji na wysokości oczu o szerokości twarzy."""
-    occluded_image = image.copy()
-    
-    try:
-        # 1. Znajdź środek wysokości oczu (oś Y)
-        # Bierzemy średnią wysokość lewego i prawego oka
-        left_eye_y = landmarks_dict["left_eye"][1]
-        right_eye_y = landmarks_dict["right_eye"][1]
-        eye_y_center = int((left_eye_y + right_eye_y) / 2)
-        
-        # 2. Użyj OCCLUSION_SIZE jako CAŁKOWITEJ wysokości paska
-        bar_height_half = OCCLUSION_SIZE // 2
-        
-        # 3. Znajdź szerokość twarzy (oś X) z bbox
-        # bbox to [x1, y1, x2, y2]
-        face_x1 = int(bbox[0])
-        face_x2 = int(bbox[2])
-        
-        # 4. Oblicz współrzędne finalnego paska
-        x1 = face_x1
-        y1 = max(0, eye_y_center - bar_height_half) # Upewnij się, że nie wyjdziesz poza górę obrazu
-        x2 = face_x2
-        y2 = min(image.shape[0], eye_y_center + bar_height_half) # Upewnij się, że nie wyjdziesz poza dół
-        
-        # 5. Narysuj czarny prostokąt
-        cv2.rectangle(occluded_image, (x1, y1), (x2, y2), (0, 0, 0), -1) # -1 = wypełniony
-    
-    except Exception as e:
-        # Jeśli brakuje klucza "left_eye" lub coś jest nie tak, logujemy błąd
-        print(f"Warning: Błąd podczas nakładania okluzji (np. brak landmarków): {e}")
-        # Zwróć oryginał, jeśli coś pójdzie nie tak
-        return image.copy() 
-
-    return occluded_image
-
-def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
+def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs, store=None):
     """
     Testuje drugą połowę zdjęć z okluzją i zapisuje wyniki do CSV.
+    store: magazyn adnotacji dla zdjęć bez pliku .json w GCS (load_annotation_store).
     """
     print("Wczytywanie galerii FAISS i mapowania ID...")
     try:
@@ -274,37 +278,28 @@ def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
                 jpg_blob = image_pairs.get(img_folder_path, {}).get('jpg')
                 json_blob = image_pairs.get(img_folder_path, {}).get('json')
 
-                if not jpg_blob or not json_blob:
-                    tqdm.write(f"Warning: Brak pary JPG/JSON dla {img_folder_path}")
+                if not jpg_blob:
+                    tqdm.write(f"Warning: Brak pliku .jpg w {img_folder_path}")
                     continue
                 
                 local_img_path = download_blob(jpg_blob, LOCAL_DATA_DIR)
-                local_json_path = download_blob(json_blob, LOCAL_DATA_DIR)
-                
-                if not local_img_path or not local_json_path:
+                if not local_img_path:
                     continue 
 
                 img = cv2.imread(local_img_path)
-                json_data = None
-                try:
-                    with open(local_json_path, 'r') as jf:
-                        json_data = json.load(jf)
-                except Exception as e:
-                    tqdm.write(f"Warning: Błąd odczytu JSON {local_json_path}: {e}")
-                    img = None # Ustawiamy na None, aby sprzątać
+                os.remove(local_img_path)
+                json_data = load_annotation(json_blob, jpg_blob, store)
                 
                 # Sprawdzamy, czy mamy wszystko: obraz, landmarki ORAZ bbox
                 if (img is None or json_data is None or 
                     "landmarks" not in json_data or "bbox" not in json_data):
                     
                     tqdm.write(f"Warning: Brak pełnych danych (JPG/JSON/Landmarks/BBox) dla {local_img_path}")
-                    if local_img_path and os.path.exists(local_img_path): os.remove(local_img_path)
-                    if local_json_path and os.path.exists(local_json_path): os.remove(local_json_path)
                     continue
 
                 # 1. Nałóż okluzję
                 # Przekazujemy teraz landmarki ORAZ bbox
-                occluded_img = apply_occlusion(img, json_data["landmarks"], json_data["bbox"])
+                occluded_img = apply_occlusion(img, json_data["landmarks"], json_data["bbox"], OCCLUSION_SIZE)
                 
                 # === KOD DO ZAPISU OBRAZU OKLUZJI ===
                 try:
@@ -319,9 +314,6 @@ def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
                 query_embedding = get_embedding(model, occluded_img)
                 
                 if query_embedding is None:
-                    # Sprzątanie przed 'continue'
-                    os.remove(local_img_path)
-                    os.remove(local_json_path)
                     continue 
                     
                 # 3. Przeszukaj FAISS
@@ -354,10 +346,6 @@ def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
                     correct_top1 += 1
                 total_queries += 1
 
-                # Sprzątanie
-                os.remove(local_img_path)
-                os.remove(local_json_path)
-
     if total_queries > 0:
         accuracy = (correct_top1 / total_queries) * 100
         print(f"\n--- Ewaluacja Zakończona ---")
@@ -393,7 +381,7 @@ def main():
     # Krok 2: Uruchom ewaluację z okluzją
     # Zakładamy, że pliki FAISS już istnieją
     print("--- ROZPOCZYNAM KROK 2: Ewaluacja Okluzji ---")
-    run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs)
+    run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs, load_annotation_store(bucket))
     
     # Sprzątanie folderu cache
     print("Sprzątanie folderu cache...")
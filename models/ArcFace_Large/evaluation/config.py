@@ -5,10 +5,54 @@ import os
 BASE_FOLDER_LOCAL = "../../scripts/casia_dataset/webface_112x112" 
 # Możesz też ustawić pełną ścieżkę, np. "C:/Users/User/Projekty/webface_112x112"
 
+# --- Konfiguracja Modelu (models.embedder) ---
+EMBEDDER_BACKEND = "arcface"
+# Ustaw det_size (640, 640) dla datasetu testowego lub (112, 112) dla WebFace
+EMBEDDER_OPTIONS = {"model_name": "buffalo_l", "det_size": (224, 224)}
+
+# Cache embeddingów na dysku (klucz: hash JPEG + model + parametry okluzji).
+# Obrazy z cache nie są dekodowane, więc podglądy w occlusion_photos powstają tylko dla
+# nowo liczonych zdjęć. Ustaw None, aby zawsze liczyć od zera.
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
 # --- Konfiguracja FAISS & Galerii ---
 FAISS_INDEX_FILE = "gallery.index"
-FAISS_MAPPING_FILE = "gallery_id_map.json"
+# Mapowanie ID FAISS -> nazwa tożsamości: <FAISS_MAPPING_FILE>_ids.npy i _labels.npy
+# (models.gallery.id_map, wczytywane przez memmap). Stary plik .json też jest obsługiwany.
+FAISS_MAPPING_FILE = "gallery_id_map"
+
+# Typ indeksu galerii (models.gallery.INDEX_TYPES): "flat" (dokładny IndexFlatIP), "hnsw",
+# "ivf_flat", "ivf_pq" lub "sq". Opcje budowy: nlist, pq_m, pq_bits, hnsw_m, ef_construction.
+GALLERY_INDEX_TYPE = "flat"
+GALLERY_INDEX_OPTIONS = {}
+# Parametry przeszukiwania: nprobe (IVF) i efSearch (HNSW) - więcej = dokładniej, ale wolniej
+GALLERY_NPROBE = 16
+GALLERY_EF_SEARCH = 64
+
+# Wczytywanie galerii do przeszukiwania: models.gallery.load_search_gallery (opis opcji w loading.py).
+# Shardy mapowane z dysku, np. "gallery_shards" (None = cała galeria z FAISS_INDEX_FILE w pamięci);
+# z istniejącego indeksu: python -m models.gallery.build_shards gallery.index gallery_shards float16
+# (float32, gdy ustawione jest GALLERY_COMPRESSION - shardy służą wtedy do dokładnego re-rankingu).
+GALLERY_SHARDS = None
+# Liczba procesów przeszukujących shardy (0 = w tym procesie). Wymaga GALLERY_SHARDS.
+GALLERY_SEARCH_NODES = 0
+# "float16", "int8", "binary" albo None. Przy kompresji te same zapytania przeszukuje też galeria
+# bez kompresji (RESULTS_CSV_UNCOMPRESSED) - raport: pamięć, czas i zmiana Rank-1/Rank-3.
+GALLERY_COMPRESSION = None
+GALLERY_RERANK_K = 50
+# "mean" albo "templates"; agregacja szablonów: "max", "mean_top_k" (GALLERY_TOP_K) lub "softmax"
+# (GALLERY_TEMPERATURE). GALLERY_TEMPLATE_SEARCH_K: ile szablonów pobiera index.search (None = auto).
+GALLERY_MODE = "mean"
+GALLERY_AGGREGATION = "max"
+GALLERY_TOP_K = 3
+GALLERY_TEMPERATURE = 0.1
+GALLERY_TEMPLATE_SEARCH_K = None
 
 # --- Konfiguracja Ewaluacji ---
 RESULTS_CSV = "occlusion_results.csv"
-OCCLUSION_SIZE = 30
\ No newline at end of file
+RESULTS_CSV_UNCOMPRESSED = "occlusion_results_uncompressed.csv"
+OCCLUSION_SIZE = 30
+# Liczba najlepszych dopasowań zapisywanych do CSV (calculate_rank_k potrzebuje >= 3)
+SEARCH_K = 3
+# Ile zapytań zbieramy przed jednym wspólnym index.search
+SEARCH_BLOCK_SIZE = 1024
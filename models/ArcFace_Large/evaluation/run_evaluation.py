@@ -1,111 +1,46 @@
 import os
 import sys
-import glob
-import json
 import csv
 import random
 import numpy as np
-import cv2
 import faiss
-import insightface
 from tqdm import tqdm
 # Usunięto import GCS
+from models.embedder import create_embedder, mean_embedding, read_image_bytes, with_cache, discover_file_structure, read_annotation, occlusion_transform, embedding_params
+from models.gallery import BlockSearcher, results_header, build_index, describe_index, save_id_map
+from models.gallery import template_embeddings, save_template_owners, load_search_gallery
+from models.gallery import export_shards, write_result_rows
+from models.evaluate_calculate_metrics.calculate_rank_k import compare_rank_k
 from models.ArcFace_Large.evaluation.config import (
+    GALLERY_INDEX_TYPE, GALLERY_INDEX_OPTIONS, GALLERY_NPROBE, GALLERY_EF_SEARCH, GALLERY_SHARDS, GALLERY_SEARCH_NODES,
+    GALLERY_COMPRESSION, GALLERY_RERANK_K, RESULTS_CSV_UNCOMPRESSED,
+    GALLERY_MODE, GALLERY_AGGREGATION, GALLERY_TOP_K, GALLERY_TEMPERATURE, GALLERY_TEMPLATE_SEARCH_K,
     BASE_FOLDER_LOCAL, # Nowa zmienna
-    FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE
+    FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE, SEARCH_K, SEARCH_BLOCK_SIZE,
+    EMBEDDER_BACKEND, EMBEDDER_OPTIONS, EMBEDDING_CACHE_DIR
 )
 
 # --- 1. INICJALIZACJA MODELU ---
 
 def initialize_services():
-    """Ładuje model InsightFace."""
-    # Usunięto logikę GCS
-    print("Ładowanie modelu InsightFace (ArcFace)... (to może potrwać chwilę)")
+    """Ładuje embedder (domyślnie InsightFace ArcFace) ze wspólnego pakietu models.embedder."""
+    print(f"Ładowanie modelu ({EMBEDDER_BACKEND})... (to może potrwać chwilę)")
     try:
-        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-        model = insightface.app.FaceAnalysis(
-            name="buffalo_l", 
-            root='./insightface_models', 
-            providers=providers
-        )
-        # Ustaw (640, 640) dla datasetu testowego lub (112, 112) dla WebFace
-        model.prepare(ctx_id=0, det_size=(224,224))
+        model = with_cache(create_embedder(EMBEDDER_BACKEND, **EMBEDDER_OPTIONS), EMBEDDING_CACHE_DIR)
     except Exception as e:
-        print(f"BŁĄD: Nie udało się załadować modelu InsightFace.")
+        print(f"BŁĄD: Nie udało się załadować modelu {EMBEDDER_BACKEND}.")
         print(f"Error: {e}")
         sys.exit(1)
         
     print("Inicjalizacja zakończona pomyślnie.")
     return model
 
-def get_embedding(model, image_bgr):
-    """Pobiera embedding dla pojedynczego obrazu."""
-    try:
-        faces = model.get(image_bgr)
-        if faces and len(faces) > 0:
-            return faces[0].normed_embedding
-    except Exception as e:
-        print(f"Warning: Błąd podczas pobierania embeddingu: {e}")
-    return None
-
-# --- 2. NOWA FUNKCJA POMOCNICZA (WERSJA LOKALNA) ---
-
-def discover_file_structure(local_test_path):
-    """
-    Mapuje lokalną strukturę plików na logiczne foldery.
-    Zwraca te same słowniki co wersja GCS, ale z lokalnymi ścieżkami.
-    """
-    print(f"Wykrywanie struktury plików w {local_test_path}...")
-    
-    # Używamy glob do znalezienia wszystkich plików .jpg na odpowiedniej głębokości
-    # Wzór: local_test_path / [id_folder] / [img_folder] / [img.jpg]
-    search_pattern = os.path.join(local_test_path, "*", "*", "*.jpg")
-    all_jpg_files = list(glob.glob(search_pattern))
-    
-    if not all_jpg_files:
-        print("BŁĄD: Nie znaleziono ŻADNYCH plików .jpg pasujących do wzorca.")
-        print(f"Szukany wzorzec: {search_pattern}")
-        return None, None
-        
-    print(f"Znaleziono łącznie {len(all_jpg_files)} plików .jpg.")
-
-    identity_to_imgfolders = {} 
-    image_pairs = {}       
-
-    for jpg_path in tqdm(all_jpg_files, desc="Skanowanie plików"):
-        # Normalizuj ścieżki dla spójności
-        jpg_path_norm = os.path.normpath(jpg_path)
-        
-        # Sprawdź, czy istnieje pasujący plik .json
-        base_name = os.path.splitext(jpg_path_norm)[0]
-        json_path = base_name + ".json"
-        
-        if not os.path.exists(json_path):
-            #tqdm.write(f"Warning: Brak pliku .json dla {jpg_path_norm}")
-            continue # Pomiń, jeśli nie ma pary
-        
-        # Odtwórz ścieżki
-        image_folder_path = os.path.dirname(jpg_path_norm)
-        identity_path = os.path.dirname(image_folder_path)
-        
-        if identity_path not in identity_to_imgfolders:
-            identity_to_imgfolders[identity_path] = set()
-        
-        if image_folder_path not in image_pairs:
-            image_pairs[image_folder_path] = {'jpg': None, 'json': None}
-        
-        identity_to_imgfolders[identity_path].add(image_folder_path)
-        image_pairs[image_folder_path]['jpg'] = jpg_path_norm
-        image_pairs[image_folder_path]['json'] = json_path
-
-    print(f"Wykryto {len(identity_to_imgfolders)} folderów tożsamości z kompletnymi parami JPG/JSON.")
-    return identity_to_imgfolders, image_pairs
-
 # --- 3. BUDOWANIE GALERII FAISS (ZMODYFIKOWANE) ---
 
 def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
     """
-    Tworzy galerię FAISS z pierwszej połowy zdjęć dla każdego ID.
+    Tworzy galerię FAISS z pierwszej połowy zdjęć dla każdego ID: uśredniony wektor
+    albo (GALLERY_MODE = "templates") osobny wiersz na każde zdjęcie.
     """
     print(f"--- ROZPOCZYNAM Budowanie Galerii FAISS ---")
     
@@ -116,8 +51,7 @@ def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
         return False
     
     gallery_embeddings = []
-    index_to_id_map = {} 
-    faiss_index_counter = 0
+    gallery_labels = []
 
     for id_path in tqdm(identity_paths, desc="Tworzenie galerii ID"):
         identity_id = os.path.basename(id_path) # Pobiera 'id_3' ze ścieżki
@@ -130,7 +64,7 @@ def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
         if not gallery_folders:
             continue
 
-        id_embeddings = []
+        id_images = []
         for img_folder_path in gallery_folders:
             # Pobierz lokalną ścieżkę .jpg z naszej mapy
             local_path = image_pairs.get(img_folder_path, {}).get('jpg')
@@ -139,25 +73,26 @@ def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
                 tqdm.write(f"Warning: Wewnętrzny błąd mapowania dla {img_folder_path}")
                 continue
                 
-            # Nie pobieramy, tylko czytamy
-            img = cv2.imread(local_path)
-            if img is None:
+            # Nie pobieramy, tylko czytamy (surowe bajty - klucz cache embeddingów)
+            image_bytes = read_image_bytes(local_path)
+            if image_bytes is None:
                 tqdm.write(f"Warning: Błąd odczytu obrazu {local_path}")
                 continue
                 
-            embedding = get_embedding(model, img)
-            if embedding is not None:
-                id_embeddings.append(embedding)
-            
-            # Nie usuwamy pliku
+            id_images.append(image_bytes)
 
-        if id_embeddings:
-            avg_embedding = np.mean(id_embeddings, axis=0)
-            avg_embedding /= np.linalg.norm(avg_embedding) 
-            
-            gallery_embeddings.append(avg_embedding)
-            index_to_id_map[faiss_index_counter] = identity_id
-            faiss_index_counter += 1
+        if not id_images:
+            continue
+
+        # Wszystkie zdjęcia galerii danego ID liczymy jednym batchem (pomijając te z cache)
+        embeddings = model.embed_encoded(id_images)
+        if GALLERY_MODE == "templates":
+            identity_embedding = template_embeddings(embeddings)
+        else:
+            identity_embedding = mean_embedding(embeddings)
+        if identity_embedding is not None:
+            gallery_embeddings.append(identity_embedding)
+            gallery_labels.append(identity_id)
 
     print(f"Zakończono. Znaleziono {len(gallery_embeddings)} unikalnych tożsamości.")
     
@@ -165,56 +100,60 @@ def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
         print("BŁĄD: Galeria jest pusta, nie można zbudować indeksu FAISS.")
         return False
         
-    dimension = gallery_embeddings[0].shape[0] 
-    gallery_matrix = np.array(gallery_embeddings).astype('float32')
+    # Tryb "templates": wiersze to szablony kolejnych tożsamości (wektory 1-D trybu "mean" -> po jednym wierszu)
+    gallery_matrix = np.vstack(gallery_embeddings).astype('float32')
+    if GALLERY_MODE == "templates":
+        print(f"Galeria szablonów: {len(gallery_matrix)} zdjęć, agregacja '{GALLERY_AGGREGATION}'.")
     
-    index = faiss.IndexFlatIP(dimension)
-    index.add(gallery_matrix)
+    print(f"Budowanie indeksu galerii ({GALLERY_INDEX_TYPE})...")
+    try:
+        index = build_index(gallery_matrix, GALLERY_INDEX_TYPE, **GALLERY_INDEX_OPTIONS)
+    except ValueError as e:
+        print(f"BŁĄD: Nie można zbudować indeksu {GALLERY_INDEX_TYPE}: {e}")
+        return False
+    print(f"Indeks: {describe_index(index)}")
     
     print(f"Zapisywanie indeksu FAISS do {FAISS_INDEX_FILE}...")
     faiss.write_index(index, FAISS_INDEX_FILE)
+    if GALLERY_SHARDS:
+        print(f"Zapisywanie galerii w shardach do {GALLERY_SHARDS}...")
+        # Przy kompresji shardy służą do re-rankingu - muszą być dokładne (float32)
+        export_shards(index, GALLERY_SHARDS, "float32" if GALLERY_COMPRESSION else "float16")
     
     print(f"Zapisywanie mapowania ID do {FAISS_MAPPING_FILE}...")
-    with open(FAISS_MAPPING_FILE, 'w') as f:
-        json.dump(index_to_id_map, f)
+    save_id_map(FAISS_MAPPING_FILE, np.arange(len(gallery_labels)), gallery_labels)
+    if GALLERY_MODE == "templates":
+        # Wiersz indeksu -> ID tożsamości (numer w mapowaniu ID)
+        save_template_owners(FAISS_MAPPING_FILE, np.repeat(np.arange(len(gallery_labels)),
+                                                           [len(embeddings) for embeddings in gallery_embeddings]))
         
     return True
 
 # --- 4. TESTOWANIE Z OKLUZJĄ (ZMODYFIKOWANE) ---
 
-def apply_occlusion(image, landmarks_dict, bbox):
-    """Nakłada pasek okluzji na wysokości oczu o szerokości twarzy."""
-    occluded_image = image.copy()
-    try:
-        left_eye_y = landmarks_dict["left_eye"][1]
-        right_eye_y = landmarks_dict["right_eye"][1]
-        eye_y_center = int((left_eye_y + right_eye_y) / 2)
-        bar_height_half = OCCLUSION_SIZE // 2
-        face_x1 = int(bbox[0])
-        face_x2 = int(bbox[2])
-        x1 = face_x1
-        y1 = max(0, eye_y_center - bar_height_half)
-        x2 = face_x2
-        y2 = min(image.shape[0], eye_y_center + bar_height_half)
-        cv2.rectangle(occluded_image, (x1, y1), (x2, y2), (0, 0, 0), -1)
-    except Exception as e:
-        print(f"Warning: Błąd podczas nakładania okluzji (np. brak landmarków): {e}")
-        return image.copy() 
-    return occluded_image
-
 def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
     """
     Testuje drugą połowę zdjęć z okluzją i zapisuje wyniki do CSV.
     """
     print("Wczytywanie galerii FAISS i mapowania ID...")
     try:
-        index = faiss.read_index(FAISS_INDEX_FILE)
-        with open(FAISS_MAPPING_FILE, 'r') as f:
-            index_to_id_map = json.load(f)
+        index, baseline, service, id_map = load_search_gallery(
+            FAISS_INDEX_FILE, FAISS_MAPPING_FILE, GALLERY_SHARDS, GALLERY_SEARCH_NODES, GALLERY_NPROBE,
+            GALLERY_EF_SEARCH, GALLERY_COMPRESSION, GALLERY_RERANK_K, GALLERY_MODE, GALLERY_AGGREGATION,
+            GALLERY_TOP_K, GALLERY_TEMPERATURE, GALLERY_TEMPLATE_SEARCH_K
+        )
+    except ValueError as e: # Niezgodna konfiguracja galerii
+        print(f"BŁĄD: {e}.")
+        return
     except Exception as e:
         print(f"BŁĄD: Nie udało się wczytać plików FAISS. Uruchom najpierw budowanie galerii.")
         print(f"Error: {e}")
         return
+    if service is not None:
+        print(f"Przeszukiwanie galerii w {GALLERY_SEARCH_NODES} procesach ({service.ntotal} wektorów).")
+    if baseline is not None:
+        compressed = index.index if GALLERY_MODE == "templates" else index
+        print(f"Galeria skompresowana - {compressed.describe()}")
 
     print(f"Rozpoczynanie ewaluacji z okluzją. Wyniki w {RESULTS_CSV}...")
     
@@ -227,9 +166,30 @@ def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
     os.makedirs(output_occlusion_dir, exist_ok=True)
     print(f"Obrazy z okluzją będą zapisywane w: {output_occlusion_dir}")
     
+    searcher = BlockSearcher(index, SEARCH_K, SEARCH_BLOCK_SIZE)
+    baseline_searcher = None
+    if baseline is not None:
+        baseline_searcher = BlockSearcher(baseline, SEARCH_K, SEARCH_BLOCK_SIZE)
+        baseline_file = open(RESULTS_CSV_UNCOMPRESSED, 'w', newline='', encoding='utf-8')
+        baseline_writer = csv.writer(baseline_file)
+        baseline_writer.writerow(results_header(SEARCH_K))
+
     with open(RESULTS_CSV, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(["query_id", "top1_id", "top1_similarity", "top2_id", "top2_similarity", "top3_id", "top3_similarity", "is_correct_top1"])
+        writer.writerow(results_header(SEARCH_K))
+
+        def write_results(results):
+            """4. Zapisz wyniki przeszukanego bloku."""
+            nonlocal total_queries, correct_top1
+            # ID FAISS -> nazwy tożsamości dla całego bloku naraz
+            correct_top1 += write_result_rows(writer, results, id_map)
+            total_queries += len(results)
+
+        def search(ground_truth_id, query_embedding):
+            """Dodaje zapytanie do bloku (i do bloku galerii bez kompresji, jeśli porównujemy)."""
+            write_results(searcher.add(ground_truth_id, query_embedding))
+            if baseline_searcher is not None:
+                write_result_rows(baseline_writer, baseline_searcher.add(ground_truth_id, query_embedding), id_map)
         
         for id_path in tqdm(identity_paths, desc="Testowanie okluzji"):
             ground_truth_id = os.path.basename(id_path)
@@ -248,64 +208,36 @@ def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
                     tqdm.write(f"Warning: Wewnętrzny błąd mapowania dla {img_folder_path}")
                     continue
                 
-                # Nie pobieramy, tylko czytamy
-                img = cv2.imread(local_img_path)
-                json_data = None
-                try:
-                    with open(local_json_path, 'r') as jf:
-                        json_data = json.load(jf)
-                except Exception as e:
-                    tqdm.write(f"Warning: Błąd odczytu JSON {local_json_path}: {e}")
-                    img = None 
+                # Nie pobieramy, tylko czytamy (surowe bajty - klucz cache embeddingów)
+                image_bytes = read_image_bytes(local_img_path)
+                json_data = read_annotation(local_json_path)
                 
-                if (img is None or json_data is None or 
+                if (image_bytes is None or json_data is None or 
                     "landmarks" not in json_data or "bbox" not in json_data):
                     tqdm.write(f"Warning: Brak pełnych danych (JPG/JSON/Landmarks/BBox) dla {local_img_path}")
                     continue
 
-                # 1. Nałóż okluzję
-                occluded_img = apply_occlusion(img, json_data["landmarks"], json_data["bbox"])
-                
-                try:
-                    original_filename = os.path.basename(local_img_path)
-                    save_path = os.path.join(output_occlusion_dir, f"occluded_{ground_truth_id}_{original_filename}")
-                    cv2.imwrite(save_path, occluded_img)
-                except Exception as e:
-                    tqdm.write(f"Warning: Nie udało się zapisać obrazu okluzji {save_path}: {e}")
-                
-                # 2. Pobierz embedding
-                query_embedding = get_embedding(model, occluded_img)
+                # 1. Nałóż okluzję i 2. pobierz embedding
+                # (przy trafieniu w cache obraz nie jest nawet dekodowany)
+                original_filename = os.path.basename(local_img_path)
+                save_path = os.path.join(output_occlusion_dir, f"occluded_{ground_truth_id}_{original_filename}")
+                query_embedding = model.embed_encoded(
+                    [image_bytes],
+                    params=embedding_params(OCCLUSION_SIZE),
+                    transform=occlusion_transform([json_data], OCCLUSION_SIZE, [save_path])
+                )[0]
                 
-                if query_embedding is None:
+                if np.isnan(query_embedding).any():
                     continue 
                     
-                # 3. Przeszukaj FAISS
-                query_embedding_normalized = query_embedding / np.linalg.norm(query_embedding)
-                query_vector = np.expand_dims(query_embedding_normalized, axis=0).astype('float32')
-                
-                D, I = index.search(query_vector, 3) # Szukaj Top 3
-                
-                top1_idx = I[0][0]
-                top2_idx = I[0][1]
-                top3_idx = I[0][2]
-                
-                top1_sim = D[0][0]
-                top2_sim = D[0][1]
-                top3_sim = D[0][2]
-                
-                top1_id = index_to_id_map.get(str(top1_idx), "N/A")
-                top2_id = index_to_id_map.get(str(top2_idx), "N/A")
-                top3_id = index_to_id_map.get(str(top3_idx), "N/A")
-                
-                # 4. Zapisz wyniki
-                is_correct = (top1_id == ground_truth_id)
-                writer.writerow([ground_truth_id, top1_id, f"{top1_sim:.4f}", top2_id, f"{top2_sim:.4f}", top3_id, f"{top3_sim:.4f}", is_correct])
-                
-                if is_correct:
-                    correct_top1 += 1
-                total_queries += 1
+                # 3. Przeszukaj FAISS - zapytania czekają w bloku na jedno wspólne index.search
+                search(ground_truth_id, query_embedding)
 
-                # Nie ma potrzeby sprzątania plików
+        # Ostatni, niepełny blok
+        write_results(searcher.flush())
+        if baseline_searcher is not None:
+            write_result_rows(baseline_writer, baseline_searcher.flush(), id_map)
+            baseline_file.close()
 
     if total_queries > 0:
         accuracy = (correct_top1 / total_queries) * 100
@@ -317,6 +249,16 @@ def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
         print("\n--- Ewaluacja Zakończona ---")
         print("Nie przetworzono żadnych zapytań.")
 
+    if baseline_searcher is not None:
+        print(f"\n--- Kompresja galerii: {GALLERY_COMPRESSION} (re-ranking top-{GALLERY_RERANK_K}) ---")
+        print(f"Czas przeszukiwania: {searcher.search_seconds:.3f}s, bez kompresji {baseline_searcher.search_seconds:.3f}s "
+              f"(przyspieszenie x{baseline_searcher.search_seconds / max(searcher.search_seconds, 1e-9):.2f})")
+        compare_rank_k(RESULTS_CSV_UNCOMPRESSED, RESULTS_CSV)
+
+    if service is not None:
+        print(service.report())
+        service.close()
+
 # --- 5. GŁÓWNA FUNKCJA URUCHAMIAJĄCA (ZMODYFIKOWANA) ---
 
 def main():
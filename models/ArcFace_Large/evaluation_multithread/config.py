@@ -4,9 +4,64 @@ import os
 BASE_FOLDER_LOCAL = "webface_112x112" 
 
 # --- Ustawienia Równoległości ---
-# Ustaw na liczbę rdzeni CPU (lub więcej, jeśli masz szybki dysk NVMe)
-NUM_WORKERS = os.cpu_count() or 4
+# Liczba wątków sesji ONNX / TF w każdym procesie z modelem.
+# NUM_WORKERS * INTRA_OP_THREADS nie powinno przekraczać liczby rdzeni.
+INTRA_OP_THREADS = 1
+# Liczba procesów z modelem (każdy ładuje własną kopię modelu)
+NUM_WORKERS = max(1, (os.cpu_count() or 4) // INTRA_OP_THREADS)
+# True: ProcessEmbeddingEngine (pula procesów, wyniki przez pamięć współdzieloną).
+# False: jeden model w procesie głównym (np. przy pracy na GPU).
+USE_PROCESS_ENGINE = True
+
+# --- Potok etapów (models.pipeline) ---
+# Wątki na etap. Przy USE_PROCESS_ENGINE odczyt, okluzja i model działają w procesach,
+# a w procesie głównym zostają tylko "search" i zapis do CSV.
+PIPELINE_WORKERS = {"read": 4, "preprocess": NUM_WORKERS, "infer": 1, "search": 2}
+# Maksymalna liczba porcji (batchy) w kolejce przed każdym etapem
+PIPELINE_QUEUE_SIZE = 8
+# Co ile sekund wypisywać przepustowość i kolejki etapów (None = tylko podsumowanie)
+PIPELINE_REPORT_INTERVAL = 30
+
+# --- Konfiguracja Modelu (models.embedder) ---
+EMBEDDER_BACKEND = "arcface"
+# 'buffalo_s' jest bardziej stabilny; det_size (112, 112) pasuje do WebFace.
+# mode="detect" to dawne FaceAnalysis.get (zdjęcia bez wykrytej twarzy nie dostają embeddingu).
+# mode="aligned" pomija detektor (zdjęcia WebFace są już wycięte i wyrównane) i liczy embeddingi
+# w batchach po batch_size - szybciej, ale każde zdjęcie dostaje embedding, a det_size jest
+# ignorowane, więc wyniki nie są porównywalne z trybem "detect" (inny klucz cache).
+EMBEDDER_OPTIONS = {"model_name": "buffalo_s", "det_size": (112, 112), "mode": "detect", "batch_size": 128}
+# Czy w trybie "aligned" wyrównywać twarz landmarkami z plików .json (s_03_process)
+ALIGN_WITH_LANDMARKS = False
+
+# Cache embeddingów na dysku (klucz: hash JPEG + model + parametry okluzji).
+# Obrazy z cache nie są dekodowane, więc podglądy w occlusion_photos powstają tylko dla
+# nowo liczonych zdjęć. Ustaw None, aby zawsze liczyć od zera.
+EMBEDDING_CACHE_DIR = "embedding_cache"
 
 # --- Konfiguracja FAISS & Galerii ---
 FAISS_INDEX_FILE = "gallery.index"
-# ... (reszta pliku bez zmian) ...
\ No newline at end of file
+# Mapowanie ID FAISS -> nazwa tożsamości: <FAISS_MAPPING_FILE>_ids.npy i _labels.npy
+# (models.gallery.id_map, wczytywane przez memmap). Stary plik .json też jest obsługiwany.
+FAISS_MAPPING_FILE = "gallery_id_map"
+
+# Typ indeksu galerii (models.gallery.INDEX_TYPES): "flat" (dokładny IndexFlatIP), "hnsw",
+# "ivf_flat", "ivf_pq" lub "sq". Opcje budowy: nlist, pq_m, pq_bits, hnsw_m, ef_construction.
+GALLERY_INDEX_TYPE = "flat"
+GALLERY_INDEX_OPTIONS = {}
+# Parametry przeszukiwania: nprobe (IVF) i efSearch (HNSW) - więcej = dokładniej, ale wolniej
+GALLERY_NPROBE = 16
+GALLERY_EF_SEARCH = 64
+# Stan galerii przyrostowej (models.gallery.Gallery): <GALLERY_BASE>.index (= FAISS_INDEX_FILE),
+# _ids.npy, _labels.npy, _sums.npy, _counts.npy i _state.json.
+# enroll_gallery.py dopisuje / podmienia / usuwa pojedyncze ID bez przebudowy całej galerii.
+GALLERY_BASE = os.path.splitext(FAISS_INDEX_FILE)[0]
+# Raport delty Rank-1 względem IndexFlatIP (tylko dla GALLERY_INDEX_TYPE innego niż "flat")
+COMPARE_WITH_FLAT = True
+
+# --- Konfiguracja Ewaluacji ---
+RESULTS_CSV = "occlusion_results.csv"
+OCCLUSION_SIZE = 30
+# Liczba najlepszych dopasowań zapisywanych do CSV (calculate_rank_k potrzebuje >= 3)
+SEARCH_K = 3
+# Ile zapytań przeszukujemy jednym index.search (porcja zapytań w potoku)
+SEARCH_BLOCK_SIZE = 1024
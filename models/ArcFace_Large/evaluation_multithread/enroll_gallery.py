@@ -0,0 +1,63 @@
+import os
+import sys
+from models.gallery import Gallery
+from models.ArcFace_Large.evaluation_multithread.config import GALLERY_BASE
+from models.ArcFace_Large.evaluation_multithread.run_evaluation_multithread import (
+    initialize_services, discover_file_structure, embed_gallery_identities, save_gallery
+)
+
+# Przyrostowa aktualizacja galerii zbudowanej przez run_evaluation_multithread.py.
+# Liczone są tylko zdjęcia podanych ID (pierwsza połowa zdjęć, jak przy budowie galerii):
+#   python -m models.ArcFace_Large.evaluation_multithread.enroll_gallery add <folder ID> [...]
+#   python -m models.ArcFace_Large.evaluation_multithread.enroll_gallery replace <folder ID> [...]
+#   python -m models.ArcFace_Large.evaluation_multithread.enroll_gallery remove <ID> [...]
+# add dopisuje zdjęcia do istniejącego ID (albo dodaje nowe ID), replace je podmienia.
+COMMANDS = ("add", "replace", "remove")
+
+
+def enroll(gallery, identity_paths, replace=False):
+    """Liczy embeddingi galerii dla podanych folderów ID i aktualizuje ich wpisy."""
+    identity_to_imgfolders, image_pairs = discover_file_structure(identity_paths=identity_paths)
+    if not identity_to_imgfolders:
+        return False
+
+    model = initialize_services()
+    try:
+        found_paths = list(identity_to_imgfolders.keys())
+        id_sums, id_counts = embed_gallery_identities(model, found_paths, identity_to_imgfolders, image_pairs,
+                                                      desc="Aktualizacja galerii (obrazy)")
+    finally:
+        model.close()
+
+    identity_ids = [os.path.basename(id_path) for id_path in found_paths]
+    gallery.update(identity_ids, id_sums, id_counts, replace=replace)
+    print(f"{'Podmieniono' if replace else 'Dopisano'} {sum(1 for count in id_counts if count)} tożsamości.")
+    return True
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in COMMANDS:
+        print(f"Użycie: python -m models.ArcFace_Large.evaluation_multithread.enroll_gallery "
+              f"{{{'|'.join(COMMANDS)}}} <folder ID albo ID> [...]")
+        sys.exit(1)
+    command, targets = sys.argv[1], sys.argv[2:]
+
+    if not Gallery.exists(GALLERY_BASE):
+        print(f"BŁĄD: Nie znaleziono galerii {GALLERY_BASE}. Uruchom najpierw 'run_evaluation_multithread.py'.")
+        sys.exit(1)
+    gallery = Gallery.load(GALLERY_BASE)
+    print(f"Wczytano galerię: {len(gallery)} tożsamości.")
+
+    if command == "remove":
+        removed = gallery.remove(targets)
+        print(f"Usunięto {removed} z {len(targets)} tożsamości.")
+    elif not enroll(gallery, [os.path.normpath(path) for path in targets], replace=(command == "replace")):
+        print("Zatrzymanie, nie znaleziono plików.")
+        return
+
+    save_gallery(gallery)
+    print(f"Galeria: {len(gallery)} tożsamości. Gotowe.")
+
+
+if __name__ == "__main__":
+    main()
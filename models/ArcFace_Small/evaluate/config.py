@@ -5,12 +5,48 @@ import os
 BASE_FOLDER_LOCAL = "../../scripts/casia_dataset/webface_112x112" 
 # Możesz też ustawić pełną ścieżkę, np. "C:/Users/User/Projekty/webface_112x112"
 
+# --- Konfiguracja Modelu (models.embedder) ---
+EMBEDDER_BACKEND = "arcface"
+EMBEDDER_OPTIONS = {"model_name": "buffalo_s", "det_size": (112, 112)} # Dla WebFace
+
+# Cache embeddingów na dysku (klucz: hash JPEG + model + parametry okluzji).
+# Obrazy z cache nie są dekodowane, więc podglądy w occlusion_photos powstają tylko dla
+# nowo liczonych zdjęć. Ustaw None, aby zawsze liczyć od zera.
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
 # --- Konfiguracja FAISS & Galerii ---
 FAISS_INDEX_FILE = "gallery.index"
-FAISS_MAPPING_FILE = "gallery_id_map.json"
+# Mapowanie ID FAISS -> nazwa tożsamości: <FAISS_MAPPING_FILE>_ids.npy i _labels.npy
+# (models.gallery.id_map, wczytywane przez memmap). Stary plik .json też jest obsługiwany.
+FAISS_MAPPING_FILE = "gallery_id_map"
+
+# Galeria w shardach mapowanych z dysku (models.gallery.shards) dla galerii większych niż RAM,
+# np. "gallery_shards". None = wektory z FAISS_INDEX_FILE (cała galeria w pamięci).
+# Z istniejącego indeksu: python -m models.gallery.build_shards gallery.index gallery_shards float16
+GALLERY_SHARDS = None
 
 # --- Konfiguracja Ewaluacji ---
 RESULTS_CSV = "occlusion_results.csv"
 OCCLUSION_SIZE = 30
 
-NUM_WORKERS = 4
\ No newline at end of file
+NUM_WORKERS = 4
+
+# --- Konfiguracja Weryfikacji 1:1 ---
+# Wyniki par w formacie kolumnowym: <VERIFICATION_SCORES>.json (nagłówek),
+# .f32 (score) i .bits (bitmapa etykiet) - patrz evaluate_calculate_metrics/score_format.py
+VERIFICATION_SCORES = "verification_scores"
+# Ile zapytań naraz mnożymy przez całą galerię (jeden GEMM na blok)
+VERIFICATION_BLOCK_SIZE = 1024
+
+# Próbkowanie par imposter zamiast zapytanie x cała galeria (Q x N par):
+#   "all"        - wszystkie pary (dokładnie, bez wag),
+#   "fixed"      - IMPOSTERS_PER_QUERY losowych imposterów na zapytanie,
+#   "hard"       - VERIFICATION_HARD_K najbliższych imposterów z indeksu FAISS + IMPOSTERS_PER_QUERY losowych,
+#   "stratified" - IMPOSTERS_PER_QUERY losowań w każdym przedziale wyniku (granice VERIFICATION_STRATA).
+# Tryby próbkujące zapisują wagi par (.w32), dzięki którym calculate_metrics.py szacuje
+# metryki (TAR@FAR, ROC-AUC) dla wszystkich par bez obciążenia.
+VERIFICATION_SAMPLING = "all"
+IMPOSTERS_PER_QUERY = 100
+VERIFICATION_HARD_K = 10
+VERIFICATION_STRATA = [0.0, 0.1, 0.2, 0.3, 0.4]
+VERIFICATION_SEED = 0
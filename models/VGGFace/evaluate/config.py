@@ -6,11 +6,88 @@ BASE_FOLDER_LOCAL = "../../scripts/casia_dataset/webface_112x112"
 # --- Ustawienia Równoległości ---
 # Ustaw na liczbę rdzeni CPU (lub więcej, jeśli masz szybki dysk NVMe)
 NUM_WORKERS = os.cpu_count() or 4
+# Długość kolejek między etapami potoku (models.pipeline) - ogranicza zadania i wyniki w pamięci
+PIPELINE_QUEUE_SIZE = 8
+
+# --- Konfiguracja Modelu (models.embedder) ---
+EMBEDDER_BACKEND = "vggface"
+# batch_size / batch_wait (s): dynamiczne batchowanie obrazów z NUM_WORKERS wątków
+# (jedno wywołanie MTCNN i modelu na batch), np. {"model": "resnet50", "batch_size": 64, "batch_wait": 0.01}
+EMBEDDER_OPTIONS = {"model": "resnet50"}
+
+# Cache embeddingów na dysku (klucz: hash JPEG + model + parametry okluzji).
+# Obrazy z cache nie są dekodowane, więc podglądy w occlusion_photos powstają tylko dla
+# nowo liczonych zdjęć. Ustaw None, aby zawsze liczyć od zera.
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+# Projekcja embeddingów 2048-d przed indeksowaniem i zapytaniami (models.embedder.PROJECTIONS):
+# "pca", "pca_whiten" (PCA z wybielaniem) lub "random" (losowa rotacja + obcięcie) do PROJECTION_DIM
+# wymiarów. None = pełne 2048-d. run_eval.py dopasowuje ją na PROJECTION_TRAIN_IMAGES losowych
+# zdjęciach z podziału train i zapisuje w PROJECTION_FILE (obok FAISS_INDEX_FILE); run_ver.py ją wczytuje.
+# Wpływ na celność / czas: calculate_rank_k.py --compare (CSV bez projekcji) i calculate_metrics.py.
+PROJECTION = None
+PROJECTION_DIM = 256
+PROJECTION_FILE = "gallery_vgg.projection"
+PROJECTION_TRAIN_IMAGES = 5000
 
 # --- Konfiguracja FAISS & Galerii ---
 FAISS_INDEX_FILE = "gallery_vgg.index" # Nowa nazwa, żeby nie pomylić
-FAISS_MAPPING_FILE = "gallery_id_map_vgg.json" # Nowa nazwa
+# Mapowanie ID FAISS -> nazwa tożsamości: <FAISS_MAPPING_FILE>_ids.npy i _labels.npy
+# (models.gallery.id_map, wczytywane przez memmap). Stary plik .json też jest obsługiwany.
+FAISS_MAPPING_FILE = "gallery_id_map_vgg" # Nowa nazwa
+
+# Typ indeksu galerii (models.gallery.INDEX_TYPES): "flat" (dokładny IndexFlatIP), "hnsw",
+# "ivf_flat", "ivf_pq" lub "sq". Opcje budowy: nlist, pq_m, pq_bits, hnsw_m, ef_construction.
+GALLERY_INDEX_TYPE = "flat"
+GALLERY_INDEX_OPTIONS = {}
+# Parametry przeszukiwania: nprobe (IVF) i efSearch (HNSW) - więcej = dokładniej, ale wolniej
+GALLERY_NPROBE = 16
+GALLERY_EF_SEARCH = 64
+
+# Wczytywanie galerii do przeszukiwania: models.gallery.load_search_gallery (opis opcji w loading.py).
+# Shardy mapowane z dysku, np. "gallery_vgg_shards" (None = cała galeria z FAISS_INDEX_FILE w pamięci);
+# z istniejącego indeksu: python -m models.gallery.build_shards gallery_vgg.index gallery_vgg_shards float16
+# (float32, gdy ustawione jest GALLERY_COMPRESSION - shardy służą wtedy do dokładnego re-rankingu).
+GALLERY_SHARDS = None
+# Liczba procesów przeszukujących shardy (0 = w tym procesie). Wymaga GALLERY_SHARDS.
+GALLERY_SEARCH_NODES = 0
+# "float16", "int8", "binary" albo None. Przy kompresji te same zapytania przeszukuje też galeria
+# bez kompresji (RESULTS_CSV_UNCOMPRESSED) - raport: pamięć, czas i zmiana Rank-1/Rank-3.
+GALLERY_COMPRESSION = None
+GALLERY_RERANK_K = 50
+# "mean" albo "templates"; agregacja szablonów: "max", "mean_top_k" (GALLERY_TOP_K) lub "softmax"
+# (GALLERY_TEMPERATURE). GALLERY_TEMPLATE_SEARCH_K: ile szablonów pobiera index.search (None = auto).
+GALLERY_MODE = "mean"
+GALLERY_AGGREGATION = "max"
+GALLERY_TOP_K = 3
+GALLERY_TEMPERATURE = 0.1
+GALLERY_TEMPLATE_SEARCH_K = None
 
 # --- Konfiguracja Ewaluacji ---
 RESULTS_CSV = "occlusion_results_vgg.csv" # Nowa nazwa
+RESULTS_CSV_UNCOMPRESSED = "occlusion_results_vgg_uncompressed.csv"
 OCCLUSION_SIZE = 30
+# Liczba najlepszych dopasowań zapisywanych do CSV (calculate_rank_k potrzebuje >= 3)
+SEARCH_K = 3
+# Ile zapytań zbieramy przed jednym wspólnym index.search
+SEARCH_BLOCK_SIZE = 1024
+
+# --- Konfiguracja Weryfikacji 1:1 ---
+# Wyniki par w formacie kolumnowym: <VERIFICATION_SCORES>.json (nagłówek),
+# .f32 (score) i .bits (bitmapa etykiet) - patrz evaluate_calculate_metrics/score_format.py
+VERIFICATION_SCORES = "verification_scores"
+# Ile zapytań naraz mnożymy przez całą galerię (jeden GEMM na blok)
+VERIFICATION_BLOCK_SIZE = 1024
+
+# Próbkowanie par imposter zamiast zapytanie x cała galeria (Q x N par):
+#   "all"        - wszystkie pary (dokładnie, bez wag),
+#   "fixed"      - IMPOSTERS_PER_QUERY losowych imposterów na zapytanie,
+#   "hard"       - VERIFICATION_HARD_K najbliższych imposterów z indeksu FAISS + IMPOSTERS_PER_QUERY losowych,
+#   "stratified" - IMPOSTERS_PER_QUERY losowań w każdym przedziale wyniku (granice VERIFICATION_STRATA).
+# Tryby próbkujące zapisują wagi par (.w32), dzięki którym calculate_metrics.py szacuje
+# metryki (TAR@FAR, ROC-AUC) dla wszystkich par bez obciążenia.
+VERIFICATION_SAMPLING = "all"
+IMPOSTERS_PER_QUERY = 100
+VERIFICATION_HARD_K = 10
+VERIFICATION_STRATA = [0.0, 0.1, 0.2, 0.3, 0.4]
+VERIFICATION_SEED = 0
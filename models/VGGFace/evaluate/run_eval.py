@@ -1,161 +1,81 @@
 import os
 import sys
-import glob
-import json
 import csv
 import random
 import numpy as np
-import cv2
 import faiss
 from tqdm import tqdm
-import threading # Ważne dla bezpieczeństwa GPU
 
-# Importy dla VGGFace
-import tensorflow as tf
-from keras_vggface.vggface import VGGFace
-from keras_vggface.utils import preprocess_input
-from mtcnn.mtcnn import MTCNN
-
-# Importy dla wielowątkowości
-from concurrent.futures import ThreadPoolExecutor, as_completed 
-from config import (
+from models.embedder import create_embedder, mean_embedding, read_image_bytes, with_cache, discover_file_structure, read_annotation, occlusion_transform, embedding_params
+from models.embedder import with_projection, fit_projection, save_projection, list_split_images
+from models.gallery import BlockSearcher, results_header, build_index, describe_index, save_id_map
+from models.gallery import template_embeddings, save_template_owners, load_search_gallery
+from models.gallery import export_shards, write_result_rows
+from models.pipeline import Stage, Pipeline
+from models.evaluate_calculate_metrics.calculate_rank_k import compare_rank_k
+from models.VGGFace.evaluate.config import (
+    GALLERY_INDEX_TYPE, GALLERY_INDEX_OPTIONS, GALLERY_NPROBE, GALLERY_EF_SEARCH, GALLERY_SHARDS, GALLERY_SEARCH_NODES,
+    GALLERY_COMPRESSION, GALLERY_RERANK_K, RESULTS_CSV_UNCOMPRESSED,
+    GALLERY_MODE, GALLERY_AGGREGATION, GALLERY_TOP_K, GALLERY_TEMPERATURE, GALLERY_TEMPLATE_SEARCH_K,
     BASE_FOLDER_LOCAL, 
-    FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE,
-    NUM_WORKERS
+    FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE, SEARCH_K, SEARCH_BLOCK_SIZE,
+    NUM_WORKERS, PIPELINE_QUEUE_SIZE, EMBEDDER_BACKEND, EMBEDDER_OPTIONS, EMBEDDING_CACHE_DIR,
+    PROJECTION, PROJECTION_DIM, PROJECTION_FILE, PROJECTION_TRAIN_IMAGES
 )
 
 # --- 1. INICJALIZACJA MODELU (NOWA) ---
 
 def initialize_services():
-    """Ładuje modele VGGFace, MTCNN i tworzy blokadę GPU."""
-    
-    # Upewnij się, że TF widzi GPU
-    gpus = tf.config.experimental.list_physical_devices('GPU')
-    if gpus:
-        try:
-            for gpu in gpus:
-                tf.config.experimental.set_memory_growth(gpu, True)
-            print(f"Znaleziono i skonfigurowano {len(gpus)} kart GPU.")
-        except RuntimeError as e:
-            print(e)
-    else:
-        print("OSTRZEŻENIE: Nie znaleziono GPU. Skrypt będzie działał bardzo wolno na CPU.")
-
-    print("Ładowanie detektora MTCNN... (to może potrwać chwilę)")
-    try:
-        detector = MTCNN()
-    except Exception as e:
-        print(f"BŁĄD: Nie udało się załadować detektora MTCNN: {e}")
-        sys.exit(1)
-
-    print("Ładowanie modelu VGGFace (RESNET-50)... (to może potrwać chwilę)")
+    """Ładuje embedder VGGFace (MTCNN + RESNET-50) ze wspólnego pakietu models.embedder."""
     try:
-        # Ładujemy model RESNET-50, bez górnych warstw klasyfikacyjnych
-        # 'pooling="avg"' da nam gotowy wektor cech
-        vgg_model = VGGFace(model='resnet50', 
-                            include_top=False, 
-                            input_shape=(224, 224, 3), 
-                            pooling='avg')
+        model = with_cache(create_embedder(EMBEDDER_BACKEND, **EMBEDDER_OPTIONS), EMBEDDING_CACHE_DIR)
     except Exception as e:
-        print(f"BŁĄD: Nie udało się załadować modelu VGGFace: {e}")
+        print(f"BŁĄD: Nie udało się załadować modelu {EMBEDDER_BACKEND}: {e}")
         sys.exit(1)
         
-    # Tworzymy blokadę, aby chronić Keras/GPU przed jednoczesnym dostępem
-    gpu_lock = threading.Lock()
-    
     print("Inicjalizacja zakończona pomyślnie.")
-    return vgg_model, detector, gpu_lock
+    return model
 
-def get_embedding(image_bgr, vgg_model, detector, gpu_lock):
+def fit_embedding_projection(model):
     """
-    Pobiera embedding (2048-d) dla pojedynczego obrazu używając MTCNN i VGGFace.
-    Jest to funkcja "thread-safe" dzięki blokadzie.
+    Dopasowuje projekcję PROJECTION na embeddingach losowych zdjęć z podziału train
+    (inne tożsamości niż w teście), zapisuje ją do PROJECTION_FILE i zwraca embedder z projekcją.
     """
+    train_dir = os.path.join(BASE_FOLDER_LOCAL, "train")
+    train_files = list_split_images(train_dir) if os.path.isdir(train_dir) else []
+    if not train_files:
+        print(f"BŁĄD: Brak zdjęć do dopasowania projekcji w {train_dir}")
+        return None
+    train_files = random.Random(0).sample(train_files, min(PROJECTION_TRAIN_IMAGES, len(train_files)))
+
+    embeddings = []
+    for start in tqdm(range(0, len(train_files), model.batch_size), desc=f"Embeddingi train ({PROJECTION})"):
+        images = [read_image_bytes(path) for path in train_files[start:start + model.batch_size]]
+        embeddings.append(model.embed_encoded([image for image in images if image is not None]))
     try:
-        img_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-        
-        detections = []
-        embedding = None
-        
-        # --- SEKCJA KRYTYCZNA (chroniona blokadą) ---
-        # MTCNN i Keras.predict NIE SĄ bezpieczne dla wątków.
-        # Tylko jeden wątek na raz może wykonywać ten blok.
-        with gpu_lock:
-            # Krok 1: Detekcja twarzy
-            detections = detector.detect_faces(img_rgb)
-            
-            if not detections:
-                return None # Nie znaleziono twarzy
-                
-            # Bierzemy pierwszą, największą twarz
-            x, y, w, h = detections[0]['box']
-            x1, y1 = max(0, x), max(0, y)
-            x2, y2 = min(img_rgb.shape[1], x+w), min(img_rgb.shape[0], y+h)
-            
-            face = img_rgb[y1:y2, x1:x2]
-            
-            # Krok 2: Skalowanie i preprocessing
-            face = cv2.resize(face, (224, 224))
-            face = np.expand_dims(face, axis=0) # (1, 224, 224, 3)
-            face = face.astype('float32') 
-            face = preprocess_input(face, version=2) # Wersja 2 dla RESNET/SENET
-            
-            # Krok 3: Ekstrakcja embeddingu
-            embedding = vgg_model.predict(face, verbose=0)
-        # --- KONIEC SEKCJI KRYTYCZNEJ ---
-            
-        return embedding.flatten() # Zwracamy wektor 1D (2048 wymiarów)
-        
-    except Exception as e:
-        tqdm.write(f"Warning: Błąd podczas pobierania embeddingu (VGGFace): {e}")
-    return None
+        transform = fit_projection(np.vstack(embeddings), PROJECTION, PROJECTION_DIM)
+    except ValueError as e:
+        print(f"BŁĄD: Nie można dopasować projekcji: {e}")
+        return None
 
-# --- 2. FUNKCJA POMOCNICZA (BEZ ZMIAN) ---
-
-def discover_file_structure(local_test_path):
-    """Mapuje lokalną strukturę plików."""
-    print(f"Wykrywanie struktury plików w {local_test_path}...")
-    search_pattern = os.path.join(local_test_path, "*", "*", "*.jpg")
-    all_jpg_files = list(glob.glob(search_pattern))
-    
-    if not all_jpg_files:
-        print(f"BŁĄD: Nie znaleziono plików .jpg: {search_pattern}")
-        return None, None
-        
-    print(f"Znaleziono łącznie {len(all_jpg_files)} plików .jpg.")
-    identity_to_imgfolders = {} 
-    image_pairs = {}       
-
-    for jpg_path in tqdm(all_jpg_files, desc="Skanowanie plików"):
-        jpg_path_norm = os.path.normpath(jpg_path)
-        base_name = os.path.splitext(jpg_path_norm)[0]
-        json_path = base_name + ".json"
-        
-        if not os.path.exists(json_path):
-            continue 
-        
-        image_folder_path = os.path.dirname(jpg_path_norm)
-        identity_path = os.path.dirname(image_folder_path)
-        
-        if identity_path not in identity_to_imgfolders:
-            identity_to_imgfolders[identity_path] = set()
-        if image_folder_path not in image_pairs:
-            image_pairs[image_folder_path] = {'jpg': None, 'json': None}
-        
-        identity_to_imgfolders[identity_path].add(image_folder_path)
-        image_pairs[image_folder_path]['jpg'] = jpg_path_norm
-        image_pairs[image_folder_path]['json'] = json_path
-
-    print(f"Wykryto {len(identity_to_imgfolders)} folderów tożsamości z parami JPG/JSON.")
-    return identity_to_imgfolders, image_pairs
+    print(f"Projekcja {PROJECTION}: {transform.d_in} -> {transform.d_out} wymiarów "
+          f"(dopasowana na {len(train_files)} zdjęciach train), zapis do {PROJECTION_FILE}.")
+    save_projection(transform, PROJECTION_FILE)
+    return with_projection(model, transform)
 
 # --- 3. POMOCNIK GALERII (RÓWNOLEGŁY) ---
 
+def split_query_folders(identity_to_imgfolders, id_path):
+    """Foldery zdjęć zapytań ID - druga połowa posortowanych folderów (pierwsza to galeria)."""
+    image_folder_paths = sorted(identity_to_imgfolders[id_path])
+    return image_folder_paths[max(1, len(image_folder_paths) // 2):]
+
 def process_identity_for_gallery(args):
     """
-    Funkcja robocza dla workera. Przetwarza jedno ID.
+    Funkcja robocza dla workera. Przetwarza jedno ID: zwraca uśredniony wektor
+    albo (GALLERY_MODE = "templates") macierz embeddingów wszystkich zdjęć galerii.
     """
-    id_path, identity_to_imgfolders, image_pairs, vgg_model, detector, gpu_lock = args
+    id_path, identity_to_imgfolders, image_pairs, model = args
     
     identity_id = os.path.basename(id_path)
     image_folder_paths = sorted(list(identity_to_imgfolders[id_path]))
@@ -166,33 +86,34 @@ def process_identity_for_gallery(args):
     if not gallery_folders:
         return (identity_id, None)
 
-    id_embeddings = []
+    id_images = []
     for img_folder_path in gallery_folders:
         local_path = image_pairs.get(img_folder_path, {}).get('jpg')
         if not local_path:
             continue
             
-        img = cv2.imread(local_path)
-        if img is None:
+        # Surowe bajty - klucz cache embeddingów
+        image_bytes = read_image_bytes(local_path)
+        if image_bytes is None:
             continue
             
-        # Używamy nowej funkcji get_embedding
-        embedding = get_embedding(img, vgg_model, detector, gpu_lock)
-        if embedding is not None:
-            id_embeddings.append(embedding)
-
-    if id_embeddings:
-        avg_embedding = np.mean(id_embeddings, axis=0)
-        avg_embedding /= np.linalg.norm(avg_embedding)
-        return (identity_id, avg_embedding)
-        
-    return (identity_id, None)
+        id_images.append(image_bytes)
+
+    if not id_images:
+        return (identity_id, None)
+
+    # Wszystkie zdjęcia galerii danego ID liczymy jednym batchem (pomijając te z cache)
+    embeddings = model.embed_encoded(id_images)
+    if GALLERY_MODE == "templates":
+        return (identity_id, template_embeddings(embeddings))
+    return (identity_id, mean_embedding(embeddings))
 
 # --- 4. BUDOWANIE GALERII (RÓWNOLEGŁE) ---
 
-def build_faiss_gallery(vgg_model, detector, gpu_lock, identity_to_imgfolders, image_pairs):
+def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
     """
-    Tworzy galerię FAISS równolegle używając ThreadPoolExecutor.
+    Tworzy galerię FAISS równolegle: ID przechodzą przez ograniczony potok (models.pipeline)
+    zamiast listy wszystkich zadań i wyników.
     """
     print(f"--- ROZPOCZYNAM Budowanie Galerii FAISS (równolegle z {NUM_WORKERS} workerami) ---")
     
@@ -201,24 +122,33 @@ def build_faiss_gallery(vgg_model, detector, gpu_lock, identity_to_imgfolders, i
         print("BŁĄD: Lista folderów tożsamości jest pusta.")
         return False
     
+    # Zadania generowane leniwie, wyniki zbierane, gdy tylko ID zostanie policzone
+    tasks = ((id_path, identity_to_imgfolders, image_pairs, model) for id_path in identity_paths)
+    embeddings_by_id = {}
+
+    with tqdm(total=len(identity_paths), desc="Tworzenie galerii ID (równolegle)") as pbar:
+        def collect(result):
+            # Jeden wątek - słownik nie wymaga blokady
+            identity_id, avg_embedding = result
+            embeddings_by_id[identity_id] = avg_embedding
+            pbar.update(1)
+
+        pipeline = Pipeline(tasks, [
+            Stage("embed", process_identity_for_gallery, NUM_WORKERS, PIPELINE_QUEUE_SIZE),
+            Stage("gallery", collect, 1, PIPELINE_QUEUE_SIZE),
+        ], name="galeria")
+        pipeline.run()
+    print(pipeline.report())
+
+    # Kolejność galerii jak identity_paths (niezależnie od kolejności ukończenia)
     gallery_embeddings = []
-    index_to_id_map = {}
-    faiss_index_counter = 0
-
-    tasks = [(id_path, identity_to_imgfolders, image_pairs, vgg_model, detector, gpu_lock) for id_path in identity_paths]
-
-    with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
-        results = list(tqdm(
-            executor.map(process_identity_for_gallery, tasks), 
-            total=len(tasks), 
-            desc="Tworzenie galerii ID (równolegle)"
-        ))
-
-    for identity_id, avg_embedding in results:
+    gallery_labels = []
+    for id_path in identity_paths:
+        identity_id = os.path.basename(id_path)
+        avg_embedding = embeddings_by_id.get(identity_id)
         if avg_embedding is not None:
             gallery_embeddings.append(avg_embedding)
-            index_to_id_map[faiss_index_counter] = identity_id
-            faiss_index_counter += 1
+            gallery_labels.append(identity_id)
         else:
             tqdm.write(f"Warning: Nie udało się wygenerować embeddingu dla {identity_id}")
 
@@ -228,19 +158,34 @@ def build_faiss_gallery(vgg_model, detector, gpu_lock, identity_to_imgfolders, i
         print("BŁĄD: Galeria jest pusta, nie można zbudować indeksu FAISS.")
         return False
         
-    dimension = gallery_embeddings[0].shape[0] 
-    print(f"Wymiar embeddingu (VGGFace): {dimension}") # Powinno być 2048 dla RESNET50
-    gallery_matrix = np.array(gallery_embeddings).astype('float32')
+    # Tryb "templates": wiersze to szablony kolejnych tożsamości (wektory 1-D trybu "mean" -> po jednym wierszu)
+    gallery_matrix = np.vstack(gallery_embeddings).astype('float32')
+    dimension = gallery_matrix.shape[1]
+    print(f"Wymiar embeddingu (VGGFace): {dimension}") # 2048 dla RESNET50 (PROJECTION_DIM z projekcją)
+    if GALLERY_MODE == "templates":
+        print(f"Galeria szablonów: {len(gallery_matrix)} zdjęć, agregacja '{GALLERY_AGGREGATION}'.")
     
-    index = faiss.IndexFlatIP(dimension)
-    index.add(gallery_matrix)
+    print(f"Budowanie indeksu galerii ({GALLERY_INDEX_TYPE})...")
+    try:
+        index = build_index(gallery_matrix, GALLERY_INDEX_TYPE, **GALLERY_INDEX_OPTIONS)
+    except ValueError as e:
+        print(f"BŁĄD: Nie można zbudować indeksu {GALLERY_INDEX_TYPE}: {e}")
+        return False
+    print(f"Indeks: {describe_index(index)}")
     
     print(f"Zapisywanie indeksu FAISS do {FAISS_INDEX_FILE}...")
     faiss.write_index(index, FAISS_INDEX_FILE)
+    if GALLERY_SHARDS:
+        print(f"Zapisywanie galerii w shardach do {GALLERY_SHARDS}...")
+        # Przy kompresji shardy służą do re-rankingu - muszą być dokładne (float32)
+        export_shards(index, GALLERY_SHARDS, "float32" if GALLERY_COMPRESSION else "float16")
     
     print(f"Zapisywanie mapowania ID do {FAISS_MAPPING_FILE}...")
-    with open(FAISS_MAPPING_FILE, 'w') as f:
-        json.dump(index_to_id_map, f)
+    save_id_map(FAISS_MAPPING_FILE, np.arange(len(gallery_labels)), gallery_labels)
+    if GALLERY_MODE == "templates":
+        # Wiersz indeksu -> ID tożsamości (numer w mapowaniu ID)
+        save_template_owners(FAISS_MAPPING_FILE, np.repeat(np.arange(len(gallery_labels)),
+                                                           [len(embeddings) for embeddings in gallery_embeddings]))
         
     return True
 
@@ -248,9 +193,10 @@ def build_faiss_gallery(vgg_model, detector, gpu_lock, identity_to_imgfolders, i
 
 def process_occlusion_query(args):
     """
-    Funkcja robocza dla workera. Przetwarza jedno zapytanie okluzji.
+    Funkcja robocza dla workera. Liczy embedding jednego zapytania okluzji
+    (wyszukiwanie w FAISS robi wątek główny - blokami zapytań).
     """
-    img_folder_path, ground_truth_id, image_pairs, vgg_model, detector, gpu_lock, index, index_to_id_map, output_occlusion_dir = args
+    img_folder_path, ground_truth_id, image_pairs, model, output_occlusion_dir = args
 
     local_img_path = image_pairs.get(img_folder_path, {}).get('jpg')
     local_json_path = image_pairs.get(img_folder_path, {}).get('json')
@@ -258,82 +204,52 @@ def process_occlusion_query(args):
     if not local_img_path or not local_json_path:
         return f"Warning: Błąd mapowania dla {img_folder_path}"
 
-    img = cv2.imread(local_img_path)
-    json_data = None
-    try:
-        with open(local_json_path, 'r') as jf:
-            json_data = json.load(jf)
-    except Exception as e:
-        return f"Warning: Błąd odczytu JSON {local_json_path}: {e}"
+    image_bytes = read_image_bytes(local_img_path)
+    json_data = read_annotation(local_json_path)
     
-    if (img is None or json_data is None or 
+    if (image_bytes is None or json_data is None or 
         "landmarks" not in json_data or "bbox" not in json_data):
         return f"Warning: Brak pełnych danych dla {local_img_path}"
 
-    occluded_img = apply_occlusion(img, json_data["landmarks"], json_data["bbox"])
-    
-    try:
-        original_filename = os.path.basename(local_img_path)
-        save_path = os.path.join(output_occlusion_dir, f"occluded_{ground_truth_id}_{original_filename}")
-        cv2.imwrite(save_path, occluded_img)
-    except Exception as e:
-        tqdm.write(f"Warning: Nie udało się zapisać obrazu okluzji {save_path}: {e}")
+    # Okluzja + embedding (przy trafieniu w cache obraz nie jest nawet dekodowany)
+    original_filename = os.path.basename(local_img_path)
+    save_path = os.path.join(output_occlusion_dir, f"occluded_{ground_truth_id}_{original_filename}")
+    query_embedding = model.embed_encoded(
+        [image_bytes],
+        params=embedding_params(OCCLUSION_SIZE),
+        transform=occlusion_transform([json_data], OCCLUSION_SIZE, [save_path])
+    )[0]
     
-    query_embedding = get_embedding(occluded_img, vgg_model, detector, gpu_lock)
-    
-    if query_embedding is None:
+    if np.isnan(query_embedding).any():
         return f"Warning: Nie udało się uzyskać embeddingu dla {local_img_path}"
         
-    query_embedding_normalized = query_embedding / np.linalg.norm(query_embedding)
-    query_vector = np.expand_dims(query_embedding_normalized, axis=0).astype('float32')
-    
-    D, I = index.search(query_vector, 3) # Szukaj Top 3
-    
-    top1_idx, top2_idx, top3_idx = I[0]
-    top1_sim, top2_sim, top3_sim = D[0]
-    
-    top1_id = index_to_id_map.get(str(top1_idx), "N/A")
-    top2_id = index_to_id_map.get(str(top2_idx), "N/A")
-    top3_id = index_to_id_map.get(str(top3_idx), "N/A")
-    
-    is_correct = (top1_id == ground_truth_id)
-    
-    return [ground_truth_id, top1_id, f"{top1_sim:.4f}", top2_id, f"{top2_sim:.4f}", top3_id, f"{top3_sim:.4f}", is_correct]
-
+    return (ground_truth_id, query_embedding)
 
-def apply_occlusion(image, landmarks_dict, bbox):
-    """Nakłada pasek okluzji na wysokości oczu o szerokości twarzy."""
-    occluded_image = image.copy()
-    try:
-        left_eye_y = landmarks_dict["left_eye"][1]
-        right_eye_y = landmarks_dict["right_eye"][1]
-        eye_y_center = int((left_eye_y + right_eye_y) / 2)
-        bar_height_half = OCCLUSION_SIZE // 2
-        face_x1 = int(bbox[0])
-        face_x2 = int(bbox[2])
-        x1 = face_x1
-        y1 = max(0, eye_y_center - bar_height_half)
-        x2 = face_x2
-        y2 = min(image.shape[0], eye_y_center + bar_height_half)
-        cv2.rectangle(occluded_image, (x1, y1), (x2, y2), (0, 0, 0), -1)
-    except Exception as e:
-        tqdm.write(f"Warning: Błąd podczas nakładania okluzji (np. brak landmarków): {e}")
-        return image.copy() 
-    return occluded_image
 
-def run_occlusion_evaluation(vgg_model, detector, gpu_lock, identity_to_imgfolders, image_pairs):
+def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
     """
-    Testuje drugą połowę zdjęć równolegle.
+    Testuje drugą połowę zdjęć równolegle. Zapytania są generowane leniwie, a wiersze
+    trafiają do RESULTS_CSV, gdy tylko uzbiera się blok zapytań.
     """
     print("Wczytywanie galerii FAISS i mapowania ID...")
     try:
-        index = faiss.read_index(FAISS_INDEX_FILE)
-        with open(FAISS_MAPPING_FILE, 'r') as f:
-            index_to_id_map = json.load(f)
+        index, baseline, service, id_map = load_search_gallery(
+            FAISS_INDEX_FILE, FAISS_MAPPING_FILE, GALLERY_SHARDS, GALLERY_SEARCH_NODES, GALLERY_NPROBE,
+            GALLERY_EF_SEARCH, GALLERY_COMPRESSION, GALLERY_RERANK_K, GALLERY_MODE, GALLERY_AGGREGATION,
+            GALLERY_TOP_K, GALLERY_TEMPERATURE, GALLERY_TEMPLATE_SEARCH_K
+        )
+    except ValueError as e: # Niezgodna konfiguracja galerii
+        print(f"BŁĄD: {e}.")
+        return
     except Exception as e:
         print(f"BŁĄD: Nie udało się wczytać plików FAISS. Uruchom najpierw budowanie galerii.")
         print(f"Error: {e}")
         return
+    if service is not None:
+        print(f"Przeszukiwanie galerii w {GALLERY_SEARCH_NODES} procesach ({service.ntotal} wektorów).")
+    if baseline is not None:
+        compressed = index.index if GALLERY_MODE == "templates" else index
+        print(f"Galeria skompresowana - {compressed.describe()}")
 
     print(f"Rozpoczynanie ewaluacji z okluzją (równolegle z {NUM_WORKERS} workerami)...")
     
@@ -343,20 +259,15 @@ def run_occlusion_evaluation(vgg_model, detector, gpu_lock, identity_to_imgfolde
     os.makedirs(output_occlusion_dir, exist_ok=True)
     print(f"Obrazy z okluzją będą zapisywane w: {output_occlusion_dir}")
     
-    tasks = []
-    for id_path in identity_paths:
-        ground_truth_id = os.path.basename(id_path)
-        image_folder_paths = sorted(list(identity_to_imgfolders[id_path]))
-        
-        split_point = max(1, len(image_folder_paths) // 2)
-        query_folders = image_folder_paths[split_point:] 
-
-        for img_folder_path in query_folders:
-            tasks.append(
-                (img_folder_path, ground_truth_id, image_pairs, vgg_model, detector, gpu_lock, index, index_to_id_map, output_occlusion_dir)
-            )
-            
-    if not tasks:
+    def iter_query_tasks():
+        """Zapytania (druga połowa zdjęć każdego ID) generowane leniwie."""
+        for id_path in identity_paths:
+            ground_truth_id = os.path.basename(id_path)
+            for img_folder_path in split_query_folders(identity_to_imgfolders, id_path):
+                yield (img_folder_path, ground_truth_id, image_pairs, model, output_occlusion_dir)
+
+    total = sum(len(split_query_folders(identity_to_imgfolders, id_path)) for id_path in identity_paths)
+    if total == 0:
         print("\n--- Ewaluacja Zakończona ---")
         print("Nie znaleziono żadnych zapytań do przetworzenia.")
         return
@@ -364,27 +275,50 @@ def run_occlusion_evaluation(vgg_model, detector, gpu_lock, identity_to_imgfolde
     total_queries = 0
     correct_top1 = 0
     
+    searcher = BlockSearcher(index, SEARCH_K, SEARCH_BLOCK_SIZE)
+    baseline_searcher = None
+    if baseline is not None:
+        baseline_searcher = BlockSearcher(baseline, SEARCH_K, SEARCH_BLOCK_SIZE)
+        baseline_file = open(RESULTS_CSV_UNCOMPRESSED, 'w', newline='', encoding='utf-8')
+        baseline_writer = csv.writer(baseline_file)
+        baseline_writer.writerow(results_header(SEARCH_K))
+
     with open(RESULTS_CSV, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(["query_id", "top1_id", "top1_similarity", "top2_id", "top2_similarity", "top3_id", "top3_similarity", "is_correct_top1"])
+        writer.writerow(results_header(SEARCH_K))
+
+        def write_results(results):
+            """Zapisuje wyniki przeszukanego bloku zapytań."""
+            nonlocal total_queries, correct_top1
+            # ID FAISS -> nazwy tożsamości dla całego bloku naraz
+            correct_top1 += write_result_rows(writer, results, id_map)
+            total_queries += len(results)
+
+        def search(ground_truth_id, query_embedding):
+            """Dodaje zapytanie do bloku (i do bloku galerii bez kompresji, jeśli porównujemy)."""
+            write_results(searcher.add(ground_truth_id, query_embedding))
+            if baseline_searcher is not None:
+                write_result_rows(baseline_writer, baseline_searcher.add(ground_truth_id, query_embedding), id_map)
         
-        with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
-            results = list(tqdm(
-                executor.map(process_occlusion_query, tasks), 
-                total=len(tasks), 
-                desc="Testowanie okluzji (równolegle)"
-            ))
-
-        for result in results:
-            if isinstance(result, list):
-                writer.writerow(result)
-                is_correct = result[-1]
-                if is_correct:
-                    correct_top1 += 1
-                total_queries += 1
-            else:
-                tqdm.write(str(result))
-
+        with tqdm(total=total, desc="Testowanie okluzji (równolegle)") as pbar:
+            def collect(result):
+                """Etap wyszukiwania (jeden wątek): zapytanie czeka w bloku na wspólne index.search."""
+                if isinstance(result, tuple): # (ID, embedding)
+                    search(*result)
+                else:
+                    tqdm.write(str(result))
+                pbar.update(1)
+
+            pipeline = Pipeline(iter_query_tasks(), [
+                Stage("embed", process_occlusion_query, NUM_WORKERS, PIPELINE_QUEUE_SIZE),
+                Stage("search", collect, 1, PIPELINE_QUEUE_SIZE),
+            ], name="okluzja")
+            pipeline.run()
+        write_results(searcher.flush())
+        if baseline_searcher is not None:
+            write_result_rows(baseline_writer, baseline_searcher.flush(), id_map)
+            baseline_file.close()
+    print(pipeline.report())
 
     if total_queries > 0:
         accuracy = (correct_top1 / total_queries) * 100
@@ -392,15 +326,32 @@ def run_occlusion_evaluation(vgg_model, detector, gpu_lock, identity_to_imgfolde
         print(f"Całkowita liczba zapytań: {total_queries}")
         print(f"Poprawne trafienia Top-1: {correct_top1}")
         print(f"Celność Top-1: {accuracy:.2f}%")
+        print(f"Czas przeszukiwania galerii: {searcher.search_seconds:.3f}s (wymiar {index.d})")
     else:
         print("\n--- Ewaluacja Zakończona (VGGFace) ---")
         print("Nie przetworzono żadnych zapytań.")
 
+    if baseline_searcher is not None:
+        print(f"\n--- Kompresja galerii: {GALLERY_COMPRESSION} (re-ranking top-{GALLERY_RERANK_K}) ---")
+        print(f"Czas przeszukiwania: {searcher.search_seconds:.3f}s, bez kompresji {baseline_searcher.search_seconds:.3f}s "
+              f"(przyspieszenie x{baseline_searcher.search_seconds / max(searcher.search_seconds, 1e-9):.2f})")
+        compare_rank_k(RESULTS_CSV_UNCOMPRESSED, RESULTS_CSV)
+
+    if service is not None:
+        print(service.report())
+        service.close()
+
 # --- 6. GŁÓWNA FUNKCJA URUCHAMIAJĄCA ---
 
 def main():
-    # Krok 0: Załaduj modele (VGGFace, MTCNN) i blokadę
-    vgg_model, detector, gpu_lock = initialize_services()
+    # Krok 0: Załaduj embedder (VGGFace, MTCNN)
+    model = initialize_services()
+    if PROJECTION:
+        # Galeria i zapytania w przestrzeni po projekcji (cache trzyma embeddingi 2048-d)
+        model = fit_embedding_projection(model)
+        if model is None:
+            print("Zatrzymanie skryptu z powodu błędu projekcji.")
+            return
     
     local_test_path = os.path.join(BASE_FOLDER_LOCAL, "test")
     
@@ -411,7 +362,7 @@ def main():
 
     # Krok 1: Zbuduj galerię (indeks FAISS)
     print("--- ROZPOCZYNAM KROK 1: Budowanie Galerii FAISS ---")
-    if not build_faiss_gallery(vgg_model, detector, gpu_lock, identity_to_imgfolders, image_pairs):
+    if not build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
         print("Zatrzymanie skryptu z powodu błędu budowania galerii.")
         return
     print("\n" + "="*50 + "\n")
@@ -420,7 +371,7 @@ def main():
     
     # Krok 2: Uruchom ewaluację z okluzją
     print("--- ROZPOCZYNAM KROK 2: Ewaluacja Okluzji ---")
-    run_occlusion_evaluation(vgg_model, detector, gpu_lock, identity_to_imgfolders, image_pairs)
+    run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs)
     
     print("Gotowe.")
 
@@ -0,0 +1,30 @@
+import importlib
+
+from models.embedder.base import (
+    Embedder, l2_normalize, valid_rows, mean_embedding, landmarks_to_array, LANDMARK_KEYS,
+    read_image_bytes, decode_image
+)
+from models.embedder.cache import EmbeddingCache, CachedEmbedder, with_cache
+from models.embedder.batching import DynamicBatcher
+from models.embedder.projection import (
+    ProjectedEmbedder, with_projection, fit_projection, save_projection, load_projection, PROJECTIONS
+)
+from models.embedder.preprocess import read_annotation, annotation_exists, apply_occlusion, occlusion_transform, embedding_params
+from models.embedder.dataset import discover_file_structure, list_split_images
+
+# Backendy są importowane leniwie - każdy model ma własne (ciężkie) zależności
+# i własny requirements.txt, więc nie chcemy ich ładować wszystkich naraz.
+BACKENDS = {
+    "arcface": ("models.embedder.arcface", "ArcFaceEmbedder"),
+    "vggface": ("models.embedder.vggface", "VGGFaceEmbedder"),
+    "dlib": ("models.embedder.dlib_face", "DlibEmbedder"),
+}
+
+
+def create_embedder(backend, **options):
+    """Tworzy embedder wybranego backendu ('arcface', 'vggface', 'dlib')."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Nieznany backend '{backend}'. Dostępne: {', '.join(BACKENDS)}")
+    module_name, class_name = BACKENDS[backend]
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)(**options)
@@ -0,0 +1,114 @@
+import os
+import glob
+
+import cv2
+import numpy as np
+import insightface
+import onnxruntime
+from insightface.utils import ensure_available, face_align
+
+from models.embedder.base import Embedder, l2_normalize, landmarks_to_array
+
+DEFAULT_PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+MODES = ("detect", "aligned")
+
+
+class ArcFaceEmbedder(Embedder):
+    """
+    InsightFace (buffalo_l / buffalo_s), embedding 512-d (znormalizowany).
+
+    Tryby:
+      - "detect":  FaceAnalysis.get - detektor + ArcFace, obraz po obrazie.
+      - "aligned": sam model rozpoznawania, cały batch w jednym session.run.
+        Dla wyciętych i wyrównanych twarzy (WebFace 112x112) detektor jest zbędny;
+        jeśli podano landmarki z JSON-a, twarz jest najpierw wyrównywana (norm_crop).
+
+    intra_op_threads ogranicza liczbę wątków sesji ONNX (np. gdy model działa
+    w kilku procesach naraz - patrz ProcessEmbeddingEngine).
+    """
+
+    name = "arcface"
+    dimension = 512
+
+    def __init__(self, model_name="buffalo_l", det_size=(112, 112), mode="detect",
+                 root='./insightface_models', providers=None, batch_size=64, intra_op_threads=None):
+        if mode not in MODES:
+            raise ValueError(f"Nieznany tryb ArcFace '{mode}'. Dostępne: {', '.join(MODES)}")
+        self.model_name = model_name
+        self.det_size = tuple(det_size)
+        self.mode = mode
+        self.batch_size = batch_size
+        providers = providers or DEFAULT_PROVIDERS
+
+        if mode == "detect":
+            self.app = insightface.app.FaceAnalysis(
+                name=model_name,
+                root=root,
+                providers=providers
+            )
+            # (640, 640) dla zdjęć pełnoklatkowych, (112, 112) dla WebFace
+            self.app.prepare(ctx_id=0, det_size=self.det_size)
+        else:
+            self.recognizer = self._load_recognizer(model_name, root, providers)
+
+        if intra_op_threads:
+            self._limit_threads(providers, intra_op_threads)
+
+    @property
+    def model_id(self):
+        if self.mode == "aligned":
+            return f"{self.name}-{self.model_name}-aligned"
+        return f"{self.name}-{self.model_name}-det{self.det_size[0]}x{self.det_size[1]}"
+
+    @staticmethod
+    def _load_recognizer(model_name, root, providers):
+        """Ładuje z paczki modeli tylko model rozpoznawania (bez detektora)."""
+        model_dir = ensure_available('models', model_name, root=root)
+        for onnx_file in sorted(glob.glob(os.path.join(model_dir, '*.onnx'))):
+            model = insightface.model_zoo.get_model(onnx_file, providers=providers)
+            if model is not None and model.taskname == 'recognition':
+                return model
+        raise RuntimeError(f"Brak modelu rozpoznawania w paczce {model_name} ({model_dir})")
+
+    def _limit_threads(self, providers, intra_op_threads):
+        """
+        model_zoo tworzy sesje ONNX bez SessionOptions (ORT zajmuje wszystkie rdzenie),
+        więc odtwarzamy je z ograniczoną liczbą wątków.
+        """
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.intra_op_num_threads = intra_op_threads
+        sess_options.inter_op_num_threads = 1
+        models = self.app.models.values() if self.mode == "detect" else [self.recognizer]
+        for model in models:
+            model.session = onnxruntime.InferenceSession(model.model_file, sess_options, providers=providers)
+
+    def _align(self, image_bgr, landmarks):
+        input_size = self.recognizer.input_size
+        if landmarks is not None:
+            return face_align.norm_crop(image_bgr, landmark=landmarks_to_array(landmarks),
+                                        image_size=input_size[0])
+        if image_bgr.shape[1::-1] != input_size:
+            return cv2.resize(image_bgr, input_size)
+        return image_bgr
+
+    def _embed_chunk(self, images, landmarks=None):
+        if self.mode == "detect":
+            return super()._embed_chunk(images, landmarks)
+
+        chunk = np.full((len(images), self.dimension), np.nan, dtype=np.float32)
+        crops, rows = [], []
+        for i, image_bgr in enumerate(images):
+            if image_bgr is None:
+                continue
+            crops.append(self._align(image_bgr, None if landmarks is None else landmarks[i]))
+            rows.append(i)
+        if crops:
+            # Jedno wywołanie ONNX dla całego batcha (blobFromImages -> session.run)
+            chunk[rows] = l2_normalize(self.recognizer.get_feat(crops))
+        return chunk
+
+    def _embed_one(self, image_bgr):
+        faces = self.app.get(image_bgr)
+        if faces:
+            return faces[0].normed_embedding
+        return None
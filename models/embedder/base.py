@@ -0,0 +1,174 @@
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from models.embedder.preprocess import read_annotation, occlusion_transform, embedding_params
+from models.embedder.formats import read_packed
+
+# Kolejność 5 punktów charakterystycznych w JSON-ach z s_03_process (RetinaFace).
+# Odpowiada kolejności 'kps' w InsightFace (od lewej strony obrazu).
+LANDMARK_KEYS = ("right_eye", "left_eye", "nose", "mouth_right", "mouth_left")
+
+
+def landmarks_to_array(landmarks):
+    """Zamienia słownik landmarków z JSON-a na tablicę (5, 2) float32."""
+    if isinstance(landmarks, dict):
+        landmarks = [landmarks[key] for key in LANDMARK_KEYS]
+    return np.asarray(landmarks, dtype=np.float32).reshape(5, 2)
+
+
+def read_image_bytes(path):
+    """
+    Czyta surowe bajty obrazu (JPEG) albo zwraca None. Jeśli podział jest spakowany
+    (s_03b_pack), bajty pochodzą z jego archiwów - plik .jpg nie musi istnieć.
+    """
+    image_bytes = read_packed(path)
+    if image_bytes is not None:
+        return image_bytes
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def decode_image(image_bytes):
+    """Dekoduje bajty JPEG do obrazu BGR (jak cv2.imread) albo zwraca None."""
+    if not image_bytes:
+        return None
+    return cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def valid_rows(embeddings):
+    """Maska wierszy, dla których udało się policzyć embedding (nie-NaN)."""
+    return ~np.isnan(embeddings).any(axis=1)
+
+
+def l2_normalize(embeddings):
+    """Normalizuje wiersze macierzy (N, D) do długości 1."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (embeddings / norms).astype(np.float32)
+
+
+def mean_embedding(embeddings):
+    """
+    Uśrednia poprawne wiersze i normalizuje wynik (wektor tożsamości w galerii).
+    Zwraca None, jeśli żaden obraz nie dał embeddingu.
+    """
+    embeddings = embeddings[valid_rows(embeddings)]
+    if len(embeddings) == 0:
+        return None
+    avg_embedding = np.mean(embeddings, axis=0)
+    avg_embedding /= np.linalg.norm(avg_embedding)
+    return avg_embedding.astype(np.float32)
+
+
+class Embedder:
+    """
+    Wspólny kontrakt wszystkich modeli: embed_batch(images) -> macierz (N, D) float32.
+    Obrazy (BGR, jak z cv2.imread), dla których nie znaleziono twarzy, dają wiersz NaN.
+    """
+
+    name = "base"
+    dimension = None
+    batch_size = 32
+
+    @property
+    def model_id(self):
+        """Identyfikator modelu i jego ustawień - część klucza w EmbeddingCache."""
+        return self.name
+
+    def embed_batch(self, images, landmarks=None):
+        """
+        Liczy embeddingi dla listy obrazów, po batch_size naraz.
+        'landmarks' (opcjonalnie) to lista landmarków z JSON-a dla każdego obrazu -
+        używają ich tylko backendy, które same wyrównują twarz.
+        """
+        images = list(images)
+        if landmarks is not None:
+            landmarks = list(landmarks)
+        output = np.full((len(images), self.dimension), np.nan, dtype=np.float32)
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            chunk_landmarks = None if landmarks is None else landmarks[start:start + self.batch_size]
+            output[start:start + len(chunk)] = self._embed_chunk(chunk, chunk_landmarks)
+        return output
+
+    def embed_encoded(self, images_bytes, params="", transform=None, landmarks=None):
+        """
+        Jak embed_batch, ale dla surowych bajtów JPEG. 'transform(obraz, i)' jest
+        wywoływany po dekodowaniu (np. nałożenie okluzji), a 'params' opisuje go
+        w kluczu cache (patrz CachedEmbedder) - tutaj jest ignorowany.
+        """
+        images = []
+        for i, image_bytes in enumerate(images_bytes):
+            image_bgr = decode_image(image_bytes)
+            if image_bgr is not None and transform is not None:
+                image_bgr = transform(image_bgr, i)
+            images.append(image_bgr)
+        return self.embed_batch(images, landmarks)
+
+    def embed_files(self, jpg_paths, json_paths=None, occlusion_size=0,
+                    align_with_landmarks=False, save_paths=None):
+        """
+        Embeddingi prosto z plików: .jpg + (opcjonalnie) .json z s_03_process.
+        Przy occlusion_size > 0 nakłada okluzję (i zapisuje podgląd do save_paths),
+        przy align_with_landmarks przekazuje landmarki z JSON-a do modelu.
+        Obrazy bez potrzebnej adnotacji dają wiersz NaN.
+        """
+        jpg_paths = list(jpg_paths)
+        images_bytes = [read_image_bytes(jpg_path) for jpg_path in jpg_paths]
+        annotations = None
+        if occlusion_size or align_with_landmarks:
+            annotations = [read_annotation(json_path) for json_path in json_paths]
+            images_bytes = [None if annotation is None else image_bytes
+                            for image_bytes, annotation in zip(images_bytes, annotations)]
+
+        transform = None
+        if occlusion_size:
+            transform = occlusion_transform(annotations, occlusion_size, save_paths)
+        landmarks = None
+        if align_with_landmarks:
+            landmarks = [None if annotation is None else annotation["landmarks"] for annotation in annotations]
+        return self.embed_encoded(images_bytes, embedding_params(occlusion_size, align_with_landmarks),
+                                  transform, landmarks)
+
+    def embed_files_stream(self, chunks, occlusion_size=0, align_with_landmarks=False):
+        """
+        Dla leniwego iteratora porcji (tag, jpg_paths, json_paths, save_paths)
+        zwraca kolejno (tag, embeddingi) - ten sam interfejs co ProcessEmbeddingEngine.
+        """
+        for tag, jpg_paths, json_paths, save_paths in chunks:
+            yield tag, self.embed_files(jpg_paths, json_paths, occlusion_size, align_with_landmarks, save_paths)
+
+    def close(self):
+        """Zwalnia zasoby modelu (dla modeli w procesie głównym - nic do zrobienia)."""
+
+    def embed_one(self, image_bgr, landmarks=None):
+        """Odpowiednik dawnego get_embedding: wektor 1D albo None."""
+        embedding = self.embed_batch([image_bgr], None if landmarks is None else [landmarks])[0]
+        if np.isnan(embedding).any():
+            return None
+        return embedding
+
+    def _embed_chunk(self, images, landmarks=None):
+        """
+        Domyślnie pętla po obrazach. Backendy, które potrafią policzyć
+        cały batch jednym wywołaniem modelu, nadpisują tę metodę.
+        """
+        chunk = np.full((len(images), self.dimension), np.nan, dtype=np.float32)
+        for i, image_bgr in enumerate(images):
+            if image_bgr is None:
+                continue
+            try:
+                embedding = self._embed_one(image_bgr)
+            except Exception as e:
+                tqdm.write(f"Warning: Błąd podczas pobierania embeddingu ({self.name}): {e}")
+                continue
+            if embedding is not None:
+                chunk[i] = embedding
+        return chunk
+
+    def _embed_one(self, image_bgr):
+        raise NotImplementedError
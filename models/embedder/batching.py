@@ -0,0 +1,80 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+# Znacznik zamknięcia kolejki (close)
+_STOP = object()
+
+
+class DynamicBatcher:
+    """
+    Dynamiczne batchowanie dla modeli, które nie są bezpieczne dla wątków: submit(item)
+    z dowolnego wątku zwraca Future, a jeden wątek roboczy zbiera elementy w batche
+    (do max_batch_size elementów albo max_wait sekund od pierwszego) i woła
+    process_batch(lista elementów) -> lista wyników tej samej długości.
+    Model jest używany tylko z wątku roboczego, więc nie potrzebuje blokady.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait=0.005, name="dynamic-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def map(self, items):
+        """Wyniki dla listy elementów (kolejność zachowana); wyjątek batcha jest przekazywany dalej."""
+        return [future.result() for future in [self.submit(item) for item in items]]
+
+    def _collect(self, first):
+        """Pierwszy element + to, co nadejdzie przed upływem max_wait (najwyżej max_batch_size)."""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                return
+            batch = self._collect(entry)
+            futures = [future for _, future in batch]
+            try:
+                results = list(self.process_batch([item for item, _ in batch]))
+                if len(results) != len(futures):
+                    raise RuntimeError(f"process_batch zwrócił {len(results)} wyników dla {len(futures)} elementów")
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    @property
+    def mean_batch_size(self):
+        return self.items / max(1, self.batches)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
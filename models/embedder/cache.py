@@ -0,0 +1,197 @@
+import os
+import re
+import hashlib
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows - bez blokady między procesami
+    fcntl = None
+
+from models.embedder.base import Embedder
+
+KEY_SIZE = 20 # sha1
+
+
+class EmbeddingCache:
+    """
+    Trwały cache embeddingów adresowany treścią:
+    sha1(model_id + parametry + bajty JPEG) -> wektor float32.
+
+    Na dysku są dwa pliki dopisywane na końcu (append-only):
+      <model_id>.keys - kolejne klucze po 20 bajtów,
+      <model_id>.f32  - kolejne wektory (dimension * float32), czytane przez np.memmap.
+    W RAM trzymany jest tylko słownik klucz -> numer wiersza.
+
+    Kilka procesów może dzielić ten sam katalog (np. run_eval.py i run_ver.py): dopisywanie
+    odbywa się pod blokadą pliku kluczy (fcntl.flock), numer wiersza wynika z rozmiaru pliku,
+    a wiersze dopisane przez inne procesy są doczytywane przy braku trafienia.
+    """
+
+    def __init__(self, cache_dir, model_id, dimension):
+        self.model_id = model_id
+        self.dimension = dimension
+        os.makedirs(cache_dir, exist_ok=True)
+        file_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_id)
+        self.keys_path = os.path.join(cache_dir, f"{file_name}.keys")
+        self.vectors_path = os.path.join(cache_dir, f"{file_name}.f32")
+
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._count = 0
+        self._vectors = None
+        self._mapped_count = 0
+        self._load()
+
+    def __len__(self):
+        return self._count
+
+    def _file_lock(self):
+        """Otwarty plik kluczy z wyłączną blokadą (zwolnioną przy zamknięciu pliku)."""
+        f = open(self.keys_path, 'ab')
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def _file_count(self):
+        """Liczba pełnych wpisów na dysku (klucze są dopisywane po wektorach)."""
+        keys_size = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        return min(keys_size // KEY_SIZE, vectors_size // (self.dimension * 4)), keys_size, vectors_size
+
+    def _read_tail(self, count):
+        """Dodaje do słownika klucze wierszy self._count..count (dopisane przez inne procesy)."""
+        if count <= self._count:
+            return
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._count * KEY_SIZE)
+            keys = f.read((count - self._count) * KEY_SIZE)
+        for i in range(count - self._count):
+            self._rows.setdefault(keys[i * KEY_SIZE:(i + 1) * KEY_SIZE], self._count + i)
+        self._count = count
+
+    def _sync(self):
+        """Pod blokadą pliku: obcina niepełny ogon i doczytuje nowe wiersze."""
+        count, keys_size, vectors_size = self._file_count()
+        # Przerwany zapis (np. zabity proces) zostawia niepełny ogon - obcinamy go
+        if keys_size != count * KEY_SIZE:
+            os.truncate(self.keys_path, count * KEY_SIZE)
+        if vectors_size != count * self.dimension * 4:
+            os.truncate(self.vectors_path, count * self.dimension * 4)
+        self._read_tail(count)
+
+    def _load(self):
+        with self._file_lock():
+            self._sync()
+
+    def _remap(self):
+        """Odświeża mapowanie pliku wektorów po dopisaniu nowych wierszy."""
+        if self._mapped_count != self._count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                      shape=(self._count, self.dimension))
+            self._mapped_count = self._count
+
+    def make_key(self, image_bytes, params=""):
+        digest = hashlib.sha1()
+        digest.update(self.model_id.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(params.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(image_bytes)
+        return digest.digest()
+
+    def lookup(self, keys):
+        """Zwraca (macierz (N, D) z NaN dla braków, maska trafień)."""
+        vectors = np.full((len(keys), self.dimension), np.nan, dtype=np.float32)
+        hits = np.zeros(len(keys), dtype=bool)
+        with self._lock:
+            rows = [self._rows.get(key) if key is not None else None for key in keys]
+            if any(row is None and key is not None for row, key in zip(rows, keys)):
+                # Braki mogły już policzyć inne procesy - doczytujemy ich wiersze
+                self._read_tail(self._file_count()[0])
+                rows = [self._rows.get(key) if key is not None else None for key in keys]
+            hit_positions = [i for i, row in enumerate(rows) if row is not None]
+            if hit_positions:
+                self._remap()
+                vectors[hit_positions] = self._vectors[[rows[i] for i in hit_positions]]
+                hits[hit_positions] = True
+        return vectors, hits
+
+    def store(self, keys, vectors):
+        """Dopisuje nowe wpisy (również wiersze NaN - 'brak twarzy' też warto pamiętać)."""
+        with self._lock, self._file_lock():
+            # Numery wierszy od aktualnego końca pliku (mógł go wydłużyć inny proces)
+            self._sync()
+            new_keys, new_vectors = [], []
+            for key, vector in zip(keys, vectors):
+                if key is None or key in self._rows:
+                    continue
+                self._rows[key] = self._count + len(new_keys)
+                new_keys.append(key)
+                new_vectors.append(vector)
+            if not new_keys:
+                return
+            # Najpierw wektory, potem klucze - klucz nigdy nie wskazuje na niezapisany wiersz
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.asarray(new_vectors, dtype=np.float32).tobytes())
+            with open(self.keys_path, 'ab') as f:
+                f.write(b"".join(new_keys))
+            self._count += len(new_keys)
+
+
+class CachedEmbedder(Embedder):
+    """
+    Embedder z cache: embed_encoded najpierw sprawdza EmbeddingCache,
+    a model dostaje tylko obrazy, których jeszcze nie liczyliśmy. Transform (np. okluzja
+    z zapisem podglądu) też jest wywoływany tylko dla nich.
+    """
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+        self.name = embedder.name
+        self.dimension = embedder.dimension
+        self.batch_size = embedder.batch_size
+
+    def __getattr__(self, attribute):
+        # Pozostałe atrybuty (mode, model_name, ...) bierzemy z opakowanego modelu
+        return getattr(self.embedder, attribute)
+
+    @property
+    def model_id(self):
+        return self.embedder.model_id
+
+    def embed_batch(self, images, landmarks=None):
+        return self.embedder.embed_batch(images, landmarks)
+
+    def embed_encoded(self, images_bytes, params="", transform=None, landmarks=None):
+        images_bytes = list(images_bytes)
+        keys = [None if not image_bytes else self.cache.make_key(image_bytes, params)
+                for image_bytes in images_bytes]
+        output, hits = self.cache.lookup(keys)
+
+        missing = [i for i, key in enumerate(keys) if key is not None and not hits[i]]
+        if missing:
+            missing_transform = None
+            if transform is not None:
+                missing_transform = lambda image_bgr, j: transform(image_bgr, missing[j])
+            computed = self.embedder.embed_encoded(
+                [images_bytes[i] for i in missing],
+                params,
+                missing_transform,
+                None if landmarks is None else [landmarks[i] for i in missing]
+            )
+            output[missing] = computed
+            self.cache.store([keys[i] for i in missing], computed)
+        return output
+
+
+def with_cache(embedder, cache_dir):
+    """Opakowuje embedder w CachedEmbedder (albo zwraca go bez zmian, gdy cache_dir jest pusty)."""
+    if not cache_dir:
+        return embedder
+    cache = EmbeddingCache(cache_dir, embedder.model_id, embedder.dimension)
+    print(f"Cache embeddingów: {cache.vectors_path} ({len(cache)} wpisów)")
+    return CachedEmbedder(embedder, cache)
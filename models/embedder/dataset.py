@@ -0,0 +1,75 @@
+import os
+import time
+
+import numpy as np
+
+from models.embedder.formats import load_manifest, read_manifest, scan_split
+
+# Wątki skanera os.scandir (gdy podział nie ma aktualnego manifestu)
+SCAN_WORKERS = 32
+
+
+def _structure(split_dir, manifest):
+    """Wiersze manifestu z adnotacją -> (identity_to_imgfolders, image_pairs) jak dotąd w ewaluatorach."""
+    identity_to_imgfolders = {}
+    image_pairs = {}
+    for jpg in manifest["jpg"][manifest["annotated"]]:
+        jpg_path_norm = os.path.normpath(os.path.join(split_dir, jpg.decode()))
+        image_folder_path = os.path.dirname(jpg_path_norm)
+        identity_path = os.path.dirname(image_folder_path)
+        identity_to_imgfolders.setdefault(identity_path, set()).add(image_folder_path)
+        image_pairs[image_folder_path] = {'jpg': jpg_path_norm, 'json': os.path.splitext(jpg_path_norm)[0] + ".json"}
+    return identity_to_imgfolders, image_pairs
+
+
+def _subset(split_dir, identities, workers):
+    """Wiersze manifestu tylko dla podanych tożsamości (bez skanowania całego podziału)."""
+    manifest = read_manifest(split_dir)
+    if manifest is None:
+        return scan_split(split_dir, workers, identities)
+    return manifest[np.isin(manifest["identity"], [identity.encode() for identity in identities])]
+
+
+def list_split_images(split_dir, workers=SCAN_WORKERS):
+    """Ścieżki wszystkich zdjęć podziału (posortowane, także bez adnotacji) - z manifestu albo skanowania."""
+    manifest, _ = load_manifest(split_dir, workers)
+    return [os.path.normpath(os.path.join(split_dir, jpg.decode())) for jpg in manifest["jpg"]]
+
+
+def discover_file_structure(local_test_path=None, identity_paths=None, workers=SCAN_WORKERS):
+    """
+    Mapuje strukturę plików podziału local_test_path (albo tylko folderów ID identity_paths)
+    z manifestu <split>/manifest.npy; bez aktualnego manifestu - równoległy os.scandir (i zapis
+    manifestu). Pomija zdjęcia bez adnotacji. Zwraca (identity_to_imgfolders, image_pairs) albo (None, None).
+    """
+    location = local_test_path if identity_paths is None else f"{len(identity_paths)} podanych folderach ID"
+    print(f"Wykrywanie struktury plików w {location}...")
+    start = time.perf_counter()
+    if identity_paths is None:
+        if not os.path.isdir(local_test_path):
+            print(f"BŁĄD: Folder {local_test_path} nie istnieje.")
+            return None, None
+        manifest, from_file = load_manifest(local_test_path, workers)
+        source = "manifest" if from_file else "skanowanie os.scandir"
+        parts = [(local_test_path, manifest)]
+    else:
+        by_split = {}
+        for id_path in identity_paths:
+            id_path = os.path.normpath(id_path)
+            by_split.setdefault(os.path.dirname(id_path), []).append(os.path.basename(id_path))
+        parts = [(split_dir, _subset(split_dir, identities, workers)) for split_dir, identities in by_split.items()]
+        source = "manifest/skanowanie wybranych ID"
+
+    total = sum(len(manifest) for _, manifest in parts)
+    if not total:
+        print(f"BŁĄD: Nie znaleziono zdjęć w {location}.")
+        return None, None
+    print(f"Znaleziono łącznie {total} zdjęć ({source}, {time.perf_counter() - start:.2f} s).")
+
+    identity_to_imgfolders, image_pairs = {}, {}
+    for split_dir, manifest in parts:
+        split_identities, split_pairs = _structure(split_dir, manifest)
+        identity_to_imgfolders.update(split_identities)
+        image_pairs.update(split_pairs)
+    print(f"Wykryto {len(identity_to_imgfolders)} folderów tożsamości z kompletnymi parami JPG/adnotacja.")
+    return identity_to_imgfolders, image_pairs
@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+import face_recognition
+from tqdm import tqdm
+
+from models.embedder.base import Embedder
+
+
+class DlibEmbedder(Embedder):
+    """Biblioteka face_recognition (dlib), embedding 128-d."""
+
+    name = "dlib"
+    dimension = 128
+
+    def __init__(self, detection_model="cnn", batch_size=32, intra_op_threads=None):
+        # dlib nie ma własnego ustawienia wątków - korzysta z OMP_NUM_THREADS
+        # (ustawianego przez ProcessEmbeddingEngine), więc intra_op_threads jest ignorowane
+        self.detection_model = detection_model
+        self.batch_size = batch_size
+        # Mały "warm-up" - niech dlib załaduje modele teraz, a nie przy pierwszym obrazie
+        face_recognition.face_encodings(np.zeros((100, 100, 3), dtype=np.uint8))
+
+    @property
+    def model_id(self):
+        return f"{self.name}-{self.detection_model}"
+
+    def _embed_one(self, image_bgr):
+        try:
+            img_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+            face_locations = face_recognition.face_locations(img_rgb, model=self.detection_model)
+            if not face_locations:
+                return None
+            return face_recognition.face_encodings(img_rgb, known_face_locations=face_locations)[0]
+        except Exception as e:
+            # Ten błąd często się zdarza, gdy detekcja 'hog' zawiedzie na małym obrazku
+            if "Process C++ exception" in str(e):
+                tqdm.write(f"Warning: Błąd C++ dlib (prawdopodobnie za mały obraz): {e}")
+                return None
+            raise
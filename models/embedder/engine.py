@@ -0,0 +1,195 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from models.embedder.base import read_image_bytes
+from models.embedder.cache import EmbeddingCache
+from models.embedder.preprocess import embedding_params
+
+# Zmienne środowiskowe bibliotek numerycznych (BLAS/OpenMP/TF) - ustawiane
+# przed startem procesów, żeby N procesów x K wątków nie przekroczyło liczby rdzeni
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                   "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS")
+
+# Stan procesu roboczego (ustawiany w _init_worker, raz na proces)
+_worker = {}
+
+
+def _init_worker(backend, options, intra_op_threads):
+    """Initializer puli: każdy proces ładuje własny model tylko raz."""
+    from models.embedder import create_embedder
+    if intra_op_threads:
+        options = dict(options, intra_op_threads=intra_op_threads)
+    _worker["embedder"] = create_embedder(backend, **options)
+    _worker["buffers"] = {}
+
+
+def _worker_info():
+    embedder = _worker["embedder"]
+    return embedder.model_id, embedder.dimension, embedder.batch_size
+
+
+def _attach_buffer(shm_name, shape):
+    """Podłącza (raz na proces) bufor wyników we współdzielonej pamięci."""
+    buffers = _worker["buffers"]
+    if shm_name not in buffers:
+        # Procesy 'spawn' dzielą resource_tracker z procesem głównym,
+        # który jako jedyny robi unlink (ProcessEmbeddingEngine.close)
+        shm = shared_memory.SharedMemory(name=shm_name)
+        buffers[shm_name] = (shm, np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+    return buffers[shm_name][1]
+
+
+def _embed_files_task(shm_name, shape, slot, jpg_paths, json_paths, occlusion_size,
+                      align_with_landmarks, save_paths):
+    """
+    Zadanie dla procesu roboczego: sam czyta pliki z podanych ścieżek, liczy
+    embeddingi i wpisuje je do slotu 'slot' bufora współdzielonego.
+    Zwraca tylko liczbę wierszy - macierz nie przechodzi przez pickle.
+    """
+    embeddings = _worker["embedder"].embed_files(
+        jpg_paths, json_paths, occlusion_size, align_with_landmarks, save_paths
+    )
+    _attach_buffer(shm_name, shape)[slot, :len(embeddings)] = embeddings
+    return len(embeddings)
+
+
+class ProcessEmbeddingEngine:
+    """
+    Pula procesów z modelem zamiast puli wątków: każdy proces ma własny model
+    (własną sesję ONNX / graf TF), więc pre/post-processing w Pythonie nie
+    rywalizuje o GIL. Procesy dostają batche ścieżek do plików, a embeddingi
+    oddają przez współdzieloną pamięć (po 2 sloty na proces).
+
+    Udostępnia embed_files jak Embedder; cache embeddingów jest sprawdzany
+    w procesie głównym, więc do procesów trafiają tylko brakujące obrazy.
+    """
+
+    def __init__(self, backend, options, num_workers, intra_op_threads=1, cache_dir=None):
+        self.num_workers = num_workers
+        if intra_op_threads:
+            for var in THREAD_ENV_VARS:
+                os.environ[var] = str(intra_op_threads)
+
+        # 'spawn' - ONNX Runtime / TF nie znoszą forka po inicjalizacji
+        self.executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(backend, options, intra_op_threads)
+        )
+        self.model_id, self.dimension, self.batch_size = self.executor.submit(_worker_info).result()
+        self.name = self.model_id
+
+        self.num_slots = 2 * num_workers
+        shape = (self.num_slots, self.batch_size, self.dimension)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self.slots = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+
+        self.cache = None
+        if cache_dir:
+            self.cache = EmbeddingCache(cache_dir, self.model_id, self.dimension)
+            print(f"Cache embeddingów: {self.cache.vectors_path} ({len(self.cache)} wpisów)")
+
+    def embed_files(self, jpg_paths, json_paths=None, occlusion_size=0,
+                    align_with_landmarks=False, save_paths=None):
+        """Jak Embedder.embed_files, ale rozdziela batche między procesy."""
+        chunks = [(None, jpg_paths, json_paths, save_paths)]
+        for _, embeddings in self.embed_files_stream(chunks, occlusion_size, align_with_landmarks):
+            return embeddings
+
+    def _lookup_chunk(self, jpg_paths, params):
+        """Sprawdza cache dla porcji: zwraca (wyniki z NaN dla braków, klucze, wiersze do policzenia)."""
+        output = np.full((len(jpg_paths), self.dimension), np.nan, dtype=np.float32)
+        if self.cache is None:
+            return output, None, list(range(len(jpg_paths)))
+        keys = []
+        for jpg_path in jpg_paths:
+            image_bytes = read_image_bytes(jpg_path)
+            keys.append(None if not image_bytes else self.cache.make_key(image_bytes, params))
+        output, hits = self.cache.lookup(keys)
+        todo = [i for i, key in enumerate(keys) if key is not None and not hits[i]]
+        return output, keys, todo
+
+    def embed_files_stream(self, chunks, occlusion_size=0, align_with_landmarks=False):
+        """
+        Strumieniowa wersja embed_files. 'chunks' to leniwy iterator krotek
+        (tag, jpg_paths, json_paths, save_paths); zwraca (tag, embeddingi)
+        w kolejności ukończenia. Kolejne porcje są pobierane dopiero, gdy zwolni
+        się slot, więc w pamięci jest najwyżej num_slots batchy niezależnie
+        od długości iteratora.
+        """
+        params = embedding_params(occlusion_size, align_with_landmarks)
+        chunks = iter(chunks)
+        queued = deque()   # (porcja, wiersze) - batche czekające na wolny slot
+        pending = {}       # future -> (slot, porcja, wiersze)
+        free_slots = list(range(self.num_slots))
+
+        def pick(values, rows):
+            return None if values is None else [values[i] for i in rows]
+
+        def finish(chunk):
+            if self.cache is not None and chunk["todo"]:
+                todo = chunk["todo"]
+                self.cache.store([chunk["keys"][i] for i in todo], chunk["output"][todo])
+            return chunk["tag"], chunk["output"]
+
+        exhausted = False
+        while True:
+            # Zapełniamy wolne sloty; nowa porcja jest pobierana tylko, gdy kolejka jest pusta
+            while free_slots and not exhausted:
+                if not queued:
+                    item = next(chunks, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    tag, jpg_paths, json_paths, save_paths = item
+                    jpg_paths = list(jpg_paths)
+                    output, keys, todo = self._lookup_chunk(jpg_paths, params)
+                    chunk = {"tag": tag, "jpg": jpg_paths, "json": json_paths, "save": save_paths,
+                             "output": output, "keys": keys, "todo": todo, "remaining": 0}
+                    if not todo:
+                        yield finish(chunk)
+                        continue
+                    for start in range(0, len(todo), self.batch_size):
+                        queued.append((chunk, todo[start:start + self.batch_size]))
+                        chunk["remaining"] += 1
+                    continue
+
+                chunk, rows = queued.popleft()
+                slot = free_slots.pop()
+                future = self.executor.submit(
+                    _embed_files_task, self.shm.name, self.slots.shape, slot,
+                    pick(chunk["jpg"], rows), pick(chunk["json"], rows), occlusion_size,
+                    align_with_landmarks, pick(chunk["save"], rows)
+                )
+                pending[future] = (slot, chunk, rows)
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                slot, chunk, rows = pending.pop(future)
+                count = future.result()
+                chunk["output"][rows] = self.slots[slot, :count]
+                free_slots.append(slot)
+                chunk["remaining"] -= 1
+                if chunk["remaining"] == 0:
+                    yield finish(chunk)
+
+    def close(self):
+        self.executor.shutdown()
+        self.slots = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
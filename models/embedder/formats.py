@@ -0,0 +1,8 @@
+# Czytniki formatów danych na dysku, które zapisuje przygotowanie datasetu:
+#   annotations.store (annotation_store), archiwa zdjęć shards/ (image_shards), manifest podziału (manifest).
+# Zostają w scripts/download_and_preprocess_dataset, bo obraz Dockera przygotowania danych jest
+# budowany tylko z tamtego katalogu; moduły te wymagają wyłącznie numpy (bez config i kroków s_*).
+# To jedyne miejsce, z którego warstwa modeli je importuje.
+from scripts.download_and_preprocess_dataset.annotation_store import AnnotationStore, STORE_FILE, lookup_annotation
+from scripts.download_and_preprocess_dataset.image_shards import read_packed
+from scripts.download_and_preprocess_dataset.manifest import load_manifest, read_manifest, scan_split
@@ -0,0 +1,77 @@
+import os
+import json
+
+import cv2
+from tqdm import tqdm
+
+from models.embedder.formats import lookup_annotation
+
+
+def read_annotation(json_path):
+    """
+    Adnotacja zdjęcia z s_03_process (bbox, landmarks, confidence) albo None: z magazynu
+    adnotacji podziału (annotations.store, jeden memmap), a bez niego - z pliku .json.
+    """
+    if not json_path:
+        return None
+    annotation = lookup_annotation(json_path)
+    if annotation is not None:
+        return annotation
+    try:
+        with open(json_path, 'r') as jf:
+            annotation = json.load(jf)
+    except Exception:
+        return None
+    if "landmarks" not in annotation or "bbox" not in annotation:
+        return None
+    return annotation
+
+
+def annotation_exists(json_path):
+    """Czy zdjęcie ma adnotację (w magazynie podziału albo jako plik .json)."""
+    return lookup_annotation(json_path) is not None or os.path.exists(json_path)
+
+
+def apply_occlusion(image, landmarks_dict, bbox, occlusion_size):
+    """Nakłada pasek okluzji na wysokości oczu o szerokości twarzy."""
+    occluded_image = image.copy()
+    try:
+        left_eye_y = landmarks_dict["left_eye"][1]
+        right_eye_y = landmarks_dict["right_eye"][1]
+        eye_y_center = int((left_eye_y + right_eye_y) / 2)
+        bar_height_half = occlusion_size // 2
+        x1 = int(bbox[0])
+        y1 = max(0, eye_y_center - bar_height_half)
+        x2 = int(bbox[2])
+        y2 = min(image.shape[0], eye_y_center + bar_height_half)
+        cv2.rectangle(occluded_image, (x1, y1), (x2, y2), (0, 0, 0), -1)
+    except Exception as e:
+        tqdm.write(f"Warning: Błąd podczas nakładania okluzji (np. brak landmarków): {e}")
+        return image.copy()
+    return occluded_image
+
+
+def occlusion_transform(annotations, occlusion_size, save_paths=None):
+    """
+    Transform dla embed_encoded: okluzja i-tego obrazu według i-tej adnotacji,
+    opcjonalnie z zapisem podglądu do save_paths[i].
+    """
+    def transform(image, i):
+        occluded_image = apply_occlusion(image, annotations[i]["landmarks"], annotations[i]["bbox"], occlusion_size)
+        if save_paths is not None and save_paths[i]:
+            try:
+                cv2.imwrite(save_paths[i], occluded_image)
+            except Exception as e:
+                tqdm.write(f"Warning: Nie udało się zapisać obrazu okluzji {save_paths[i]}: {e}")
+        return occluded_image
+    return transform
+
+
+def embedding_params(occlusion_size=0, align_with_landmarks=False):
+    """Opis przetwarzania obrazu przed modelem - część klucza w EmbeddingCache."""
+    params = []
+    if occlusion_size:
+        params.append(f"occlusion={occlusion_size}")
+    if align_with_landmarks:
+        params.append("landmarks")
+    return ";".join(params)
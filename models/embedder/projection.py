@@ -0,0 +1,90 @@
+import faiss
+import numpy as np
+
+from models.embedder.base import Embedder, l2_normalize, valid_rows
+
+# Projekcje embeddingów do mniejszego wymiaru (faiss.VectorTransform, zapis write_VectorTransform):
+#   "pca"        - PCA (rzut na główne składowe),
+#   "pca_whiten" - PCA z wybielaniem (składowe skalowane 1 / sqrt(wariancja)),
+#   "random"     - losowa rotacja + obcięcie (bez uczenia).
+# Wynik projekcji jest ponownie normalizowany, więc iloczyn skalarny = podobieństwo kosinusowe.
+PROJECTIONS = ("pca", "pca_whiten", "random")
+
+
+def fit_projection(embeddings, method="pca", dimension=256, seed=0):
+    """Dopasowuje projekcję do macierzy embeddingów (N, D) - wiersze NaN są pomijane."""
+    if method not in PROJECTIONS:
+        raise ValueError(f"Nieznana projekcja '{method}' (dostępne: {', '.join(PROJECTIONS)})")
+    embeddings = np.ascontiguousarray(embeddings[valid_rows(embeddings)], dtype=np.float32)
+    input_dimension = embeddings.shape[1]
+    if dimension > input_dimension:
+        raise ValueError(f"Wymiar projekcji {dimension} większy niż wymiar embeddingu {input_dimension}")
+    if method == "random":
+        transform = faiss.RandomRotationMatrix(input_dimension, dimension)
+        transform.init(seed)
+        return transform
+    if len(embeddings) < dimension:
+        raise ValueError(f"PCA do {dimension} wymiarów wymaga co najmniej {dimension} embeddingów (jest {len(embeddings)})")
+    transform = faiss.PCAMatrix(input_dimension, dimension, -0.5 if method == "pca_whiten" else 0.0)
+    transform.train(l2_normalize(embeddings))
+    return transform
+
+
+def save_projection(transform, path):
+    faiss.write_VectorTransform(transform, path)
+
+
+def load_projection(path):
+    return faiss.read_VectorTransform(path)
+
+
+def project(transform, embeddings):
+    """
+    Rzutuje i normalizuje wiersze (N, D) -> (N, d_out); wiersze NaN zostają NaN.
+    Wejście jest normalizowane przed projekcją - jak przy dopasowaniu (fit_projection).
+    """
+    output = np.full((len(embeddings), transform.d_out), np.nan, dtype=np.float32)
+    rows = valid_rows(embeddings)
+    if rows.any():
+        normalized = l2_normalize(np.ascontiguousarray(embeddings[rows], dtype=np.float32))
+        output[rows] = l2_normalize(transform.apply(np.ascontiguousarray(normalized)))
+    return output
+
+
+class ProjectedEmbedder(Embedder):
+    """
+    Embedder z projekcją: embed_batch / embed_encoded zwracają embeddingi po projekcji,
+    więc galeria i zapytania mają ten sam (mniejszy) wymiar. Opakowuje też CachedEmbedder -
+    cache trzyma wtedy embeddingi przed projekcją (zmiana projekcji nie unieważnia cache).
+    """
+
+    # Bez cache widocznego z zewnątrz (przez __getattr__ byłby cache opakowanego modelu):
+    # models.pipeline zapisywałby do niego embeddingi po projekcji, o innym wymiarze
+    cache = None
+
+    def __init__(self, embedder, transform):
+        self.embedder = embedder
+        self.transform = transform
+        self.name = embedder.name
+        self.dimension = transform.d_out
+        self.batch_size = embedder.batch_size
+
+    def __getattr__(self, attribute):
+        return getattr(self.embedder, attribute)
+
+    @property
+    def model_id(self):
+        return f"{self.embedder.model_id}+proj{self.dimension}"
+
+    def embed_batch(self, images, landmarks=None):
+        return project(self.transform, self.embedder.embed_batch(images, landmarks))
+
+    def embed_encoded(self, images_bytes, params="", transform=None, landmarks=None):
+        return project(self.transform, self.embedder.embed_encoded(images_bytes, params, transform, landmarks))
+
+
+def with_projection(embedder, transform):
+    """Opakowuje embedder w ProjectedEmbedder (albo zwraca go bez zmian, gdy transform jest None)."""
+    if transform is None:
+        return embedder
+    return ProjectedEmbedder(embedder, transform)
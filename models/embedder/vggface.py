@@ -0,0 +1,123 @@
+import inspect
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tqdm import tqdm
+from keras_vggface.vggface import VGGFace
+from keras_vggface.utils import preprocess_input
+from mtcnn.mtcnn import MTCNN
+
+from models.embedder.base import Embedder
+from models.embedder.batching import DynamicBatcher
+
+
+class VGGFaceEmbedder(Embedder):
+    """
+    MTCNN + VGGFace (RESNET-50, pooling='avg'), embedding 2048-d.
+
+    MTCNN i model Keras nie są bezpieczne dla wątków, więc używa ich tylko wątek
+    DynamicBatcher: obrazy z wielu wątków (np. NUM_WORKERS w run_eval.py) są zbierane
+    w batche do batch_size obrazów albo batch_wait sekund, wykrywane razem i liczone
+    jednym wywołaniem skompilowanej tf.function zamiast predict() obraz po obrazie.
+    """
+
+    name = "vggface"
+    dimension = 2048
+    input_size = (224, 224)
+
+    def __init__(self, model="resnet50", batch_size=32, batch_wait=0.005, intra_op_threads=None):
+        self.model = model
+        self.batch_size = batch_size
+
+        # Musi być ustawione przed pierwszą operacją TF
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+
+        # Upewnij się, że TF widzi GPU
+        gpus = tf.config.experimental.list_physical_devices('GPU')
+        if gpus:
+            for gpu in gpus:
+                tf.config.experimental.set_memory_growth(gpu, True)
+            print(f"Znaleziono i skonfigurowano {len(gpus)} kart GPU.")
+        else:
+            print("OSTRZEŻENIE: Nie znaleziono GPU. Skrypt będzie działał bardzo wolno na CPU.")
+
+        print("Ładowanie detektora MTCNN... (to może potrwać chwilę)")
+        self.detector = MTCNN()
+        # mtcnn >= 1.0 przyjmuje batch obrazów (parametr batch_stride), starsze wersje - jeden obraz
+        self.batch_detection = "batch_stride" in inspect.signature(self.detector.detect_faces).parameters
+
+        print(f"Ładowanie modelu VGGFace ({model.upper()})... (to może potrwać chwilę)")
+        # Bez górnych warstw klasyfikacyjnych - 'pooling="avg"' daje gotowy wektor cech
+        self.vgg_model = VGGFace(model=model,
+                                 include_top=False,
+                                 input_shape=self.input_size + (3,),
+                                 pooling='avg')
+        # Jeden graf dla dowolnej liczby twarzy (bez narzutu predict() i ponownego śledzenia)
+        self._forward = tf.function(
+            lambda faces: self.vgg_model(faces, training=False),
+            input_signature=[tf.TensorSpec((None,) + self.input_size + (3,), tf.float32)]
+        )
+
+        self.batcher = DynamicBatcher(self._embed_faces, batch_size, batch_wait, name="vggface-inference")
+
+    @property
+    def model_id(self):
+        return f"{self.name}-{self.model}"
+
+    def _detect(self, images_rgb):
+        """Lista wykryć (jak MTCNN.detect_faces) dla każdego obrazu."""
+        if not self.batch_detection:
+            return [self.detector.detect_faces(image) for image in images_rgb]
+        # Batch MTCNN wymaga obrazów jednego rozmiaru - grupujemy po kształcie
+        detections = [None] * len(images_rgb)
+        groups = {}
+        for i, image in enumerate(images_rgb):
+            groups.setdefault(image.shape, []).append(i)
+        for rows in groups.values():
+            if len(rows) == 1:
+                detections[rows[0]] = self.detector.detect_faces(images_rgb[rows[0]])
+                continue
+            for i, faces in zip(rows, self.detector.detect_faces([images_rgb[i] for i in rows])):
+                detections[i] = faces
+        return detections
+
+    def _embed_faces(self, images_rgb):
+        """Wątek batchera: detekcja + jedno wywołanie modelu dla całego batcha -> wektor albo None na obraz."""
+        crops, rows = [], []
+        for i, (image, detections) in enumerate(zip(images_rgb, self._detect(images_rgb))):
+            if not detections:
+                continue
+            # Pierwsza, największa twarz
+            x, y, w, h = detections[0]['box']
+            x1, y1 = max(0, x), max(0, y)
+            x2, y2 = min(image.shape[1], x + w), min(image.shape[0], y + h)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crops.append(cv2.resize(image[y1:y2, x1:x2], self.input_size))
+            rows.append(i)
+
+        results = [None] * len(images_rgb)
+        if crops:
+            # Preprocessing w wersji 2 (RESNET/SENET)
+            faces = preprocess_input(np.stack(crops).astype('float32'), version=2)
+            embeddings = self._forward(tf.constant(faces)).numpy()
+            for i, embedding in zip(rows, embeddings):
+                results[i] = embedding
+        return results
+
+    def _embed_chunk(self, images, landmarks=None):
+        chunk = np.full((len(images), self.dimension), np.nan, dtype=np.float32)
+        futures = [(i, self.batcher.submit(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)))
+                   for i, image_bgr in enumerate(images) if image_bgr is not None]
+        for i, future in futures:
+            try:
+                embedding = future.result()
+            except Exception as e:
+                tqdm.write(f"Warning: Błąd podczas pobierania embeddingu ({self.name}): {e}")
+                continue
+            if embedding is not None:
+                chunk[i] = embedding
+        return chunk
@@ -2,11 +2,14 @@ import csv
 import sys
 import numpy as np
 from sklearn.metrics import roc_auc_score, roc_curve, accuracy_score
-from models.ArcFace_Large.evaluation.config import BASE_FOLDER_LOCAL # Import tylko dla spójności, nieużywany
+from models.evaluate_calculate_metrics.score_format import load_scores, scores_exist, HEADER_SUFFIX
+from models.evaluate_calculate_metrics.histogram_metrics import histogram_from_chunks
 
-def calculate_verification_metrics(csv_file):
-    print(f"Wczytywanie wyników weryfikacji z: {csv_file}")
-    
+THRESHOLDS_TO_TEST = [0.1, 0.2, 0.25, 0.3, 0.4] # Progi zasugerowane przez Ciebie
+FAR_TARGETS = [0.1, 0.01, 0.001] # 10%, 1%, 0.1%
+
+def load_csv_scores(csv_file):
+    """Stary format: verification_scores.csv z kolumnami score, label."""
     scores = []
     labels = [] # 1 dla 'genuine', 0 dla 'imposter'
     
@@ -24,30 +27,100 @@ def calculate_verification_metrics(csv_file):
         print(f"BŁĄD: Nie znaleziono pliku {csv_file}")
         print("Upewnij się, że najpierw uruchomiłeś 'run_verification.py'.")
         sys.exit(1)
-        
-    if not labels:
-        print("BŁĄD: Plik CSV jest pusty. Nie ma danych do analizy.")
-        return
 
-    y_true = np.array(labels)
-    y_scores = np.array(scores)
-    
-    num_genuine = np.sum(y_true == 1)
-    num_imposter = np.sum(y_true == 0)
+    return np.array(scores), np.array(labels)
+
+def load_exact_scores(scores_path):
+    """Wczytuje wszystkie pary do pamięci: (y_scores, y_true, wagi albo None)."""
+    if scores_path.endswith(".csv"):
+        return load_csv_scores(scores_path) + (None,)
+    score_file = load_scores(scores_path)
+    # Wyniki: np.memmap prosto z pliku (bez kopiowania); etykiety: rozpakowana bitmapa
+    return score_file.scores, score_file.labels().astype(np.uint8), score_file.weights
+
+def load_score_histogram(scores_path):
+    """Buduje histogram wyników porcja po porcji (pamięć nie zależy od liczby par)."""
+    if scores_path.endswith(".csv"):
+        return histogram_from_chunks([load_csv_scores(scores_path)])
+    return histogram_from_chunks(load_scores(scores_path).iter_chunks())
+
+def calculate_verification_metrics(scores_path, exact=False):
+    """
+    scores_path: bazowa ścieżka wyników kolumnowych (score_format.ScoreWriter:
+    .json + .f32 + .bits) albo stary plik .csv.
+    exact=False: metryki z histogramu (histogram_metrics.ScoreHistogram) z podanym
+    ograniczeniem błędu; exact=True: dokładne metryki sklearn (wszystkie pary w RAM).
+    Jeśli pary imposter były próbkowane (kolumna wag .w32), każda para liczy się
+    z wagą ważności, więc metryki szacują wynik dla wszystkich par.
+    """
+    print(f"Wczytywanie wyników weryfikacji z: {scores_path}")
+
+    if not scores_path.endswith(".csv") and not scores_exist(scores_path):
+        print(f"BŁĄD: Nie znaleziono nagłówka wyników {scores_path}{HEADER_SUFFIX}")
+        print("Upewnij się, że najpierw uruchomiłeś 'run_verification.py'.")
+        sys.exit(1)
+
+    weighted = not scores_path.endswith(".csv") and load_scores(scores_path).weights is not None
+    if exact:
+        y_scores, y_true, weights = load_exact_scores(scores_path)
+        w = 1 if weights is None else weights
+        num_genuine = int(round(np.sum(w * (y_true == 1))))
+        num_imposter = int(round(np.sum(w * (y_true == 0))))
+    else:
+        histogram = load_score_histogram(scores_path)
+        num_genuine = int(round(histogram.num_genuine))
+        num_imposter = int(round(histogram.num_imposter))
+
+    if num_genuine + num_imposter == 0:
+        print("BŁĄD: Plik wyników jest pusty. Nie ma danych do analizy.")
+        return
 
     print("\n--- Wyniki Weryfikacji (1:1) ---")
-    print(f"Całkowita liczba par: {len(y_true)}")
+    print(f"Całkowita liczba par: {num_genuine + num_imposter}")
     print(f"Pary 'Genuine' (ja vs ja):    {num_genuine}")
     print(f"Pary 'Imposter' (ja vs obcy): {num_imposter}")
-    
+    if weighted:
+        print("(Pary imposter były próbkowane - liczby to sumy wag, czyli szacunek dla wszystkich par)")
+
     if num_genuine == 0 or num_imposter == 0:
         print("BŁĄD: Do obliczenia ROC-AUC potrzeba zarówno par genuine, jak i imposter.")
         return
 
+    if exact:
+        exact_metrics(y_scores, y_true, weights)
+    else:
+        histogram_metrics(histogram)
+    print("(Mówi nam, jak dobry jest system: np. 'Przy 1% fałszywych alarmów, system poprawnie rozpoznaje 95% prawdziwych użytkowników')")
+
+def histogram_metrics(histogram):
+    """Te same metryki co exact_metrics, liczone z histogramu (z ograniczeniem błędu)."""
+    # --- 1. Metryka: ROC-AUC ---
+    auc, auc_bound = histogram.roc_auc()
+    print(f"\n--- Metryka: ROC-AUC ---")
+    print(f"ROC-AUC: {auc:.6f} (± {auc_bound:.2e})")
+    print("(Im bliżej 1.0, tym model jest lepszy w odróżnianiu osób)")
+
+    # --- 2. Metryka: Verification Accuracy @ Progi ---
+    print(f"\n--- Metryka: Verification Accuracy (Celność Weryfikacji) ---")
+    for threshold in THRESHOLDS_TO_TEST:
+        tp, tn, fp, fn, bound = histogram.confusion(threshold)
+        acc = (tp + tn) / (tp + tn + fp + fn)
+        print(f"  Celność @ Próg {threshold}: {acc * 100:.2f}% (± {bound * 100:.2e}%)")
+        print(f"    (TP: {tp:.0f}, TN: {tn:.0f}, FP: {fp:.0f}, FN: {fn:.0f})")
+
+    # --- 3. Metryka: TAR @ FAR ---
+    print(f"\n--- Metryka: TAR @ FAR (True Accept Rate @ False Accept Rate) ---")
+    for far_target in FAR_TARGETS:
+        tar, threshold, far, bound = histogram.tar_at_far(far_target)
+        print(f"  TAR @ FAR = {far_target * 100:g}% : {tar * 100:.2f}% (+ do {bound * 100:.2e}%, przy progu ~{threshold:.4f}, FAR {far * 100:.4f}%)")
+
+def exact_metrics(y_scores, y_true, weights=None):
+    """Dokładne metryki sklearn (sortowanie wszystkich par w pamięci; weights = wagi par)."""
+    w = 1 if weights is None else weights
     # --- 1. Metryka: ROC-AUC ---
     # Ogólna jakość embeddingów
     try:
-        auc = roc_auc_score(y_true, y_scores)
+        auc = roc_auc_score(y_true, y_scores, sample_weight=weights)
         print(f"\n--- Metryka: ROC-AUC ---")
         print(f"ROC-AUC: {auc:.6f}")
         print("(Im bliżej 1.0, tym model jest lepszy w odróżnianiu osób)")
@@ -57,34 +130,30 @@ def calculate_verification_metrics(csv_file):
     # --- 2. Metryka: Verification Accuracy @ Progi ---
     # Proste "działa/nie działa"
     print(f"\n--- Metryka: Verification Accuracy (Celność Weryfikacji) ---")
-    thresholds_to_test = [0.1, 0.2, 0.25, 0.3, 0.4] # Progi zasugerowane przez Ciebie
-    
-    for threshold in thresholds_to_test:
+    for threshold in THRESHOLDS_TO_TEST:
         # Przewidujemy '1' (ta sama osoba) jeśli wynik jest POWYŻEJ progu
         y_pred = (y_scores >= threshold).astype(int)
-        acc = accuracy_score(y_true, y_pred)
+        acc = accuracy_score(y_true, y_pred, sample_weight=weights)
         
         # Obliczamy dodatkowe statystyki dla tego progu
-        tp = np.sum((y_pred == 1) & (y_true == 1)) # True Positive
-        tn = np.sum((y_pred == 0) & (y_true == 0)) # True Negative
-        fp = np.sum((y_pred == 1) & (y_true == 0)) # False Positive
-        fn = np.sum((y_pred == 0) & (y_true == 1)) # False Negative
+        tp = np.sum(w * ((y_pred == 1) & (y_true == 1))) # True Positive
+        tn = np.sum(w * ((y_pred == 0) & (y_true == 0))) # True Negative
+        fp = np.sum(w * ((y_pred == 1) & (y_true == 0))) # False Positive
+        fn = np.sum(w * ((y_pred == 0) & (y_true == 1))) # False Negative
         
         print(f"  Celność @ Próg {threshold}: {acc * 100:.2f}%")
-        print(f"    (TP: {tp}, TN: {tn}, FP: {fp}, FN: {fn})")
+        print(f"    (TP: {tp:.0f}, TN: {tn:.0f}, FP: {fp:.0f}, FN: {fn:.0f})")
         
     # --- 3. Metryka: TAR @ FAR ---
     # Naukowa ocena jakości
     print(f"\n--- Metryka: TAR @ FAR (True Accept Rate @ False Accept Rate) ---")
     
     # Obliczamy krzywą ROC
-    fpr_all, tpr_all, thresholds_all = roc_curve(y_true, y_scores)
+    fpr_all, tpr_all, thresholds_all = roc_curve(y_true, y_scores, sample_weight=weights)
     # FPR = FAR (False Accept Rate)
     # TPR = TAR (True Accept Rate)
     
-    far_targets = [0.1, 0.01, 0.001] # 10%, 1%, 0.1%
-    
-    for far_target in far_targets:
+    for far_target in FAR_TARGETS:
         try:
             # Znajdź pierwszy indeks, gdzie FPR jest <= nasz cel
             # (np. 0.01)
@@ -108,9 +177,10 @@ def calculate_verification_metrics(csv_file):
             
         except Exception as e:
             print(f"Błąd przy obliczaniu TAR@FAR={far_target}: {e}")
-            
-    print("(Mówi nam, jak dobry jest system: np. 'Przy 1% fałszywych alarmów, system poprawnie rozpoznaje 95% prawdziwych użytkowników')")
     
 
 if __name__ == "__main__":
-    calculate_verification_metrics("verification_scores.csv")
\ No newline at end of file
+    # Bazowa ścieżka wyników binarnych (albo stary plik 'verification_scores.csv')
+    # --exact: dokładne metryki sklearn zamiast histogramu (wymaga wszystkich par w RAM)
+    args = [arg for arg in sys.argv[1:] if arg != "--exact"]
+    calculate_verification_metrics(args[0] if args else "verification_scores", exact="--exact" in sys.argv)
\ No newline at end of file
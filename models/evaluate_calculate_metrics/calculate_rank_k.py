@@ -2,7 +2,8 @@ import csv
 import sys
 from models.ArcFace_Large.evaluation.config import RESULTS_CSV # Importuje nazwę pliku z config
 
-def calculate_rank_k_accuracy(csv_file):
+def rank_k_counts(csv_file):
+    """Zwraca (liczba zapytań, trafienia Rank-1, trafienia Rank-3) z pliku CSV wyników."""
     print(f"Wczytywanie wyników z: {csv_file}")
     
     total_queries = 0
@@ -37,6 +38,11 @@ def calculate_rank_k_accuracy(csv_file):
     except Exception as e:
         print(f"BŁĄD: Wystąpił błąd podczas czytania pliku CSV: {e}")
         sys.exit(1)
+
+    return total_queries, rank1_correct, rank3_correct
+
+def calculate_rank_k_accuracy(csv_file):
+    total_queries, rank1_correct, rank3_correct = rank_k_counts(csv_file)
         
     if total_queries == 0:
         print("BŁĄD: Plik CSV jest pusty. Nie ma danych do analizy.")
@@ -54,5 +60,29 @@ def calculate_rank_k_accuracy(csv_file):
     print(f"Rank-1 Accuracy (Recall@1): {rank1_acc:.2f}%")
     print(f"Rank-3 Accuracy (Recall@3): {rank3_acc:.2f}%")
 
+def compare_rank_k(baseline_csv, csv_file):
+    """Rank-1 / Rank-3 dwóch plików wyników i ich różnica (np. galeria bez kompresji vs skompresowana)."""
+    accuracies = []
+    for path in (baseline_csv, csv_file):
+        total_queries, rank1_correct, rank3_correct = rank_k_counts(path)
+        if total_queries == 0:
+            print(f"BŁĄD: Plik CSV {path} jest pusty. Nie ma danych do porównania.")
+            return
+        accuracies.append((rank1_correct / total_queries * 100, rank3_correct / total_queries * 100))
+    (base_rank1, base_rank3), (rank1, rank3) = accuracies
+
+    print("\n--- Porównanie Identyfikacji (1:N) ---")
+    print(f"Rank-1 Accuracy: {base_rank1:.2f}% -> {rank1:.2f}% ({rank1 - base_rank1:+.2f} pp)")
+    print(f"Rank-3 Accuracy: {base_rank3:.2f}% -> {rank3:.2f}% ({rank3 - base_rank3:+.2f} pp)")
+
 if __name__ == "__main__":
-    calculate_rank_k_accuracy(RESULTS_CSV)
\ No newline at end of file
+    # python -m models.evaluate_calculate_metrics.calculate_rank_k [wyniki.csv] [--compare punkt_odniesienia.csv]
+    if "--compare" in sys.argv:
+        position = sys.argv.index("--compare")
+        if position + 1 >= len(sys.argv) or sys.argv[position + 1].startswith("--"):
+            print("Użycie: python -m models.evaluate_calculate_metrics.calculate_rank_k [wyniki.csv] [--compare punkt_odniesienia.csv]")
+            sys.exit(1)
+        other_args = sys.argv[1:position] + sys.argv[position + 2:]
+        compare_rank_k(sys.argv[position + 1], other_args[0] if other_args else RESULTS_CSV)
+    else:
+        calculate_rank_k_accuracy(sys.argv[1] if len(sys.argv) > 1 else RESULTS_CSV)
\ No newline at end of file
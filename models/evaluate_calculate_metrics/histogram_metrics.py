@@ -0,0 +1,110 @@
+import numpy as np
+
+# Podobieństwo kosinusowe znormalizowanych embeddingów leży w [-1, 1].
+# 2^16 przedziałów -> szerokość ~3.05e-5, dwie tablice float64 = 1 MB RAM.
+DEFAULT_LOW = -1.0
+DEFAULT_HIGH = 1.0
+DEFAULT_BINS = 1 << 16
+
+
+class ScoreHistogram:
+    """
+    Metryki weryfikacji liczone strumieniowo z histogramów wyników genuine
+    i imposter o stałej rozdzielczości (add() porcja po porcji - pamięć
+    nie zależy od liczby par, brak sortowania).
+
+    Ograniczenia błędu (w = (high - low) / bins, G/I = liczba par genuine/imposter,
+    g_b/i_b = liczba par genuine/imposter w przedziale b):
+      - progi są wyznaczane z dokładnością do w (krawędzie przedziałów);
+      - ROC-AUC: pary genuine/imposter z tego samego przedziału liczone są jako
+        remis (0.5), więc |AUC - AUC_dokładne| <= 0.5 * sum_b(g_b * i_b) / (G * I);
+      - TAR@FAR: wynik jest dokładny dla progu na krawędzi przedziału; dokładny próg
+        może leżeć o jeden przedział niżej, więc TAR jest zaniżony najwyżej o g_b / G
+        tego przedziału (FAR nigdy nie przekracza celu);
+      - celność @ próg: niepewne są tylko pary z przedziału zawierającego próg,
+        błąd <= (g_b + i_b) / (G + I).
+    Wszystkie ograniczenia są zwracane razem z metrykami (liczone z danych).
+    Przy próbkowanych parach (wagi ważności) G, I, g_b, i_b to sumy wag -
+    metryki są wtedy nieobciążonymi estymatorami wartości dla wszystkich par.
+    Wyniki spoza [low, high] trafiają do skrajnych przedziałów.
+    """
+
+    def __init__(self, low=DEFAULT_LOW, high=DEFAULT_HIGH, bins=DEFAULT_BINS):
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.width = (high - low) / bins
+        self.genuine = np.zeros(bins, dtype=np.float64)
+        self.imposter = np.zeros(bins, dtype=np.float64)
+
+    def _bin(self, scores):
+        index = np.floor((np.asarray(scores, dtype=np.float64) - self.low) / self.width)
+        return np.clip(index, 0, self.bins - 1).astype(np.int64)
+
+    def add(self, scores, labels, weights=None):
+        """Dodaje porcję wyników (labels: bool/0-1, 1 = genuine; weights: waga pary, domyślnie 1)."""
+        index = self._bin(scores)
+        labels = np.asarray(labels, dtype=bool)
+        if weights is None:
+            self.genuine += np.bincount(index[labels], minlength=self.bins)
+            self.imposter += np.bincount(index[~labels], minlength=self.bins)
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            self.genuine += np.bincount(index[labels], weights=weights[labels], minlength=self.bins)
+            self.imposter += np.bincount(index[~labels], weights=weights[~labels], minlength=self.bins)
+
+    @property
+    def num_genuine(self):
+        return self.genuine.sum()
+
+    @property
+    def num_imposter(self):
+        return self.imposter.sum()
+
+    def edge(self, bin_index):
+        """Dolna krawędź przedziału (próg: akceptujemy wyniki >= edge)."""
+        return self.low + bin_index * self.width
+
+    def _accepted(self, counts):
+        """accepted[k] = liczba par w przedziałach >= k (czyli zaakceptowanych przy progu edge(k))."""
+        return np.cumsum(counts[::-1])[::-1]
+
+    def roc_auc(self):
+        """Zwraca (ROC-AUC, ograniczenie błędu)."""
+        G, I = self.num_genuine, self.num_imposter
+        imposter_below = np.cumsum(self.imposter) - self.imposter
+        ties = np.dot(self.genuine, self.imposter)
+        auc = (np.dot(self.genuine, imposter_below) + 0.5 * ties) / (G * I)
+        return auc, 0.5 * ties / (G * I)
+
+    def tar_at_far(self, far_target):
+        """Zwraca (TAR, próg, rzeczywisty FAR, ograniczenie błędu TAR) dla celu FAR."""
+        far = self._accepted(self.imposter) / self.num_imposter
+        tar = self._accepted(self.genuine) / self.num_genuine
+        # Najniższy próg (krawędź), przy którym FAR <= cel - FAR maleje wraz z k
+        k = int(np.searchsorted(-far, -far_target, side='left'))
+        if k >= self.bins:
+            return 0.0, self.high, 0.0, self.genuine[-1] / self.num_genuine
+        bound = self.genuine[k - 1] / self.num_genuine if k > 0 else 0.0
+        return tar[k], self.edge(k), far[k], bound
+
+    def confusion(self, threshold):
+        """Zwraca (TP, TN, FP, FN, ograniczenie błędu celności) dla progu (score >= próg -> genuine)."""
+        k = int(self._bin([threshold])[0])
+        on_edge = bool(np.isclose(threshold, self.edge(k)))
+        # Przedział zawierający próg (jeśli próg nie jest jego krawędzią) liczymy jako odrzucony
+        first_accepted = k if on_edge else k + 1
+        tp = self.genuine[first_accepted:].sum()
+        fp = self.imposter[first_accepted:].sum()
+        fn = self.num_genuine - tp
+        tn = self.num_imposter - fp
+        uncertain = 0.0 if on_edge else self.genuine[k] + self.imposter[k]
+        return tp, tn, fp, fn, uncertain / (self.num_genuine + self.num_imposter)
+
+
+def histogram_from_chunks(chunks, low=DEFAULT_LOW, high=DEFAULT_HIGH, bins=DEFAULT_BINS):
+    """Buduje ScoreHistogram z iteratora porcji (scores, labels[, weights]), np. ScoreFile.iter_chunks()."""
+    histogram = ScoreHistogram(low, high, bins)
+    for chunk in chunks:
+        histogram.add(*chunk)
+    return histogram
@@ -0,0 +1,143 @@
+import os
+import json
+
+import numpy as np
+
+# Kolumnowy zapis wyników weryfikacji zamiast verification_scores.csv:
+#   <base>.f32  - wyniki (score) jako float32, para po parze (czytane przez np.memmap),
+#   <base>.bits - etykiety jako upakowana bitmapa (np.packbits, bit = 1 -> genuine),
+#   <base>.w32  - (opcjonalnie) wagi par jako float32, gdy pary imposter są próbkowane
+#                 (waga = odwrotność prawdopodobieństwa wylosowania pary),
+#   <base>.json - nagłówek: liczba par, liczba par genuine, nazwy plików kolumn.
+# 100 mln par to ~400 MB wyników + ~12 MB etykiet zamiast kilku GB tekstu.
+FORMAT_NAME = "verification-scores"
+FORMAT_VERSION = 3
+SCORES_SUFFIX = ".f32"
+LABELS_SUFFIX = ".bits"
+WEIGHTS_SUFFIX = ".w32"
+HEADER_SUFFIX = ".json"
+
+
+class ScoreWriter:
+    """
+    Strumieniowo dopisuje bloki (scores, labels). Etykiety są pakowane po 8;
+    reszta (< 8) czeka na następny blok, a close() dopisuje ją z dopełnieniem
+    i zapisuje nagłówek (bez nagłówka plik nie jest uznawany za kompletny).
+    weighted=True dodaje kolumnę wag (write() bez wag zapisuje wagę 1).
+    """
+
+    def __init__(self, base_path, weighted=False):
+        self.base_path = base_path
+        self.weighted = weighted
+        self.count = 0
+        self.num_genuine = 0
+        self._pending_labels = np.zeros(0, dtype=bool)
+        self._scores = open(base_path + SCORES_SUFFIX, 'wb')
+        self._labels = open(base_path + LABELS_SUFFIX, 'wb')
+        self._weights = open(base_path + WEIGHTS_SUFFIX, 'wb') if weighted else None
+        if os.path.exists(base_path + HEADER_SUFFIX):
+            os.remove(base_path + HEADER_SUFFIX)
+
+    def write(self, scores, labels, weights=None):
+        scores = np.asarray(scores, dtype=np.float32).ravel()
+        labels = np.asarray(labels, dtype=bool).ravel()
+        scores.tofile(self._scores)
+        if self._weights is not None:
+            if weights is None:
+                weights = np.ones(len(scores), dtype=np.float32)
+            np.asarray(weights, dtype=np.float32).ravel().tofile(self._weights)
+        elif weights is not None:
+            raise ValueError("Wagi par wymagają ScoreWriter(..., weighted=True)")
+
+        labels = np.concatenate([self._pending_labels, labels])
+        full = len(labels) - len(labels) % 8
+        np.packbits(labels[:full]).tofile(self._labels)
+        self._pending_labels = labels[full:]
+
+        self.count += len(scores)
+        self.num_genuine += int(np.count_nonzero(labels[len(labels) - len(scores):]))
+
+    def close(self):
+        if len(self._pending_labels):
+            np.packbits(self._pending_labels).tofile(self._labels)
+            self._pending_labels = np.zeros(0, dtype=bool)
+        self._scores.close()
+        self._labels.close()
+        if self._weights is not None:
+            self._weights.close()
+        header = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "count": self.count,
+            "num_genuine": self.num_genuine,
+            "scores": os.path.basename(self.base_path + SCORES_SUFFIX),
+            "labels": os.path.basename(self.base_path + LABELS_SUFFIX),
+            "weights": os.path.basename(self.base_path + WEIGHTS_SUFFIX) if self.weighted else None,
+        }
+        with open(self.base_path + HEADER_SUFFIX, 'w') as f:
+            json.dump(header, f, indent=4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScoreFile:
+    """
+    Wyniki zapisane przez ScoreWriter, zmapowane z dysku (np.memmap - bez kopiowania).
+    'scores' to gotowa tablica float32, etykiety są rozpakowywane na żądanie:
+    labels(start, stop) albo iter_chunks() - kawałek po kawałku.
+    'weights' to wagi par (float32) albo None, gdy zapisano wszystkie pary.
+    """
+
+    def __init__(self, base_path):
+        with open(base_path + HEADER_SUFFIX, 'r') as f:
+            header = json.load(f)
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError(f"{base_path}{HEADER_SUFFIX} nie jest nagłówkiem wyników weryfikacji")
+
+        folder = os.path.dirname(base_path)
+        self.count = header["count"]
+        self.num_genuine = header["num_genuine"]
+        self.num_imposter = self.count - self.num_genuine
+        self.scores = self._map(os.path.join(folder, header["scores"]), np.float32, self.count)
+        self.label_bits = self._map(os.path.join(folder, header["labels"]), np.uint8, (self.count + 7) // 8)
+        # Wersja 2 nie miała kolumny wag
+        weights_file = header.get("weights")
+        self.weights = self._map(os.path.join(folder, weights_file), np.float32, self.count) if weights_file else None
+
+    @staticmethod
+    def _map(path, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return self.count
+
+    def labels(self, start=0, stop=None):
+        """Etykiety bool dla par [start, stop) - start musi być wielokrotnością 8."""
+        stop = self.count if stop is None else min(stop, self.count)
+        if start % 8:
+            raise ValueError("Początek zakresu etykiet musi być wielokrotnością 8")
+        bits = self.label_bits[start // 8:(stop + 7) // 8]
+        return np.unpackbits(bits, count=stop - start).astype(bool)
+
+    def iter_chunks(self, chunk_size=1 << 24):
+        """Zwraca kolejne (scores, labels, weights) po chunk_size par (weights = None bez kolumny wag)."""
+        chunk_size = max(8, chunk_size - chunk_size % 8)
+        for start in range(0, self.count, chunk_size):
+            stop = min(start + chunk_size, self.count)
+            weights = None if self.weights is None else self.weights[start:stop]
+            yield self.scores[start:stop], self.labels(start, stop), weights
+
+
+def load_scores(base_path):
+    """Otwiera wyniki zapisane przez ScoreWriter (ScoreFile)."""
+    return ScoreFile(base_path)
+
+
+def scores_exist(base_path):
+    return os.path.exists(base_path + HEADER_SUFFIX)
@@ -1,11 +1,10 @@
 # pip install scikit-learn matplotlib
 
 import faiss
-import json
-import numpy as np
 from sklearn.manifold import TSNE
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm # Importujemy do obsługi map kolorów
+from models.gallery import load_id_map, gallery_vectors
 
 def visualize_faiss_index(index_file, map_file, output_image):
     print(f"Wczytywanie indeksu z {index_file}...")
@@ -18,8 +17,8 @@ def visualize_faiss_index(index_file, map_file, output_image):
 
     print(f"Wczytywanie mapowania ID z {map_file}...")
     try:
-        with open(map_file, 'r') as f:
-            id_map = json.load(f)
+        # Mapowanie z tablic <map_file>_ids.npy / _labels.npy (albo stary plik .json)
+        id_map = load_id_map(map_file)
     except Exception as e:
         print(f"BŁĄD: Nie można wczytać pliku {map_file}.")
         print(f"Error: {e}")
@@ -35,15 +34,16 @@ def visualize_faiss_index(index_file, map_file, output_image):
 
     print(f"Wyciąganie {num_vectors} wektorów (o wymiarze {dimension}) z indeksu...")
     try:
-        vectors = index.reconstruct_n(0, num_vectors)
+        # Wektory razem z ich ID FAISS (także dla galerii przyrostowej ze stałymi ID)
+        vectors, ids = gallery_vectors(index)
     except RuntimeError:
-        print("BŁĄD: Tego typu indeks FAISS nie wspiera 'reconstruct_n'.")
+        print("BŁĄD: Tego typu indeks FAISS nie wspiera odtwarzania wektorów.")
         print("Upewnij się, że używasz IndexFlatIP.")
         return
 
     # Krok 2: Przygotuj etykiety i kolory
     # Tworzymy listę etykiet ['id_3', 'id_5', ...] we właściwej kolejności
-    labels = [id_map.get(str(i), f"ID_{i}?") for i in range(num_vectors)]
+    labels = list(id_map.labels_for(ids, missing="?"))
 
     # Generujemy unikalne kolory dla każdego ID
     # Możemy użyć mapy kolorów z matplotlib
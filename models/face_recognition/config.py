@@ -3,12 +3,35 @@ import os
 # --- Konfiguracja Ścieżek Lokalnych ---
 BASE_FOLDER_LOCAL = "webface_112x112" 
 
+# Cache embeddingów na dysku (klucz: hash JPEG + model + parametry okluzji).
+# Obrazy z cache nie są dekodowane, więc podglądy w occlusion_photos powstają tylko dla
+# nowo liczonych zdjęć. Ustaw None, aby zawsze liczyć od zera.
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
 # --- Konfiguracja FAISS & Galerii ---
 FAISS_INDEX_FILE = "gallery.index"
-FAISS_MAPPING_FILE = "gallery_id_map.json"
+# Mapowanie ID FAISS -> nazwa tożsamości: <FAISS_MAPPING_FILE>_ids.npy i _labels.npy
+# (models.gallery.id_map, wczytywane przez memmap). Stary plik .json też jest obsługiwany.
+FAISS_MAPPING_FILE = "gallery_id_map"
+
+# Typ indeksu galerii (models.gallery.INDEX_TYPES): "flat" (dokładny IndexFlatIP), "hnsw",
+# "ivf_flat", "ivf_pq" lub "sq". Opcje budowy: nlist, pq_m, pq_bits, hnsw_m, ef_construction.
+GALLERY_INDEX_TYPE = "flat"
+GALLERY_INDEX_OPTIONS = {}
+# Parametry przeszukiwania: nprobe (IVF) i efSearch (HNSW) - więcej = dokładniej, ale wolniej
+GALLERY_NPROBE = 16
+GALLERY_EF_SEARCH = 64
 
 # --- Konfiguracja Ewaluacji ---
 RESULTS_CSV = "occlusion_results.csv"
 OCCLUSION_SIZE = 30 
 
-DETECTION_MODEL = "cnn"
\ No newline at end of file
+DETECTION_MODEL = "cnn"
+
+# --- Konfiguracja Modelu (models.embedder) ---
+EMBEDDER_BACKEND = "dlib"
+EMBEDDER_OPTIONS = {"detection_model": DETECTION_MODEL}
+# Liczba najlepszych dopasowań zapisywanych do CSV (calculate_rank_k potrzebuje >= 3)
+SEARCH_K = 3
+# Ile zapytań zbieramy przed jednym wspólnym index.search
+SEARCH_BLOCK_SIZE = 1024
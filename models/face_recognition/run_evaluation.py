@@ -1,116 +1,38 @@
 import os
 import sys
-import glob
-import json
 import csv
 import random
 import numpy as np
-import cv2
 import faiss
-import face_recognition # <-- ZMIANA
 from tqdm import tqdm
-from config import (
+from models.embedder import create_embedder, mean_embedding, read_image_bytes, with_cache, discover_file_structure, read_annotation, occlusion_transform, embedding_params
+from models.gallery import BlockSearcher, results_header, results_row, build_index, configure_search, describe_index, load_id_map, save_id_map
+from models.face_recognition.config import (
+    GALLERY_INDEX_TYPE, GALLERY_INDEX_OPTIONS, GALLERY_NPROBE, GALLERY_EF_SEARCH,
     BASE_FOLDER_LOCAL, 
-    FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE,
-    DETECTION_MODEL # <-- ZMIANA
+    FAISS_INDEX_FILE, FAISS_MAPPING_FILE, RESULTS_CSV, OCCLUSION_SIZE, SEARCH_K, SEARCH_BLOCK_SIZE,
+    DETECTION_MODEL, EMBEDDER_BACKEND, EMBEDDER_OPTIONS, EMBEDDING_CACHE_DIR
 )
 
-# --- 1. INICJALIZACJA MODELU (ZMIENIONA) ---
+# --- 1. INICJALIZACJA MODELU ---
 
 def initialize_services():
-    """Sprawdza importy i wyświetla info o modelu face_recognition."""
+    """Ładuje embedder face_recognition (dlib) ze wspólnego pakietu models.embedder."""
     print("Inicjalizuję... Używam biblioteki 'face_recognition' (dlib).")
     print(f"Używany model detekcji: {DETECTION_MODEL}")
-    # face_recognition ładuje modele automatycznie przy pierwszym użyciu
-    # Nie musimy niczego zwracać.
-    
-    # Mały "warm-up" - niech załaduje modele teraz
     try:
-        _ = face_recognition.face_encodings(np.zeros((100, 100, 3), dtype=np.uint8))
+        model = with_cache(create_embedder(EMBEDDER_BACKEND, **EMBEDDER_OPTIONS), EMBEDDING_CACHE_DIR)
     except Exception as e:
         print(f"BŁĄD: Nie udało się zainicjować modelu dlib. Sprawdź instalację.")
         print(f"Error: {e}")
         sys.exit(1)
         
     print("Inicjalizacja zakończona pomyślnie.")
-    # Zwracamy None, bo model nie jest obiektem, którego przekazujemy
-    return None
-
-def get_embedding(image_bgr): # <-- ZMIANA: usunięty argument 'model'
-    """Pobiera embedding (128-d) dla pojedynczego obrazu używając face_recognition."""
-    try:
-        # face_recognition oczekuje obrazu RGB, a my mamy BGR z cv2.imread
-        img_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
-        
-        # Krok 1: Znajdź lokalizacje twarzy
-        # Używamy DETECTION_MODEL z pliku config
-        face_locations = face_recognition.face_locations(img_rgb, model=DETECTION_MODEL)
-        
-        if not face_locations:
-            #tqdm.write("Warning: Nie znaleziono twarzy (face_recognition)")
-            return None
-            
-        # Krok 2: Oblicz embedding dla pierwszej znalezionej twarzy
-        # face_encodings zwraca listę, bierzemy pierwszy [0]
-        # Ten embedding to wektor numpy o 128 wymiarach
-        embedding = face_recognition.face_encodings(img_rgb, known_face_locations=face_locations)[0]
-        
-        return embedding
-        
-    except Exception as e:
-        # Ten błąd często się zdarza, gdy detekcja 'hog' zawiedzie na małym obrazku
-        if "Process C++ exception" in str(e): 
-            tqdm.write(f"Warning: Błąd C++ dlib (prawdopodobnie za mały obraz): {e}")
-        else:
-            tqdm.write(f"Warning: Błąd podczas pobierania embeddingu (face_recognition): {e}")
-    return None
-
-# --- 2. FUNKCJA POMOCNICZA (BEZ ZMIAN) ---
-
-def discover_file_structure(local_test_path):
-    """
-    Mapuje lokalną strukturę plików na logiczne foldery.
-    """
-    print(f"Wykrywanie struktury plików w {local_test_path}...")
-    search_pattern = os.path.join(local_test_path, "*", "*", "*.jpg")
-    all_jpg_files = list(glob.glob(search_pattern))
-    
-    if not all_jpg_files:
-        print("BŁĄD: Nie znaleziono ŻADNYCH plików .jpg pasujących do wzorca.")
-        print(f"Szukany wzorzec: {search_pattern}")
-        return None, None
-        
-    print(f"Znaleziono łącznie {len(all_jpg_files)} plików .jpg.")
-    identity_to_imgfolders = {} 
-    image_pairs = {}       
-
-    for jpg_path in tqdm(all_jpg_files, desc="Skanowanie plików"):
-        jpg_path_norm = os.path.normpath(jpg_path)
-        base_name = os.path.splitext(jpg_path_norm)[0]
-        json_path = base_name + ".json"
-        
-        if not os.path.exists(json_path):
-            continue 
-        
-        image_folder_path = os.path.dirname(jpg_path_norm)
-        identity_path = os.path.dirname(image_folder_path)
-        
-        if identity_path not in identity_to_imgfolders:
-            identity_to_imgfolders[identity_path] = set()
-        
-        if image_folder_path not in image_pairs:
-            image_pairs[image_folder_path] = {'jpg': None, 'json': None}
-        
-        identity_to_imgfolders[identity_path].add(image_folder_path)
-        image_pairs[image_folder_path]['jpg'] = jpg_path_norm
-        image_pairs[image_folder_path]['json'] = json_path
-
-    print(f"Wykryto {len(identity_to_imgfolders)} folderów tożsamości z kompletnymi parami JPG/JSON.")
-    return identity_to_imgfolders, image_pairs
+    return model
 
 # --- 3. BUDOWANIE GALERII FAISS (ZMODYFIKOWANE) ---
 
-def build_faiss_gallery(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usunięty argument 'model'
+def build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
     """
     Tworzy galerię FAISS z pierwszej połowy zdjęć dla każdego ID.
     """
@@ -123,8 +45,7 @@ def build_faiss_gallery(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usun
         return False
     
     gallery_embeddings = []
-    index_to_id_map = {} 
-    faiss_index_counter = 0
+    gallery_labels = []
 
     for id_path in tqdm(identity_paths, desc="Tworzenie galerii ID"):
         identity_id = os.path.basename(id_path)
@@ -136,7 +57,7 @@ def build_faiss_gallery(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usun
         if not gallery_folders:
             continue
 
-        id_embeddings = []
+        id_images = []
         for img_folder_path in gallery_folders:
             local_path = image_pairs.get(img_folder_path, {}).get('jpg')
             
@@ -144,22 +65,22 @@ def build_faiss_gallery(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usun
                 tqdm.write(f"Warning: Wewnętrzny błąd mapowania dla {img_folder_path}")
                 continue
                 
-            img = cv2.imread(local_path)
-            if img is None:
+            # Surowe bajty - klucz cache embeddingów
+            image_bytes = read_image_bytes(local_path)
+            if image_bytes is None:
                 tqdm.write(f"Warning: Błąd odczytu obrazu {local_path}")
                 continue
                 
-            embedding = get_embedding(img) # <-- ZMIANA: usunięty argument 'model'
-            if embedding is not None:
-                id_embeddings.append(embedding)
+            id_images.append(image_bytes)
 
-        if id_embeddings:
-            avg_embedding = np.mean(id_embeddings, axis=0)
-            avg_embedding /= np.linalg.norm(avg_embedding) 
-            
+        if not id_images:
+            continue
+
+        # Wszystkie zdjęcia galerii danego ID liczymy jednym batchem (pomijając te z cache)
+        avg_embedding = mean_embedding(model.embed_encoded(id_images))
+        if avg_embedding is not None:
             gallery_embeddings.append(avg_embedding)
-            index_to_id_map[faiss_index_counter] = identity_id
-            faiss_index_counter += 1
+            gallery_labels.append(identity_id)
 
     print(f"Zakończono. Znaleziono {len(gallery_embeddings)} unikalnych tożsamości.")
     
@@ -171,51 +92,33 @@ def build_faiss_gallery(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usun
     print(f"Wymiar embeddingu: {dimension}")
     gallery_matrix = np.array(gallery_embeddings).astype('float32')
     
-    index = faiss.IndexFlatIP(dimension)
-    index.add(gallery_matrix)
+    print(f"Budowanie indeksu galerii ({GALLERY_INDEX_TYPE})...")
+    try:
+        index = build_index(gallery_matrix, GALLERY_INDEX_TYPE, **GALLERY_INDEX_OPTIONS)
+    except ValueError as e:
+        print(f"BŁĄD: Nie można zbudować indeksu {GALLERY_INDEX_TYPE}: {e}")
+        return False
+    print(f"Indeks: {describe_index(index)}")
     
     print(f"Zapisywanie indeksu FAISS do {FAISS_INDEX_FILE}...")
     faiss.write_index(index, FAISS_INDEX_FILE)
     
     print(f"Zapisywanie mapowania ID do {FAISS_MAPPING_FILE}...")
-    with open(FAISS_MAPPING_FILE, 'w') as f:
-        json.dump(index_to_id_map, f)
+    save_id_map(FAISS_MAPPING_FILE, np.arange(len(gallery_labels)), gallery_labels)
         
     return True
 
 # --- 4. TESTOWANIE Z OKLUZJĄ (BEZ ZMIAN W LOGICE) ---
 
-def apply_occlusion(image, landmarks_dict, bbox):
-    """Nakłada pasek okluzji na wysokości oczu o szerokości twarzy."""
-    # Ta funkcja jest OK - nadal używa landmarków z JSONa (RetinaFace),
-    # co jest spójne, bo okluzję nakładamy tak samo dla obu modeli.
-    occluded_image = image.copy()
-    try:
-        left_eye_y = landmarks_dict["left_eye"][1]
-        right_eye_y = landmarks_dict["right_eye"][1]
-        eye_y_center = int((left_eye_y + right_eye_y) / 2)
-        bar_height_half = OCCLUSION_SIZE // 2
-        face_x1 = int(bbox[0])
-        face_x2 = int(bbox[2])
-        x1 = face_x1
-        y1 = max(0, eye_y_center - bar_height_half)
-        x2 = face_x2
-        y2 = min(image.shape[0], eye_y_center + bar_height_half)
-        cv2.rectangle(occluded_image, (x1, y1), (x2, y2), (0, 0, 0), -1)
-    except Exception as e:
-        print(f"Warning: Błąd podczas nakładania okluzji (np. brak landmarków): {e}")
-        return image.copy() 
-    return occluded_image
-
-def run_occlusion_evaluation(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usunięty argument 'model'
+def run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs):
     """
     Testuje drugą połowę zdjęć z okluzją i zapisuje wyniki do CSV.
     """
     print("Wczytywanie galerii FAISS i mapowania ID...")
     try:
         index = faiss.read_index(FAISS_INDEX_FILE)
-        with open(FAISS_MAPPING_FILE, 'r') as f:
-            index_to_id_map = json.load(f)
+        configure_search(index, GALLERY_NPROBE, GALLERY_EF_SEARCH)
+        id_map = load_id_map(FAISS_MAPPING_FILE)
     except Exception as e:
         print(f"BŁĄD: Nie udało się wczytać plików FAISS. Uruchom najpierw budowanie galerii.")
         print(f"Error: {e}")
@@ -232,9 +135,25 @@ def run_occlusion_evaluation(identity_to_imgfolders, image_pairs): # <-- ZMIANA:
     os.makedirs(output_occlusion_dir, exist_ok=True)
     print(f"Obrazy z okluzją będą zapisywane w: {output_occlusion_dir}")
     
+    searcher = BlockSearcher(index, SEARCH_K, SEARCH_BLOCK_SIZE)
+
     with open(RESULTS_CSV, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(["query_id", "top1_id", "top1_similarity", "top2_id", "top2_similarity", "top3_id", "top3_similarity", "is_correct_top1"])
+        writer.writerow(results_header(SEARCH_K))
+
+        def write_results(results):
+            """Zapisuje wyniki przeszukanego bloku zapytań."""
+            nonlocal total_queries, correct_top1
+            if not results:
+                return
+            # ID FAISS -> nazwy tożsamości dla całego bloku naraz
+            top_labels = id_map.labels_for(np.stack([indices for _, _, indices in results]))
+            for (ground_truth_id, sims, indices), top_ids in zip(results, top_labels):
+                row = results_row(ground_truth_id, list(top_ids), sims)
+                writer.writerow(row)
+                if row[-1]:
+                    correct_top1 += 1
+                total_queries += 1
         
         for id_path in tqdm(identity_paths, desc="Testowanie okluzji"):
             ground_truth_id = os.path.basename(id_path)
@@ -251,57 +170,31 @@ def run_occlusion_evaluation(identity_to_imgfolders, image_pairs): # <-- ZMIANA:
                     tqdm.write(f"Warning: Wewnętrzny błąd mapowania dla {img_folder_path}")
                     continue
                 
-                img = cv2.imread(local_img_path)
-                json_data = None
-                try:
-                    with open(local_json_path, 'r') as jf:
-                        json_data = json.load(jf)
-                except Exception as e:
-                    tqdm.write(f"Warning: Błąd odczytu JSON {local_json_path}: {e}")
-                    img = None 
+                image_bytes = read_image_bytes(local_img_path)
+                json_data = read_annotation(local_json_path)
                 
-                if (img is None or json_data is None or 
+                if (image_bytes is None or json_data is None or 
                     "landmarks" not in json_data or "bbox" not in json_data):
                     tqdm.write(f"Warning: Brak pełnych danych (JPG/JSON/Landmarks/BBox) dla {local_img_path}")
                     continue
 
-                occluded_img = apply_occlusion(img, json_data["landmarks"], json_data["bbox"])
+                # Okluzja + embedding (przy trafieniu w cache obraz nie jest nawet dekodowany)
+                original_filename = os.path.basename(local_img_path)
+                save_path = os.path.join(output_occlusion_dir, f"occluded_{ground_truth_id}_{original_filename}")
+                query_embedding = model.embed_encoded(
+                    [image_bytes],
+                    params=embedding_params(OCCLUSION_SIZE),
+                    transform=occlusion_transform([json_data], OCCLUSION_SIZE, [save_path])
+                )[0]
                 
-                try:
-                    original_filename = os.path.basename(local_img_path)
-                    save_path = os.path.join(output_occlusion_dir, f"occluded_{ground_truth_id}_{original_filename}")
-                    cv2.imwrite(save_path, occluded_img)
-                except Exception as e:
-                    tqdm.write(f"Warning: Nie udało się zapisać obrazu okluzji {save_path}: {e}")
-                
-                query_embedding = get_embedding(occluded_img) # <-- ZMIANA: usunięty argument 'model'
-                
-                if query_embedding is None:
+                if np.isnan(query_embedding).any():
                     continue 
                     
-                query_embedding_normalized = query_embedding / np.linalg.norm(query_embedding)
-                query_vector = np.expand_dims(query_embedding_normalized, axis=0).astype('float32')
-                
-                D, I = index.search(query_vector, 3) 
-                
-                top1_idx = I[0][0]
-                top2_idx = I[0][1]
-                top3_idx = I[0][2]
-                
-                top1_sim = D[0][0]
-                top2_sim = D[0][1]
-                top3_sim = D[0][2]
-                
-                top1_id = index_to_id_map.get(str(top1_idx), "N/A")
-                top2_id = index_to_id_map.get(str(top2_idx), "N/A")
-                top3_id = index_to_id_map.get(str(top3_idx), "N/A")
-                
-                is_correct = (top1_id == ground_truth_id)
-                writer.writerow([ground_truth_id, top1_id, f"{top1_sim:.4f}", top2_id, f"{top2_sim:.4f}", top3_id, f"{top3_sim:.4f}", is_correct])
-                
-                if is_correct:
-                    correct_top1 += 1
-                total_queries += 1
+                # Zapytania czekają w bloku na jedno wspólne index.search
+                write_results(searcher.add(ground_truth_id, query_embedding))
+
+        # Ostatni, niepełny blok
+        write_results(searcher.flush())
 
     if total_queries > 0:
         accuracy = (correct_top1 / total_queries) * 100
@@ -316,7 +209,7 @@ def run_occlusion_evaluation(identity_to_imgfolders, image_pairs): # <-- ZMIANA:
 # --- 5. GŁÓWNA FUNKCJA URUCHAMIAJĄCA (ZMODYFIKOWANA) ---
 
 def main():
-    initialize_services() # <-- ZMIANA: Nie przypisujemy już 'model'
+    model = initialize_services()
     
     local_test_path = os.path.join(BASE_FOLDER_LOCAL, "test")
     
@@ -327,7 +220,7 @@ def main():
 
     # Krok 1: Zbuduj galerię (indeks FAISS)
     print("--- ROZPOCZYNAM KROK 1: Budowanie Galerii FAISS ---")
-    if not build_faiss_gallery(identity_to_imgfolders, image_pairs): # <-- ZMIANA: usunięty argument 'model'
+    if not build_faiss_gallery(model, identity_to_imgfolders, image_pairs):
         print("Zatrzymanie skryptu z powodu błędu budowania galerii.")
         return
     print("\n" + "="*50 + "\n")
@@ -336,7 +229,7 @@ def main():
     
     # Krok 2: Uruchom ewaluację z okluzją
     print("--- ROZPOCZYNAM KROK 2: Ewaluacja Okluzji ---")
-    run_occlusion_evaluation(identity_to_imgfolders, image_pairs) # <-- ZMIANA: usunięty argument 'model'
+    run_occlusion_evaluation(model, identity_to_imgfolders, image_pairs)
     
     print("Gotowe.")
 
@@ -0,0 +1,10 @@
+from models.gallery.search import search_blocks, BlockSearcher, results_header, results_row, write_result_rows
+from models.gallery.verification import verification_blocks, sampled_verification_blocks, SAMPLING_MODES
+from models.gallery.index import build_index, configure_search, describe_index, gallery_vectors, FlatComparison, INDEX_TYPES
+from models.gallery.enrollment import Gallery
+from models.gallery.id_map import IdMap, load_id_map, save_id_map, id_map_exists
+from models.gallery.templates import TemplateIndex, aggregate_scores, template_embeddings, save_template_owners, load_template_owners, AGGREGATIONS
+from models.gallery.shards import ShardedGallery, ShardWriter, export_shards, merge_top_k, SHARDS_SUFFIX
+from models.gallery.service import GallerySearchService, SearchRequest
+from models.gallery.compressed import CompressedIndex, binary_codes, COMPRESSIONS
+from models.gallery.loading import load_search_gallery
@@ -0,0 +1,28 @@
+import sys
+
+import faiss
+
+from models.gallery.shards import export_shards, DEFAULT_SHARD_SIZE, SHARDS_SUFFIX
+
+# Zamiana istniejącego indeksu FAISS na galerię w shardach (models.gallery.shards):
+#   python -m models.gallery.build_shards <plik .index> <base shardów> [float16|float32] [wektorów na shard]
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Użycie: python -m models.gallery.build_shards <plik .index> <base shardów> [float16|float32] [wektorów na shard]")
+        sys.exit(1)
+    index_file, base_path = sys.argv[1], sys.argv[2]
+    dtype = sys.argv[3] if len(sys.argv) > 3 else "float16"
+    shard_size = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_SHARD_SIZE
+    try:
+        # Płaski indeks można czytać z dysku bez wczytywania całości
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_file)
+    count = export_shards(index, base_path, dtype, shard_size)
+    print(f"Zapisano {count} wektorów ({dtype}) do {base_path}{SHARDS_SUFFIX} i {base_path}_shard*.npy.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import faiss
+import numpy as np
+
+from models.gallery.shards import merge_top_k
+
+# Reprezentacje galerii do pierwszego (przybliżonego) przeszukiwania:
+#   "float16" - IndexScalarQuantizer QT_fp16, 2 B na wymiar,
+#   "int8"    - IndexScalarQuantizer QT_8bit, 1 B na wymiar (zakres każdego wymiaru trenowany na galerii),
+#   "binary"  - znak każdego wymiaru, IndexBinaryFlat (odległość Hamminga), 1 bit na wymiar.
+COMPRESSIONS = ("float16", "int8", "binary")
+# Liczba wektorów, na których trenowany jest kwantyzator int8
+TRAIN_SAMPLE = 1 << 16
+
+
+def binary_codes(vectors):
+    """Kody binarne (N, D / 8) - bit = znak kolejnego wymiaru."""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+class CompressedIndex:
+    """
+    Przeszukiwanie dwuetapowe: najpierw rerank_k kandydatów ze skompresowanej galerii,
+    potem dokładne podobieństwa float32 tylko dla nich (re-ranking).
+    full_vectors: wektory float32 galerii - macierz, memmap albo ShardedGallery; przy
+    re-rankingu czytane są tylko wiersze kandydatów, więc mogą zostać na dysku.
+    Inny typ (np. shardy float16) jest odrzucany - re-ranking nie byłby dokładny.
+    ids: ID FAISS wierszy full_vectors (np. z gallery_vectors albo ShardedGallery.ids) -
+    search(x, k) ma interfejs index.search i zwraca te ID (bez ids - numery wierszy).
+    """
+
+    def __init__(self, full_vectors, compression="int8", rerank_k=50, block_size=65536, ids=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Nieznana kompresja '{compression}' (dostępne: {', '.join(COMPRESSIONS)})")
+        dtype = np.dtype(getattr(full_vectors, "dtype", np.float32))
+        if dtype != np.float32:
+            raise ValueError(f"Re-ranking wymaga wektorów float32 (są {dtype}) - np. shardy zapisane jako float32")
+        self.full_vectors = full_vectors
+        self.ids = None if ids is None else np.asarray(ids, dtype=np.int64)
+        self.compression = compression
+        self.rerank_k = rerank_k
+        self.ntotal = len(full_vectors)
+        self.d = np.asarray(full_vectors[np.arange(1)]).shape[1]
+
+        if compression == "binary":
+            if self.d % 8:
+                raise ValueError(f"Kody binarne wymagają wymiaru podzielnego przez 8 (jest {self.d})")
+            self.first_pass = faiss.IndexBinaryFlat(self.d)
+        else:
+            quantizer = faiss.ScalarQuantizer.QT_fp16 if compression == "float16" else faiss.ScalarQuantizer.QT_8bit
+            self.first_pass = faiss.IndexScalarQuantizer(self.d, quantizer, faiss.METRIC_INNER_PRODUCT)
+            if not self.first_pass.is_trained:
+                sample = np.sort(np.random.default_rng(0).choice(self.ntotal, min(self.ntotal, TRAIN_SAMPLE), replace=False))
+                self.first_pass.train(self._rows(sample))
+
+        for start in range(0, self.ntotal, block_size):
+            vectors = self._rows(np.arange(start, min(start + block_size, self.ntotal)))
+            self.first_pass.add(binary_codes(vectors) if compression == "binary" else vectors)
+
+    def _rows(self, rows):
+        return np.ascontiguousarray(self.full_vectors[rows], dtype=np.float32)
+
+    @property
+    def code_bytes(self):
+        """Rozmiar skompresowanej galerii (bez wektorów float32 do re-rankingu)."""
+        return self.first_pass.code_size * self.ntotal
+
+    def describe(self):
+        full_bytes = 4 * self.d * self.ntotal
+        return (f"{self.compression}: {self.code_bytes / 2**20:.2f} MB zamiast {full_bytes / 2**20:.2f} MB float32 "
+                f"({full_bytes / max(1, self.code_bytes):.0f}x mniej), re-ranking top-{self.rerank_k}")
+
+    def search(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        candidates = max(1, min(max(k, self.rerank_k), self.ntotal))
+        if self.compression == "binary":
+            _, I = self.first_pass.search(binary_codes(x), candidates)
+        else:
+            _, I = self.first_pass.search(x, candidates)
+
+        # Re-ranking: dokładne podobieństwa float32 kandydatów
+        valid = I >= 0
+        vectors = self._rows(np.maximum(I, 0).ravel()).reshape(I.shape + (self.d,))
+        scores = np.einsum('nd,ncd->nc', x, vectors)
+        scores[~valid] = -np.inf
+        if self.ids is not None:
+            I = self.ids[np.maximum(I, 0)]
+        return merge_top_k([scores], [np.where(valid, I, -1)], k)
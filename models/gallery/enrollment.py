@@ -0,0 +1,205 @@
+import os
+import json
+
+import faiss
+import numpy as np
+
+from models.gallery.index import index_factory_string, INDEX_TYPES
+from models.gallery.id_map import IdMap, lookup_labels, IDS_SUFFIX, LABELS_SUFFIX
+from models.gallery.search import search_blocks
+
+# Pliki galerii przyrostowej (base = np. "gallery"):
+#   <base>.index       - indeks z ID: faiss.IndexIDMap2, a IVF z własnymi ID
+#                        (wektor = znormalizowana średnia embeddingów tożsamości),
+#   <base>_ids.npy     - stałe 64-bitowe ID FAISS kolejnych tożsamości (rosnąco),
+#   <base>_labels.npy  - nazwy tożsamości (np. "id_3") w tej samej kolejności
+#                        (te dwa pliki to zarazem mapowanie ID - models.gallery.load_id_map(base)),
+#   <base>_sums.npy    - suma embeddingów każdej tożsamości (float64, N x D),
+#   <base>_counts.npy  - liczba zdjęć każdej tożsamości,
+#   <base>_state.json  - nagłówek: wymiar, typ indeksu, następne wolne ID.
+INDEX_SUFFIX = ".index"
+STATE_SUFFIX = "_state.json"
+ARRAY_SUFFIXES = {"ids": IDS_SUFFIX, "labels": LABELS_SUFFIX, "sums": "_sums.npy", "counts": "_counts.npy"}
+
+
+class Gallery:
+    """
+    Galeria aktualizowana przyrostowo: update() / replace() / remove() zmieniają
+    tylko podane tożsamości (ich sumy, liczby zdjęć i wektory w indeksie), więc
+    dopisanie nowej osoby kosztuje tylko embeddingi jej własnych zdjęć.
+    Indeks zwraca stałe ID (nie numer wiersza) - usunięcie tożsamości nie
+    przesuwa pozostałych. labels_for() tłumaczy całe bloki ID na nazwy.
+    """
+
+    def __init__(self, dimension, index_type="flat", index_options=None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Nieznany typ indeksu '{index_type}' (dostępne: {', '.join(INDEX_TYPES)})")
+        self.dimension = dimension
+        self.index_type = index_type
+        self.index_options = dict(index_options or {})
+        self.next_id = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.labels = np.zeros(0, dtype=str)
+        self.sums = np.zeros((0, dimension), dtype=np.float64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.index = None # Tworzony przy pierwszym dodaniu (IVF / PQ trenują się na wektorach galerii)
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- Wektory i indeks ---
+
+    def means(self, rows=None):
+        """Znormalizowane średnie embeddingów (wiersze rows albo wszystkie) jako float32."""
+        rows = slice(None) if rows is None else rows
+        means = self.sums[rows] / self.counts[rows, None]
+        means /= np.linalg.norm(means, axis=1, keepdims=True)
+        return means.astype(np.float32)
+
+    def _new_index(self):
+        index_options = {key: value for key, value in self.index_options.items()
+                         if key in ("nlist", "pq_m", "pq_bits", "hnsw_m")}
+        inner = faiss.index_factory(self.dimension, index_factory_string(self.index_type, len(self), **index_options),
+                                    faiss.METRIC_INNER_PRODUCT)
+        if self.index_type == "hnsw":
+            inner.hnsw.efConstruction = self.index_options.get("ef_construction", 200)
+        if not inner.is_trained:
+            inner.train(self.means())
+        if faiss.try_extract_index_ivf(inner) is not None:
+            # IVF przechowuje ID samo; IndexIDMap nad IVF rozjeżdża się po remove_ids
+            return inner
+        return faiss.IndexIDMap2(inner)
+
+    def rebuild_index(self):
+        """Buduje indeks od nowa z zapisanych średnich (bez liczenia embeddingów), np. po zmianie typu."""
+        self.index = self._new_index()
+        if len(self):
+            self.index.add_with_ids(self.means(), self.ids)
+
+    def _reindex(self, rows, old_ids=()):
+        if self.index is None:
+            self.rebuild_index()
+            return
+        try:
+            if len(old_ids):
+                self.index.remove_ids(np.asarray(old_ids, dtype=np.int64))
+        except RuntimeError:
+            # Indeks bez usuwania (np. HNSW) - przebudowa ze średnich
+            self.rebuild_index()
+            return
+        if len(rows):
+            self.index.add_with_ids(self.means(rows), self.ids[rows])
+
+    # --- Aktualizacje ---
+
+    def _rows_for(self, labels):
+        """Wiersze podanych tożsamości; nowe tożsamości dostają kolejne wolne ID."""
+        new_labels = [label for label in dict.fromkeys(labels) if label not in self._rows]
+        if new_labels:
+            new_ids = np.arange(self.next_id, self.next_id + len(new_labels), dtype=np.int64)
+            self.next_id += len(new_labels)
+            for label in new_labels:
+                self._rows[label] = len(self._rows)
+            self.ids = np.concatenate([self.ids, new_ids])
+            self.labels = np.concatenate([self.labels, np.array(new_labels, dtype=str)])
+            self.sums = np.concatenate([self.sums, np.zeros((len(new_labels), self.dimension))])
+            self.counts = np.concatenate([self.counts, np.zeros(len(new_labels), dtype=np.int64)])
+        return np.array([self._rows[label] for label in labels], dtype=np.int64)
+
+    def update(self, labels, sums, counts, replace=False):
+        """
+        Dopisuje zdjęcia tożsamości: sums[i] to suma embeddingów, counts[i] liczba zdjęć
+        tożsamości labels[i]. Nieznane tożsamości są dodawane; replace=True nadpisuje
+        dotychczasowe zdjęcia zamiast je uzupełniać. Tożsamości z 0 zdjęć są pomijane.
+        """
+        counts = np.asarray(counts, dtype=np.int64)
+        keep = counts > 0
+        labels = [label for label, kept in zip(labels, keep) if kept]
+        if not labels:
+            return
+        sums = np.asarray(sums, dtype=np.float64)[keep]
+        counts = counts[keep]
+
+        known = np.array([label in self._rows for label in labels])
+        rows = self._rows_for(labels)
+        old_ids = self.ids[rows[known]] if self.index is not None else ()
+        if replace:
+            self.sums[rows] = 0
+            self.counts[rows] = 0
+        np.add.at(self.sums, rows, sums)
+        np.add.at(self.counts, rows, counts)
+        self._reindex(np.unique(rows), np.unique(old_ids))
+
+    def replace(self, labels, sums, counts):
+        self.update(labels, sums, counts, replace=True)
+
+    def remove(self, labels):
+        """Usuwa tożsamości (nieznane nazwy są pomijane). Zwraca liczbę usuniętych."""
+        rows = np.array([self._rows[label] for label in labels if label in self._rows], dtype=np.int64)
+        if len(rows) == 0:
+            return 0
+        removed_ids = self.ids[rows]
+        self._drop_rows(rows)
+        if self.index is not None:
+            self._reindex(np.zeros(0, dtype=np.int64), removed_ids)
+        return len(rows)
+
+    def _drop_rows(self, rows):
+        self.ids = np.delete(self.ids, rows)
+        self.labels = np.delete(self.labels, rows)
+        self.sums = np.delete(self.sums, rows, axis=0)
+        self.counts = np.delete(self.counts, rows)
+        self._rows = {label: row for row, label in enumerate(self.labels.tolist())}
+
+    # --- Wyszukiwanie ---
+
+    def labels_for(self, ids, missing="N/A"):
+        """Nazwy tożsamości dla tablicy ID FAISS dowolnego kształtu (-1 / nieznane -> missing)."""
+        return lookup_labels(self.ids, self.labels, ids, missing)
+
+    def ids_for(self, labels):
+        """ID FAISS podanych tożsamości (-1 dla nieznanych)."""
+        return np.array([self.ids[self._rows[label]] if label in self._rows else -1 for label in labels], dtype=np.int64)
+
+    def search(self, embeddings, k=3, block_size=1024):
+        """(D, ID FAISS) dla macierzy zapytań - jak search_blocks."""
+        return search_blocks(self.index, embeddings, k, block_size)
+
+    def id_map(self):
+        """Mapowanie ID FAISS <-> nazwa (IdMap) bieżącego stanu galerii."""
+        return IdMap(self.ids, self.labels)
+
+    # --- Zapis / odczyt ---
+
+    def save(self, base_path):
+        if self.index is None:
+            self.rebuild_index()
+        faiss.write_index(self.index, base_path + INDEX_SUFFIX)
+        for name, suffix in ARRAY_SUFFIXES.items():
+            np.save(base_path + suffix, getattr(self, name))
+        state = {
+            "dimension": self.dimension,
+            "index_type": self.index_type,
+            "index_options": self.index_options,
+            "next_id": self.next_id,
+            "count": len(self),
+        }
+        with open(base_path + STATE_SUFFIX, 'w') as f:
+            json.dump(state, f, indent=4)
+
+    @classmethod
+    def load(cls, base_path):
+        with open(base_path + STATE_SUFFIX, 'r') as f:
+            state = json.load(f)
+        gallery = cls(state["dimension"], state["index_type"], state["index_options"])
+        gallery.next_id = state["next_id"]
+        for name, suffix in ARRAY_SUFFIXES.items():
+            setattr(gallery, name, np.load(base_path + suffix))
+        gallery._rows = {label: row for row, label in enumerate(gallery.labels.tolist())}
+        gallery.index = faiss.read_index(base_path + INDEX_SUFFIX)
+        return gallery
+
+    @staticmethod
+    def exists(base_path):
+        return os.path.exists(base_path + STATE_SUFFIX)
@@ -0,0 +1,101 @@
+import os
+import json
+
+import numpy as np
+
+# Mapowanie ID FAISS -> nazwa tożsamości jako dwie tablice numpy zamiast JSON {"0": "id_3", ...}:
+#   <base>_ids.npy    - ID FAISS (int64, rosnąco),
+#   <base>_labels.npy - nazwy tożsamości (unicode o stałej szerokości) w tej samej kolejności.
+# Tablice są mapowane z dysku (np.load(mmap_mode='r')), więc wczytanie nie zależy od liczby
+# tożsamości, a tłumaczenie całego bloku wyników to jedno np.searchsorted.
+IDS_SUFFIX = "_ids.npy"
+LABELS_SUFFIX = "_labels.npy"
+
+
+def lookup_labels(ids, labels, query_ids, missing="N/A"):
+    """Nazwy dla tablicy ID dowolnego kształtu (ids: rosnąco; -1 / nieznane -> missing)."""
+    query_ids = np.asarray(query_ids, dtype=np.int64)
+    result = np.full(query_ids.shape, missing, dtype=object)
+    if len(ids) == 0:
+        return result
+    positions = np.clip(np.searchsorted(ids, query_ids), 0, len(ids) - 1)
+    found = (query_ids >= 0) & (ids[positions] == query_ids)
+    result[found] = labels[positions[found]]
+    return result
+
+
+class IdMap:
+    """Tablicowe mapowanie ID FAISS <-> nazwa tożsamości (labels_for / ids_for na całych blokach)."""
+
+    def __init__(self, ids, labels):
+        self.ids = ids
+        self.labels = labels
+        # Nazwy posortowane (i ich kolejność) - liczone raz, przy pierwszym ids_for
+        self._label_order = None
+        self._sorted_labels = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def labels_for(self, query_ids, missing="N/A"):
+        return lookup_labels(self.ids, self.labels, query_ids, missing)
+
+    def ids_for(self, query_labels):
+        """ID FAISS dla listy nazw (-1 dla nieznanych)."""
+        query_labels = np.asarray(query_labels, dtype=str)
+        result = np.full(query_labels.shape, -1, dtype=np.int64)
+        if len(self.ids) == 0:
+            return result
+        if self._label_order is None:
+            self._label_order = np.argsort(self.labels, kind='stable')
+            self._sorted_labels = np.asarray(self.labels)[self._label_order]
+        sorted_labels = self._sorted_labels
+        positions = np.clip(np.searchsorted(sorted_labels, query_labels), 0, len(sorted_labels) - 1)
+        found = sorted_labels[positions] == query_labels
+        result[found] = self.ids[self._label_order[positions[found]]]
+        return result
+
+    def columns_for(self, query_labels, column_ids):
+        """Numery kolumn macierzy galerii o ID column_ids (rosnąco, np. z gallery_vectors) dla nazw; -1 dla nieznanych."""
+        query_ids = self.ids_for(query_labels)
+        column_ids = np.asarray(column_ids, dtype=np.int64)
+        if len(column_ids) == 0:
+            return np.full(query_ids.shape, -1, dtype=np.int64)
+        columns = np.clip(np.searchsorted(column_ids, query_ids), 0, len(column_ids) - 1)
+        return np.where((query_ids >= 0) & (column_ids[columns] == query_ids), columns, -1)
+
+    def save(self, base_path):
+        save_id_map(base_path, self.ids, self.labels)
+
+
+def save_id_map(base_path, ids, labels):
+    """Zapisuje mapowanie (wiersze sortowane po ID)."""
+    ids = np.asarray(ids, dtype=np.int64)
+    labels = np.asarray(labels, dtype=str)
+    order = np.argsort(ids, kind='stable')
+    np.save(base_path + IDS_SUFFIX, ids[order])
+    np.save(base_path + LABELS_SUFFIX, labels[order])
+
+
+def load_id_map(path):
+    """
+    Wczytuje mapowanie zapisane przez save_id_map (path = base) albo - dla starych
+    galerii - plik gallery_id_map.json ({"0": "id_3", ...}); bez tablic <base>_ids.npy
+    próbuje też <base>.json.
+    """
+    if not path.endswith(".json") and not os.path.exists(path + IDS_SUFFIX) and os.path.exists(path + ".json"):
+        path = path + ".json"
+    if path.endswith(".json"):
+        with open(path, 'r') as f:
+            legacy = json.load(f)
+        ids = np.array([int(key) for key in legacy], dtype=np.int64)
+        labels = np.array(list(legacy.values()), dtype=str)
+        order = np.argsort(ids, kind='stable')
+        return IdMap(ids[order], labels[order])
+    return IdMap(np.load(path + IDS_SUFFIX, mmap_mode='r'), np.load(path + LABELS_SUFFIX, mmap_mode='r'))
+
+
+def id_map_exists(path):
+    if path.endswith(".json"):
+        return os.path.exists(path)
+    return os.path.exists(path + IDS_SUFFIX) or os.path.exists(path + ".json")
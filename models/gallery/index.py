@@ -0,0 +1,173 @@
+import time
+import threading
+
+import faiss
+import numpy as np
+
+from models.gallery.search import search_blocks
+
+# Typy indeksu galerii (wszystkie z iloczynem skalarnym = podobieństwo kosinusowe):
+#   "flat"     - IndexFlatIP, dokładny, czas zapytania liniowy względem galerii,
+#   "hnsw"     - IndexHNSWFlat (graf, bez treningu; jakość/czas: ef_search),
+#   "ivf_flat" - IndexIVFFlat (nlist list, trening k-means; jakość/czas: nprobe),
+#   "ivf_pq"   - IndexIVFPQ (jak ivf_flat + kompresja PQ, pq_m bajtów na wektor przy pq_bits=8),
+#   "sq"       - IndexScalarQuantizer (8 bitów na wymiar, płaskie przeszukiwanie).
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq")
+
+
+def default_nlist(num_vectors):
+    """~4 * sqrt(N) list, ale co najmniej 39 wektorów treningowych na listę (wymóg k-means FAISS)."""
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+def index_factory_string(index_type, num_vectors, nlist=None, pq_m=16, pq_bits=8, hnsw_m=32):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist or default_nlist(num_vectors)},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist or default_nlist(num_vectors)},PQ{pq_m}x{pq_bits}"
+    if index_type == "sq":
+        return "SQ8"
+    raise ValueError(f"Nieznany typ indeksu '{index_type}' (dostępne: {', '.join(INDEX_TYPES)})")
+
+
+def build_index(vectors, index_type="flat", nlist=None, pq_m=16, pq_bits=8, hnsw_m=32, ef_construction=200):
+    """
+    Buduje indeks galerii z macierzy znormalizowanych wektorów (N, D): trenuje go
+    na tych samych wektorach (IVF / PQ / SQ) i dodaje je w kolejności wierszy,
+    więc numer wiersza = indeks FAISS (mapowanie ID się nie zmienia).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimension = vectors.shape
+    if index_type == "ivf_pq":
+        if dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} musi dzielić wymiar embeddingu {dimension}")
+        if num_vectors < (1 << pq_bits):
+            raise ValueError(f"IVFPQ z pq_bits={pq_bits} wymaga co najmniej {1 << pq_bits} wektorów (jest {num_vectors})")
+
+    index = faiss.index_factory(dimension, index_factory_string(index_type, num_vectors, nlist, pq_m, pq_bits, hnsw_m),
+                                faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def _unwrap(index):
+    """Indeks wewnętrzny IndexIDMap / IndexIDMap2 (albo sam indeks)."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Ustawia parametry przeszukiwania wczytanego indeksu (ignorowane, gdy typ ich nie ma)."""
+    inner = _unwrap(index)
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(inner, "hnsw") and ef_search:
+        inner.hnsw.efSearch = ef_search
+    return index
+
+
+def describe_index(index):
+    """Krótki opis indeksu do logów (typ, liczba wektorów, parametry przeszukiwania)."""
+    inner = _unwrap(index)
+    name = type(index).__name__ if inner is index else f"{type(index).__name__}({type(inner).__name__})"
+    description = f"{name} ({index.ntotal} wektorów"
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        description += f", nlist={ivf.nlist}, nprobe={ivf.nprobe}"
+    if hasattr(inner, "hnsw"):
+        description += f", efSearch={inner.hnsw.efSearch}"
+    return description + ")"
+
+
+def gallery_vectors(index):
+    """
+    Wszystkie wektory galerii z indeksu: (wektory (N, D), ID FAISS (N,) rosnąco).
+    Zwykły indeks zwraca numery wierszy, IndexIDMap / IVF z galerii przyrostowej
+    (models.gallery.Gallery) - swoje stałe ID. Dla PQ / SQ wektory są po kompresji.
+    """
+    if _unwrap(index) is not index:
+        ids = faiss.vector_to_array(index.id_map)
+        vectors = gallery_vectors(_unwrap(index))[0]
+    else:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is None:
+            ids = np.arange(index.ntotal, dtype=np.int64)
+            vectors = index.reconstruct_n(0, index.ntotal)
+        else:
+            invlists = ivf.invlists
+            ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+                faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+                for l in range(ivf.nlist) if invlists.list_size(l)
+            ])
+            # Mapa bezpośrednia typu Hashtable działa też dla nieciągłych ID
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+            vectors = index.reconstruct_batch(ids)
+    order = np.argsort(ids, kind='stable')
+    return vectors[order], ids[order]
+
+
+class FlatComparison:
+    """
+    Porównanie indeksu ANN z dokładnym IndexFlatIP na tych samych zapytaniach:
+    Rank-1 obu indeksów, zgodność top-1 i łączny czas przeszukiwania.
+    add() jest bezpieczne dla kilku wątków etapu "search".
+    """
+
+    def __init__(self, gallery_matrix, ids=None):
+        """ids: ID FAISS wierszy gallery_matrix, jeśli indeks ANN zwraca stałe ID (Gallery)."""
+        gallery_matrix = np.ascontiguousarray(gallery_matrix, dtype=np.float32)
+        self.baseline = faiss.IndexFlatIP(gallery_matrix.shape[1])
+        if ids is not None:
+            self.baseline = faiss.IndexIDMap(self.baseline)
+            self.baseline.add_with_ids(gallery_matrix, np.asarray(ids, dtype=np.int64))
+        else:
+            self.baseline.add(gallery_matrix)
+        self.total = 0
+        self.ann_correct = 0
+        self.flat_correct = 0
+        self.agree = 0
+        self.ann_seconds = 0.0
+        self.flat_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, embeddings, ann_indices, ground_truth_indices, ann_seconds=0.0):
+        """ann_indices: wynik indeksu ANN (N, k); ground_truth_indices: ID FAISS prawdziwej tożsamości (-1 = brak)."""
+        start = time.perf_counter()
+        _, flat_indices = search_blocks(self.baseline, embeddings, 1, max(1, len(embeddings)))
+        flat_seconds = time.perf_counter() - start
+
+        ann_top1 = np.asarray(ann_indices)[:, 0]
+        flat_top1 = flat_indices[:, 0]
+        ground_truth_indices = np.asarray(ground_truth_indices)
+        valid = ann_top1 >= 0
+        with self._lock:
+            self.total += int(np.count_nonzero(valid))
+            self.ann_correct += int(np.count_nonzero(valid & (ann_top1 == ground_truth_indices)))
+            self.flat_correct += int(np.count_nonzero(valid & (flat_top1 == ground_truth_indices)))
+            self.agree += int(np.count_nonzero(valid & (ann_top1 == flat_top1)))
+            self.ann_seconds += ann_seconds
+            self.flat_seconds += flat_seconds
+
+    def report(self):
+        if self.total == 0:
+            return "Porównanie z IndexFlatIP: brak zapytań."
+        ann = self.ann_correct / self.total * 100
+        flat = self.flat_correct / self.total * 100
+        return "\n".join([
+            f"--- Porównanie z IndexFlatIP ({self.total} zapytań) ---",
+            f"  Rank-1 ANN:  {ann:.2f}%",
+            f"  Rank-1 Flat: {flat:.2f}%",
+            f"  Delta Rank-1: {ann - flat:+.2f} pp",
+            f"  Zgodność top-1 z Flat: {self.agree / self.total * 100:.2f}%",
+            f"  Czas przeszukiwania: ANN {self.ann_seconds:.2f}s, Flat {self.flat_seconds:.2f}s",
+        ])
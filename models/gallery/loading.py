@@ -0,0 +1,66 @@
+import faiss
+
+from models.gallery.index import configure_search, gallery_vectors
+from models.gallery.id_map import load_id_map
+from models.gallery.templates import TemplateIndex, load_template_owners
+from models.gallery.shards import ShardedGallery
+from models.gallery.service import GallerySearchService
+from models.gallery.compressed import CompressedIndex
+
+# Galeria do przeszukiwania w ewaluatorach identyfikacji (wartości z config.py ewaluatora):
+#   shards           - GALLERY_SHARDS: galeria w shardach mapowanych z dysku (models.gallery.shards) dla
+#                      galerii większych niż RAM; None = wektory z FAISS_INDEX_FILE (cała galeria w pamięci),
+#   search_nodes     - GALLERY_SEARCH_NODES: przeszukiwanie w tylu procesach (models.gallery.service),
+#                      wektory shardów dzielone na ciągłe części, top-k węzłów scalany; 0 = w tym procesie,
+#   compression      - GALLERY_COMPRESSION: pierwsze przeszukiwanie po skompresowanej galerii
+#                      (models.gallery.COMPRESSIONS), rerank_k kandydatów liczonych dokładnie (float32);
+#                      galeria bez kompresji zostaje punktem odniesienia (baseline),
+#   mode             - GALLERY_MODE: "mean" (jeden wektor na tożsamość) albo "templates" (każde zdjęcie
+#                      osobno, wyniki łączone per tożsamość - models.gallery.templates).
+
+
+def load_search_gallery(index_file, mapping_file, shards=None, search_nodes=0, nprobe=16, ef_search=64,
+                        compression=None, rerank_k=50, mode="mean", aggregation="max", top_k=3,
+                        temperature=0.1, template_search_k=None):
+    """
+    Wczytuje galerię według konfiguracji ewaluatora. Zwraca (index, baseline, service, id_map):
+    index ma interfejs index.search i zwraca ID FAISS (tożsamości także w trybie "templates"),
+    baseline - ta sama galeria bez kompresji (None bez kompresji), service - GallerySearchService
+    do zamknięcia (None bez search_nodes), id_map - mapowanie ID FAISS -> nazwa.
+    """
+    if search_nodes and not shards:
+        raise ValueError("GALLERY_SEARCH_NODES wymaga galerii w shardach (ustaw GALLERY_SHARDS)")
+
+    service = None
+    baseline = None
+    if search_nodes:
+        # Galeria rozdzielona między procesy; bloki zapytań idą do wszystkich węzłów
+        service = index = GallerySearchService(shards, search_nodes)
+    elif shards:
+        # Dokładne przeszukiwanie shardów mapowanych z dysku (scalanie top-k)
+        index = ShardedGallery(shards)
+    else:
+        index = faiss.read_index(index_file)
+        configure_search(index, nprobe, ef_search)
+
+    try:
+        id_map = load_id_map(mapping_file)
+        if compression:
+            # Re-ranking float32 z wektorów shardów (czytane z dysku) albo z indeksu FAISS
+            if shards:
+                full_vectors = ShardedGallery(shards)
+                full_ids = full_vectors.ids
+            else:
+                full_vectors, full_ids = gallery_vectors(index)
+            # Kandydaci mapowani na ID FAISS (id_map / szablony), nie na numery wierszy
+            baseline, index = index, CompressedIndex(full_vectors, compression, rerank_k, ids=full_ids)
+        if mode == "templates":
+            owners = load_template_owners(mapping_file)
+            index = TemplateIndex(index, owners, aggregation, top_k, temperature, template_search_k)
+            if baseline is not None:
+                baseline = TemplateIndex(baseline, owners, aggregation, top_k, temperature, template_search_k)
+    except Exception:
+        if service is not None:
+            service.close()
+        raise
+    return index, baseline, service, id_map
@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+
+from models.embedder.base import l2_normalize, valid_rows
+
+
+def search_blocks(index, embeddings, k=3, block_size=1024):
+    """
+    Przeszukuje indeks FAISS całą macierzą zapytań (N, D): jedno index.search
+    (GEMM zamiast N x GEMV) na każdy blok block_size wierszy.
+    Zapytania są normalizowane; wiersze NaN dostają podobieństwo -inf i indeks -1.
+    Zwraca (D, I) o kształcie (N, k).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    D = np.full((len(embeddings), k), -np.inf, dtype=np.float32)
+    I = np.full((len(embeddings), k), -1, dtype=np.int64)
+    rows = np.flatnonzero(valid_rows(embeddings))
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block_D, block_I = index.search(l2_normalize(embeddings[block_rows]), k)
+        D[block_rows] = block_D
+        I[block_rows] = block_I
+    return D, I
+
+
+class BlockSearcher:
+    """
+    Dla pętli, które liczą zapytania pojedynczo: zbiera embeddingi w blok
+    i przeszukuje indeks dopiero, gdy uzbiera się block_size zapytań.
+    add() i flush() zwracają listę gotowych wyników (tag, podobieństwa[k], indeksy[k]).
+    search_seconds sumuje czas samych przeszukiwań indeksu.
+    """
+
+    def __init__(self, index, k=3, block_size=1024):
+        self.index = index
+        self.k = k
+        self.block_size = block_size
+        self._tags = []
+        self._embeddings = []
+        self.search_seconds = 0.0
+
+    def add(self, tag, embedding):
+        self._tags.append(tag)
+        self._embeddings.append(embedding)
+        if len(self._tags) >= self.block_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self._tags:
+            return []
+        start = time.perf_counter()
+        D, I = search_blocks(self.index, np.stack(self._embeddings), self.k, self.block_size)
+        self.search_seconds += time.perf_counter() - start
+        results = list(zip(self._tags, D, I))
+        self._tags, self._embeddings = [], []
+        return results
+
+
+def results_header(k=3):
+    """Nagłówek CSV wyników identyfikacji: query_id, top{i}_id, top{i}_similarity, is_correct_top1."""
+    header = ["query_id"]
+    for rank in range(1, k + 1):
+        header += [f"top{rank}_id", f"top{rank}_similarity"]
+    return header + ["is_correct_top1"]
+
+
+def results_row(query_id, top_ids, top_sims):
+    """Wiersz CSV dla jednego zapytania (kolumny jak w results_header)."""
+    row = [query_id]
+    for top_id, top_sim in zip(top_ids, top_sims):
+        row += [top_id, f"{top_sim:.4f}"]
+    return row + [top_ids[0] == query_id]
+
+
+def write_result_rows(writer, results, id_map):
+    """
+    Zapisuje do CSV wyniki przeszukanego bloku (z BlockSearcher) - ID FAISS tłumaczone
+    na nazwy dla całego bloku naraz. Zwraca liczbę trafień top-1.
+    """
+    if not results:
+        return 0
+    correct_top1 = 0
+    top_labels = id_map.labels_for(np.stack([indices for _, _, indices in results]))
+    for (ground_truth_id, sims, _), top_ids in zip(results, top_labels):
+        row = results_row(ground_truth_id, list(top_ids), sims)
+        writer.writerow(row)
+        correct_top1 += int(row[-1])
+    return correct_top1
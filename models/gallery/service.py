@@ -0,0 +1,124 @@
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+
+from models.gallery.shards import ShardedGallery, merge_top_k
+
+# Stan procesu węzła (ustawiany w _init_node, raz na proces)
+_node = {}
+
+
+def _init_node(base_path, start, stop, threads):
+    """Initializer węzła: wczytuje swoją część galerii (kolumny start:stop) do IndexFlatIP."""
+    if threads:
+        faiss.omp_set_num_threads(threads)
+    gallery = ShardedGallery(base_path)
+    index = faiss.IndexFlatIP(gallery.d)
+    for offset in range(start, stop, gallery.rows_per_block):
+        index.add(gallery[np.arange(offset, min(offset + gallery.rows_per_block, stop))])
+    _node["index"] = index
+    _node["ids"] = np.asarray(gallery.ids[start:stop])
+
+
+def _node_ready():
+    return _node["index"].ntotal
+
+
+def _search_task(queries, k):
+    """
+    Zadanie węzła: top-k w jego części galerii -> (D, ID FAISS, czas przeszukiwania w s,
+    chwila zakończenia wg time.time() - wspólnego zegara procesów jednej maszyny).
+    """
+    start = time.perf_counter()
+    index = _node["index"]
+    if index.ntotal == 0:
+        D, ids = np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+    else:
+        D, I = index.search(queries, min(k, index.ntotal))
+        ids = np.where(I >= 0, _node["ids"][np.maximum(I, 0)], -1)
+    return D, ids, time.perf_counter() - start, time.time()
+
+
+class SearchRequest:
+    """Zapytanie wysłane do wszystkich węzłów; result() czeka na odpowiedzi i scala top-k."""
+
+    def __init__(self, service, futures, k, sent):
+        self.service = service
+        self.futures = futures
+        self.k = k
+        self.sent = sent
+
+    def result(self):
+        scores, ids = [], []
+        for node, future in enumerate(self.futures):
+            D, I, node_seconds, finished = future.result()
+            self.service.latencies[node].append((node_seconds, finished - self.sent))
+            scores.append(D)
+            ids.append(I)
+        return merge_top_k(scores, ids, self.k)
+
+
+class GallerySearchService:
+    """
+    Przeszukiwanie galerii rozdzielonej między num_nodes procesów (lokalny odpowiednik
+    osobnych węzłów): każdy węzeł trzyma w IndexFlatIP swój ciągły zakres wektorów
+    z galerii w shardach (ShardedGallery). Blok zapytań trafia do wszystkich węzłów,
+    a ich top-k jest scalany (merge_top_k).
+    submit(x, k) -> SearchRequest (odpowiedź: result()); search(x, k) ma interfejs
+    index.search, więc serwis działa z search_blocks / BlockSearcher / TemplateIndex.
+    report() podaje czasy każdego węzła.
+    """
+
+    def __init__(self, base_path, num_nodes=2, threads_per_node=1):
+        gallery = ShardedGallery(base_path)
+        self.d = gallery.d
+        self.ntotal = gallery.ntotal
+        bounds = np.linspace(0, self.ntotal, num_nodes + 1).astype(np.int64)
+        self.partitions = list(zip(bounds[:-1], bounds[1:]))
+        # 'spawn' - jak w ProcessEmbeddingEngine; każdy węzeł to osobny proces z jedną kolejką zadań
+        context = multiprocessing.get_context("spawn")
+        self.nodes = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_node,
+                                initargs=(base_path, int(start), int(stop), threads_per_node))
+            for start, stop in self.partitions
+        ]
+        # Węzły wczytują swoje części równolegle
+        for ready in [node.submit(_node_ready) for node in self.nodes]:
+            ready.result()
+        self.latencies = [[] for _ in self.nodes] # (czas przeszukiwania, czas do odpowiedzi węzła) na zapytanie
+
+    def submit(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        sent = time.time()
+        return SearchRequest(self, [node.submit(_search_task, x, k) for node in self.nodes], k, sent)
+
+    def search(self, x, k):
+        return self.submit(x, k).result()
+
+    def report(self):
+        lines = [f"--- Przeszukiwanie galerii: {len(self.nodes)} węzłów, {self.ntotal} wektorów ---"]
+        for node, ((start, stop), latencies) in enumerate(zip(self.partitions, self.latencies)):
+            if not latencies:
+                lines.append(f"  węzeł {node}: {stop - start} wektorów, brak zapytań")
+                continue
+            node_ms = np.array([node_seconds for node_seconds, _ in latencies]) * 1000
+            response_ms = np.array([response for _, response in latencies]) * 1000
+            lines.append(
+                f"  węzeł {node}: {stop - start} wektorów, {len(latencies)} bloków zapytań, "
+                f"przeszukiwanie śr. {node_ms.mean():.2f} ms (p95 {np.percentile(node_ms, 95):.2f} ms, "
+                f"max {node_ms.max():.2f} ms), odpowiedź śr. {response_ms.mean():.2f} ms"
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        for node in self.nodes:
+            node.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
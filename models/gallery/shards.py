@@ -0,0 +1,186 @@
+import os
+import json
+
+import faiss
+import numpy as np
+
+from models.gallery.index import _unwrap, gallery_vectors
+
+# Galeria podzielona na shardy mapowane z dysku (większa niż RAM):
+#   <base>_shards.json          - nagłówek: wymiar, typ wektorów, liczności shardów,
+#   <base>_shard0000.npy        - macierz (n, D) znormalizowanych wektorów (float16 albo float32),
+#   <base>_shard0000_ids.npy    - ID FAISS wierszy shardu (int64; nazwy: models.gallery.load_id_map).
+# Pliki są otwierane przez np.load(mmap_mode='r'): w RAM są tylko aktualnie czytane strony,
+# a procesy otwierające ten sam shard współdzielą je przez page cache (bez kopii na proces).
+SHARDS_SUFFIX = "_shards.json"
+SHARD_DTYPES = ("float16", "float32")
+DEFAULT_SHARD_SIZE = 1 << 18
+# Ile wierszy shardu naraz zamieniamy na float32 i mnożymy przez blok zapytań
+ROWS_PER_BLOCK = 1 << 16
+
+
+def shard_paths(base_path, shard):
+    """(plik wektorów, plik ID) shardu o numerze shard."""
+    prefix = f"{base_path}_shard{shard:04d}"
+    return prefix + ".npy", prefix + "_ids.npy"
+
+
+def merge_top_k(scores, ids, k):
+    """
+    Scala wyniki top-k części galerii: listy macierzy (N, k_i) podobieństw i ID
+    -> (N, k) malejąco (-inf / -1, gdy wszystkich kandydatów jest mniej niż k).
+    """
+    D = np.concatenate(scores, axis=1)
+    I = np.concatenate(ids, axis=1)
+    if D.shape[1] < k:
+        D = np.concatenate([D, np.full((len(D), k - D.shape[1]), -np.inf, dtype=D.dtype)], axis=1)
+        I = np.concatenate([I, np.full((len(I), k - I.shape[1]), -1, dtype=np.int64)], axis=1)
+    elif D.shape[1] > k:
+        top = np.argpartition(-D, k - 1, axis=1)[:, :k]
+        D, I = np.take_along_axis(D, top, axis=1), np.take_along_axis(I, top, axis=1)
+    order = np.argsort(-D, axis=1, kind='stable')
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+class ShardWriter:
+    """
+    Strumieniowo zapisuje galerię w shardach po shard_size wektorów (add() porcjami).
+    close() zapisuje nagłówek - bez niego galeria nie jest uznawana za kompletną.
+    """
+
+    def __init__(self, base_path, dimension, dtype="float16", shard_size=DEFAULT_SHARD_SIZE):
+        if dtype not in SHARD_DTYPES:
+            raise ValueError(f"Nieznany typ shardów '{dtype}' (dostępne: {', '.join(SHARD_DTYPES)})")
+        self.base_path = base_path
+        self.dimension = dimension
+        self.dtype = dtype
+        self.shard_size = shard_size
+        self.counts = []
+        self._vectors = []
+        self._ids = []
+        self._pending = 0
+        if os.path.exists(base_path + SHARDS_SUFFIX):
+            os.remove(base_path + SHARDS_SUFFIX)
+
+    def add(self, vectors, ids):
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dimension)
+        ids = np.asarray(ids, dtype=np.int64)
+        while len(vectors):
+            take = self.shard_size - self._pending
+            self._vectors.append(vectors[:take])
+            self._ids.append(ids[:take])
+            self._pending += len(vectors[:take])
+            vectors, ids = vectors[take:], ids[take:]
+            if self._pending == self.shard_size:
+                self._flush()
+
+    def _flush(self):
+        vectors_path, ids_path = shard_paths(self.base_path, len(self.counts))
+        np.save(vectors_path, np.concatenate(self._vectors))
+        np.save(ids_path, np.concatenate(self._ids))
+        self.counts.append(self._pending)
+        self._vectors, self._ids, self._pending = [], [], 0
+
+    def close(self):
+        if self._pending:
+            self._flush()
+        header = {
+            "dimension": self.dimension,
+            "dtype": self.dtype,
+            "count": int(sum(self.counts)),
+            "shards": self.counts,
+        }
+        with open(self.base_path + SHARDS_SUFFIX, 'w') as f:
+            json.dump(header, f, indent=4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ShardedGallery:
+    """
+    Galeria z shardów mapowanych z dysku. search(x, k) ma interfejs index.search
+    (przeszukuje shard po shardzie i scala top-k; zwraca ID FAISS), więc działa
+    z search_blocks / BlockSearcher i trybem "hard" weryfikacji. gallery[kolumny]
+    czyta tylko wskazane wiersze, a column_blocks() daje galerię porcjami do GEMM.
+    Kolumna = pozycja wektora w kolejnych shardach.
+    """
+
+    def __init__(self, base_path, rows_per_block=ROWS_PER_BLOCK):
+        with open(base_path + SHARDS_SUFFIX, 'r') as f:
+            header = json.load(f)
+        self.base_path = base_path
+        self.d = header["dimension"]
+        self.dtype = header["dtype"]
+        self.ntotal = header["count"]
+        self.rows_per_block = rows_per_block
+        self.shards = []
+        for shard in range(len(header["shards"])):
+            vectors_path, ids_path = shard_paths(base_path, shard)
+            self.shards.append((np.load(vectors_path, mmap_mode='r'), np.load(ids_path, mmap_mode='r')))
+        self.offsets = np.cumsum([0] + header["shards"])
+        self._ids = None
+
+    def __len__(self):
+        return self.ntotal
+
+    @property
+    def ids(self):
+        """ID FAISS wszystkich kolumn (int64, ~8 B na wektor)."""
+        if self._ids is None:
+            self._ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [np.asarray(ids) for _, ids in self.shards])
+        return self._ids
+
+    def __getitem__(self, columns):
+        """Wektory (float32) kolumn o dowolnym kształcie -> kształt + (D,)."""
+        columns = np.asarray(columns, dtype=np.int64)
+        flat = columns.ravel()
+        result = np.empty((len(flat), self.d), dtype=np.float32)
+        shard_of = np.searchsorted(self.offsets[1:], flat, side='right')
+        for shard in np.unique(shard_of):
+            mask = shard_of == shard
+            result[mask] = self.shards[shard][0][flat[mask] - self.offsets[shard]]
+        return result.reshape(columns.shape + (self.d,))
+
+    def column_blocks(self):
+        """Kolejne (pierwsza kolumna, wektory float32) - najwyżej rows_per_block wierszy naraz."""
+        for (vectors, _), offset in zip(self.shards, self.offsets):
+            for start in range(0, len(vectors), self.rows_per_block):
+                yield offset + start, np.asarray(vectors[start:start + self.rows_per_block], dtype=np.float32)
+
+    def search(self, x, k):
+        """(D, ID FAISS) k najlepszych wektorów dla znormalizowanych zapytań x (N, D)."""
+        x = np.asarray(x, dtype=np.float32)
+        best_D = np.full((len(x), k), -np.inf, dtype=np.float32)
+        best_I = np.full((len(x), k), -1, dtype=np.int64)
+        for vectors, ids in self.shards:
+            for start in range(0, len(vectors), self.rows_per_block):
+                scores = x @ np.asarray(vectors[start:start + self.rows_per_block], dtype=np.float32).T
+                block_ids = np.broadcast_to(np.asarray(ids[start:start + self.rows_per_block]), scores.shape)
+                best_D, best_I = merge_top_k([best_D, scores], [best_I, block_ids], k)
+        return best_D, best_I
+
+    @staticmethod
+    def exists(base_path):
+        return os.path.exists(base_path + SHARDS_SUFFIX)
+
+
+def export_shards(index, base_path, dtype="float16", shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Zapisuje wektory indeksu FAISS jako galerię shardów. Płaski indeks jest czytany
+    porcjami (reconstruct_n), indeksy z ID / IVF - w całości (gallery_vectors).
+    Zwraca liczbę zapisanych wektorów.
+    """
+    with ShardWriter(base_path, index.d, dtype, shard_size) as writer:
+        if _unwrap(index) is index and faiss.try_extract_index_ivf(index) is None:
+            for start in range(0, index.ntotal, shard_size):
+                count = min(shard_size, index.ntotal - start)
+                writer.add(index.reconstruct_n(start, count), np.arange(start, start + count))
+        else:
+            vectors, ids = gallery_vectors(index)
+            writer.add(vectors, ids)
+    return index.ntotal
+
@@ -0,0 +1,107 @@
+import numpy as np
+
+from models.embedder.base import l2_normalize, valid_rows
+
+# Galeria wielu szablonów: każde zdjęcie galerii to osobny wiersz indeksu FAISS,
+# a <base>_templates.npy (base = FAISS_MAPPING_FILE) przechowuje ID tożsamości
+# właściciela każdego wiersza. Wyniki szablonów jednej tożsamości są łączone:
+#   "max"        - najlepszy szablon,
+#   "mean_top_k" - średnia top_k najlepszych szablonów,
+#   "softmax"    - średnia ważona softmax(score / temperature) (miękkie maksimum).
+TEMPLATES_SUFFIX = "_templates.npy"
+AGGREGATIONS = ("max", "mean_top_k", "softmax")
+
+
+def template_embeddings(embeddings):
+    """Poprawne (nie-NaN), znormalizowane embeddingi zdjęć tożsamości albo None (odpowiednik mean_embedding)."""
+    embeddings = embeddings[valid_rows(embeddings)]
+    if len(embeddings) == 0:
+        return None
+    return l2_normalize(embeddings)
+
+
+def save_template_owners(base_path, owners):
+    np.save(base_path + TEMPLATES_SUFFIX, np.asarray(owners, dtype=np.int64))
+
+
+def load_template_owners(base_path):
+    return np.load(base_path + TEMPLATES_SUFFIX, mmap_mode='r')
+
+
+def aggregate_scores(D, owners, k, aggregation="max", top_k=3, temperature=0.1):
+    """
+    Łączy wyniki szablonów per tożsamość redukcjami po segmentach (bez pętli Pythona).
+    D, owners: (N, T) - podobieństwa znalezionych szablonów i ID ich tożsamości (-1 = brak).
+    Zwraca (N, k) podobieństw i ID tożsamości malejąco (-inf / -1, gdy tożsamości jest mniej niż k).
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Nieznana agregacja '{aggregation}' (dostępne: {', '.join(AGGREGATIONS)})")
+    num_queries, num_templates = D.shape
+    out_D = np.full((num_queries, k), -np.inf, dtype=np.float32)
+    out_I = np.full((num_queries, k), -1, dtype=np.int64)
+
+    query = np.repeat(np.arange(num_queries), num_templates)
+    scores = np.asarray(D, dtype=np.float64).ravel()
+    owner = np.asarray(owners, dtype=np.int64).ravel()
+    valid = (owner >= 0) & np.isfinite(scores)
+    if not valid.any():
+        return out_D, out_I
+    query, scores, owner = query[valid], scores[valid], owner[valid]
+
+    # Segment = (zapytanie, tożsamość); w segmencie wyniki malejąco, więc pierwszy to maksimum
+    order = np.lexsort((-scores, owner, query))
+    query, scores, owner = query[order], scores[order], owner[order]
+    new_segment = np.ones(len(scores), dtype=bool)
+    new_segment[1:] = (query[1:] != query[:-1]) | (owner[1:] != owner[:-1])
+    starts = np.flatnonzero(new_segment)
+    lengths = np.diff(np.append(starts, len(scores)))
+
+    if aggregation == "max":
+        segment_scores = scores[starts]
+    elif aggregation == "mean_top_k":
+        kept = (np.arange(len(scores)) - np.repeat(starts, lengths)) < top_k
+        segment_scores = np.add.reduceat(np.where(kept, scores, 0.0), starts) / np.add.reduceat(kept, starts)
+    else:
+        weights = np.exp((scores - np.repeat(scores[starts], lengths)) / temperature)
+        segment_scores = np.add.reduceat(weights * scores, starts) / np.add.reduceat(weights, starts)
+
+    # k najlepszych tożsamości każdego zapytania
+    segment_query, segment_owner = query[starts], owner[starts]
+    order = np.lexsort((-segment_scores, segment_query))
+    segment_query, segment_owner, segment_scores = segment_query[order], segment_owner[order], segment_scores[order]
+    rank = np.arange(len(segment_query)) - np.searchsorted(segment_query, segment_query)
+    kept = rank < k
+    out_D[segment_query[kept], rank[kept]] = segment_scores[kept]
+    out_I[segment_query[kept], rank[kept]] = segment_owner[kept]
+    return out_D, out_I
+
+
+class TemplateIndex:
+    """
+    Indeks szablonów widziany jak indeks tożsamości: search(x, k) pobiera z indeksu FAISS
+    search_k szablonów i zwraca (D, I) k najlepszych tożsamości po agregacji - działa
+    więc bez zmian z search_blocks / BlockSearcher. search_k=None: k * największa liczba
+    szablonów jednej tożsamości (wszystkie szablony k najlepszych tożsamości, gdy leżą najbliżej).
+    """
+
+    def __init__(self, index, owners, aggregation="max", top_k=3, temperature=0.1, search_k=None):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Nieznana agregacja '{aggregation}' (dostępne: {', '.join(AGGREGATIONS)})")
+        self.index = index
+        self.owners = np.asarray(owners, dtype=np.int64)
+        self.aggregation = aggregation
+        self.top_k = top_k
+        self.temperature = temperature
+        self.search_k = search_k
+        self.d = index.d
+        self.max_templates = int(np.bincount(self.owners).max()) if len(self.owners) else 0
+        self.ntotal = len(np.unique(self.owners))
+
+    def templates_to_search(self, k):
+        search_k = self.search_k or k * self.max_templates
+        return max(1, min(max(search_k, k), self.index.ntotal))
+
+    def search(self, x, k):
+        D, I = self.index.search(x, self.templates_to_search(k))
+        owners = np.where(I >= 0, self.owners[np.maximum(I, 0)], -1)
+        return aggregate_scores(D, owners, k, self.aggregation, self.top_k, self.temperature)
@@ -0,0 +1,138 @@
+import numpy as np
+
+from models.embedder.base import l2_normalize
+
+
+def _column_blocks(gallery_matrix):
+    """(pierwsza kolumna, wektory float32) kolejnych części galerii - ShardedGallery jest czytana porcjami."""
+    if hasattr(gallery_matrix, "column_blocks"):
+        return gallery_matrix.column_blocks()
+    return [(0, np.asarray(gallery_matrix, dtype=np.float32))]
+
+
+def _full_scores(queries, gallery_matrix):
+    """Wyniki zapytań (b, D) z całą galerią -> (b, N)."""
+    return np.concatenate([queries @ part.T for _, part in _column_blocks(gallery_matrix)], axis=1)
+
+
+def verification_blocks(query_embeddings, ground_truth_indices, gallery_matrix, block_size=1024):
+    """
+    Wyniki weryfikacji 1:1 zapytania x cała galeria, liczone blokami:
+    jeden GEMM (block_size x D) @ (D x N) na blok zamiast pętli po parach.
+    Etykiety wynikają z wektora indeksów: para jest 'genuine', gdy kolumna galerii
+    to indeks prawdziwego ID zapytania. gallery_matrix może być też ShardedGallery -
+    wtedy blok zapytań jest mnożony kolejno przez porcje shardów (N' kolumn naraz).
+    Zwraca kolejne (scores (b, N') float32, labels (b, N') bool).
+    """
+    ground_truth_indices = np.asarray(ground_truth_indices)
+    for start in range(0, len(query_embeddings), block_size):
+        queries = l2_normalize(np.asarray(query_embeddings[start:start + block_size], dtype=np.float32))
+        for offset, part in _column_blocks(gallery_matrix):
+            scores = queries @ part.T
+            labels = (offset + np.arange(len(part)))[None, :] == ground_truth_indices[start:start + block_size, None]
+            yield scores, labels
+
+
+# Tryby próbkowania par imposter ("all" = cała galeria, verification_blocks)
+SAMPLING_MODES = ("all", "fixed", "hard", "stratified")
+
+
+def _pair_scores(queries, gallery_matrix, columns):
+    """Podobieństwa zapytań (b, D) z wybranymi kolumnami galerii (b, m) -> (b, m)."""
+    return np.einsum('bd,bmd->bm', queries, gallery_matrix[columns])
+
+
+def _uniform_imposters(ground_truth, num_gallery, num_imposters, rng):
+    """Losowanie ze zwracaniem num_imposters kolumn != prawdziwe ID; waga (N - 1) / m."""
+    if num_gallery < 2:
+        # Galeria jednej tożsamości nie ma imposterów
+        return np.zeros((len(ground_truth), 0), dtype=np.int64), np.zeros((len(ground_truth), 0), dtype=np.float32)
+    columns = rng.integers(0, num_gallery - 1, size=(len(ground_truth), num_imposters))
+    columns += columns >= ground_truth[:, None] # Pomijamy kolumnę prawdziwego ID
+    weights = np.full(columns.shape, (num_gallery - 1) / num_imposters, dtype=np.float32)
+    return columns, weights
+
+
+def _stratified_imposters(scores, ground_truth, num_imposters, strata, rng):
+    """
+    num_imposters losowań ze zwracaniem w każdym przedziale wyniku (granice strata);
+    waga = liczność przedziału / num_imposters. Zwraca (kolumny, wagi) o kształcie (b, S * m).
+    """
+    rows = np.arange(len(scores))
+    stratum = np.digitize(scores, strata)
+    num_strata = len(strata) + 1
+    stratum[rows, ground_truth] = num_strata # Para genuine poza przedziałami
+    # Kolumny posortowane po przedziale: przedział s zajmuje [starts[s], starts[s] + counts[s])
+    order = np.argsort(stratum, axis=1, kind='stable')
+    counts = np.stack([np.count_nonzero(stratum == s, axis=1) for s in range(num_strata)], axis=1)
+    starts = np.cumsum(counts, axis=1) - counts
+    picks = starts[:, :, None] + (rng.random((len(scores), num_strata, num_imposters)) * counts[:, :, None]).astype(np.int64)
+    picks = np.minimum(picks, scores.shape[1] - 1).reshape(len(scores), -1)
+    columns = np.take_along_axis(order, picks, axis=1)
+    weights = np.repeat(counts / num_imposters, num_imposters, axis=1).astype(np.float32)
+    return columns, weights # Puste przedziały mają wagę 0
+
+
+def sampled_verification_blocks(query_embeddings, ground_truth_indices, gallery_matrix, mode="fixed",
+                                num_imposters=100, hard_k=10, strata=(0.0, 0.1, 0.2, 0.3, 0.4),
+                                index=None, block_size=1024, seed=0, index_ids=None):
+    """
+    Weryfikacja 1:1 z próbkowaniem par imposter zamiast zapytania x cała galeria
+    (Q x N par). Każde zapytanie daje parę genuine (waga 1) i imposterów z wagami
+    ważności (odwrotność prawdopodobieństwa wylosowania), więc ważone metryki
+    (calculate_metrics) są nieobciążonymi estymatorami metryk dla wszystkich par:
+      - "fixed": num_imposters losowych kolumn na zapytanie - liczymy tylko te
+        iloczyny skalarne (bez GEMM z całą galerią);
+      - "hard": hard_k najbliższych imposterów z indeksu FAISS (index.search, waga 1)
+        + num_imposters losowych z pozostałych (losowania trafiające w hard_k odpadają);
+      - "stratified": num_imposters losowań w każdym przedziale wyniku (granice strata) -
+        wymaga pełnego wiersza wyników (GEMM), ale zapisuje tylko wylosowane pary.
+    index_ids: rosnące ID FAISS kolejnych kolumn galerii, jeśli index zwraca stałe ID
+    zamiast numerów wierszy (gallery_vectors). Dla ShardedGallery (czytanej tylko
+    w potrzebnych wierszach) index może być nią samą, a index_ids = gallery_matrix.ids.
+    Zwraca kolejne płaskie (scores, labels, weights).
+    """
+    if mode not in SAMPLING_MODES[1:]:
+        raise ValueError(f"Nieznany tryb próbkowania '{mode}' (dostępne: {', '.join(SAMPLING_MODES[1:])})")
+    if mode == "hard" and index is None:
+        raise ValueError("Tryb 'hard' wymaga indeksu FAISS")
+
+    rng = np.random.default_rng(seed)
+    if not hasattr(gallery_matrix, "column_blocks"):
+        gallery_matrix = np.asarray(gallery_matrix, dtype=np.float32)
+    ground_truth_indices = np.asarray(ground_truth_indices, dtype=np.int64)
+    num_gallery = len(gallery_matrix)
+    strata = np.asarray(strata, dtype=np.float32)
+    for start in range(0, len(query_embeddings), block_size):
+        queries = l2_normalize(np.asarray(query_embeddings[start:start + block_size], dtype=np.float32))
+        ground_truth = ground_truth_indices[start:start + block_size]
+        genuine_scores = np.einsum('bd,bd->b', queries, gallery_matrix[ground_truth])
+
+        if mode == "stratified":
+            scores = _full_scores(queries, gallery_matrix)
+            columns, weights = _stratified_imposters(scores, ground_truth, num_imposters, strata, rng)
+            imposter_scores = np.take_along_axis(scores, columns, axis=1)
+        else:
+            columns, weights = _uniform_imposters(ground_truth, num_gallery, num_imposters, rng)
+            imposter_scores = _pair_scores(queries, gallery_matrix, columns)
+
+        if mode == "hard":
+            # hard_k + 1 kandydatów, bo prawdziwe ID zwykle jest wśród najbliższych
+            hard_scores, hard_columns = index.search(queries, min(hard_k + 1, num_gallery))
+            if index_ids is not None:
+                # ID FAISS -> numer kolumny galerii
+                positions = np.clip(np.searchsorted(index_ids, hard_columns), 0, num_gallery - 1)
+                hard_columns = np.where(index_ids[positions] == hard_columns, positions, -1)
+            is_imposter = (hard_columns != ground_truth[:, None]) & (hard_columns >= 0)
+            is_imposter &= np.cumsum(is_imposter, axis=1) <= hard_k
+            # Losowania, które trafiły w zbiór "hard", są już policzone z wagą 1
+            in_hard = ((columns[:, :, None] == hard_columns[:, None, :]) & is_imposter[:, None, :]).any(axis=2)
+            weights[in_hard] = 0
+            imposter_scores = np.concatenate([hard_scores[is_imposter], imposter_scores.ravel()])
+            weights = np.concatenate([np.ones(np.count_nonzero(is_imposter), dtype=np.float32), weights.ravel()])
+
+        imposter_scores, weights = imposter_scores.ravel(), weights.ravel()
+        keep = weights > 0
+        yield (np.concatenate([genuine_scores, imposter_scores[keep]]),
+               np.concatenate([np.ones(len(genuine_scores), dtype=bool), np.zeros(np.count_nonzero(keep), dtype=bool)]),
+               np.concatenate([np.ones(len(genuine_scores), dtype=np.float32), weights[keep]]))
@@ -0,0 +1,2 @@
+from models.pipeline.stages import Stage, Pipeline
+from models.pipeline.embedding import embedding_stages
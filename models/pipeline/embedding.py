@@ -0,0 +1,78 @@
+import numpy as np
+
+from models.embedder.base import read_image_bytes, decode_image
+from models.embedder.preprocess import read_annotation, occlusion_transform, embedding_params
+from models.pipeline.stages import Stage
+
+
+def embedding_stages(model, occlusion_size=0, align_with_landmarks=False, workers=None, queue_size=8):
+    """
+    Etapy read -> preprocess -> infer dla modelu działającego w procesie głównym.
+    Wejście: porcje (tag, jpg_paths, json_paths, save_paths) jak w embed_files_stream,
+    wyjście: (tag, embeddingi) - wiersz NaN, gdy nie ma twarzy albo adnotacji.
+
+    'workers' to słownik liczby wątków na etap, np. {"read": 4, "preprocess": 8, "infer": 1}.
+    Jeśli model ma cache (CachedEmbedder), trafienia są rozpoznawane już przy odczycie
+    i nie są dekodowane ani liczone.
+    """
+    workers = workers or {}
+    cache = getattr(model, "cache", None)
+    params = embedding_params(occlusion_size, align_with_landmarks)
+    need_annotations = bool(occlusion_size or align_with_landmarks)
+
+    def read(chunk):
+        """I/O: bajty JPEG + adnotacje JSON, sprawdzenie cache."""
+        tag, jpg_paths, json_paths, save_paths = chunk
+        images_bytes = [read_image_bytes(jpg_path) for jpg_path in jpg_paths]
+        annotations = None
+        if need_annotations:
+            annotations = [read_annotation(json_path) for json_path in json_paths]
+            images_bytes = [None if annotation is None else image_bytes
+                            for image_bytes, annotation in zip(images_bytes, annotations)]
+
+        keys = None
+        if cache is not None:
+            keys = [None if not image_bytes else cache.make_key(image_bytes, params)
+                    for image_bytes in images_bytes]
+            output, hits = cache.lookup(keys)
+            todo = [i for i, key in enumerate(keys) if key is not None and not hits[i]]
+        else:
+            output = np.full((len(images_bytes), model.dimension), np.nan, dtype=np.float32)
+            todo = [i for i, image_bytes in enumerate(images_bytes) if image_bytes]
+
+        return {"tag": tag, "bytes": images_bytes, "annotations": annotations, "save": save_paths,
+                "keys": keys, "output": output, "todo": todo}
+
+    def preprocess(chunk):
+        """CPU: dekodowanie, okluzja (i zapis podglądu) tylko dla obrazów spoza cache."""
+        annotations = chunk["annotations"]
+        transform = None
+        if occlusion_size:
+            transform = occlusion_transform(annotations, occlusion_size, chunk["save"])
+        images = []
+        for i in chunk["todo"]:
+            image_bgr = decode_image(chunk["bytes"][i])
+            if image_bgr is not None and transform is not None:
+                image_bgr = transform(image_bgr, i)
+            images.append(image_bgr)
+        chunk["images"] = images
+        chunk["bytes"] = None
+        if align_with_landmarks:
+            chunk["landmarks"] = [annotations[i]["landmarks"] for i in chunk["todo"]]
+        return chunk
+
+    def infer(chunk):
+        """Model: jeden embed_batch na porcję, nowe wyniki trafiają do cache."""
+        todo = chunk["todo"]
+        if todo:
+            embeddings = model.embed_batch(chunk["images"], chunk.get("landmarks"))
+            chunk["output"][todo] = embeddings
+            if cache is not None:
+                cache.store([chunk["keys"][i] for i in todo], embeddings)
+        return chunk["tag"], chunk["output"]
+
+    return [
+        Stage("read", read, workers.get("read", 1), queue_size),
+        Stage("preprocess", preprocess, workers.get("preprocess", 1), queue_size),
+        Stage("infer", infer, workers.get("infer", 1), queue_size),
+    ]
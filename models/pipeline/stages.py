@@ -0,0 +1,146 @@
+import time
+import queue
+import threading
+
+from tqdm import tqdm
+
+# Znacznik końca strumienia w kolejkach między etapami
+_DONE = object()
+
+
+class Stage:
+    """
+    Etap potoku: 'workers' wątków pobiera elementy z własnej kolejki wejściowej
+    (najwyżej queue_size elementów), wywołuje fn(element) i przekazuje wynik
+    do następnego etapu. fn może zwrócić None - wtedy element nie idzie dalej.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=8):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.input = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, seconds):
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += seconds
+
+
+class Pipeline:
+    """
+    Łańcuch etapów połączonych ograniczonymi kolejkami: źródło (leniwy iterator)
+    -> etap 1 -> ... -> etap N. Dysk, CPU i model pracują jednocześnie, a pełna
+    kolejka wstrzymuje szybszy etap (backpressure), więc pamięć jest ograniczona.
+
+    report() pokazuje dla każdego etapu przepustowość, zajętość wątków i
+    głębokość kolejki - etap z zajętością ~100% i pełną kolejką przed sobą
+    to wąskie gardło.
+    """
+
+    def __init__(self, source, stages, name="potok", report_interval=None):
+        self.source = iter(source)
+        self.stages = list(stages)
+        self.name = name
+        self.report_interval = report_interval
+        self.produced = 0
+        self.source_seconds = 0.0
+        self._remaining = [stage.workers for stage in self.stages]
+        self._lock = threading.Lock()
+        self._error = None
+        self._start = None
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+
+    def _feed(self):
+        first = self.stages[0]
+        try:
+            while self._error is None:
+                start = time.time()
+                item = next(self.source, _DONE)
+                self.source_seconds += time.time() - start
+                if item is _DONE:
+                    break
+                self.produced += 1
+                first.input.put(item)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for _ in range(first.workers):
+                first.input.put(_DONE)
+
+    def _work(self, position):
+        stage = self.stages[position]
+        next_stage = self.stages[position + 1] if position + 1 < len(self.stages) else None
+        while True:
+            item = stage.input.get()
+            if item is _DONE:
+                break
+            if self._error is not None:
+                # Po błędzie tylko opróżniamy kolejkę, żeby wcześniejsze etapy nie utknęły
+                continue
+            start = time.time()
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                self._fail(e)
+                continue
+            stage._record(time.time() - start)
+            if result is not None and next_stage is not None:
+                next_stage.input.put(result)
+
+        with self._lock:
+            self._remaining[position] -= 1
+            last_worker = self._remaining[position] == 0
+        if last_worker and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.input.put(_DONE)
+
+    def run(self):
+        """Uruchamia wszystkie etapy i czeka na koniec strumienia (błąd etapu jest rzucany dalej)."""
+        self._start = time.time()
+        threads = [threading.Thread(target=self._feed, daemon=True)]
+        for position, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, args=(position,), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        last_report = time.time()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+                if self.report_interval and time.time() - last_report >= self.report_interval:
+                    tqdm.write(self.report())
+                    last_report = time.time()
+
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def bottleneck(self):
+        """Nazwa etapu (albo źródła) o największej zajętości wątków."""
+        elapsed = max(time.time() - self._start, 1e-9)
+        busy = {"źródło": self.source_seconds / elapsed}
+        for stage in self.stages:
+            busy[stage.name] = stage.busy_seconds / (elapsed * stage.workers)
+        return max(busy, key=busy.get)
+
+    def report(self):
+        """Przepustowość, zajętość i głębokość kolejki każdego etapu (tekst do wypisania)."""
+        elapsed = max(time.time() - self._start, 1e-9)
+        lines = [f"[{self.name}] {elapsed:.0f} s, wąskie gardło: {self.bottleneck()}"]
+        lines.append(f"  {'źródło':<12} {self.produced:>8} elem. {self.produced / elapsed:>9.1f}/s"
+                     f"  zajętość {100 * self.source_seconds / elapsed:5.1f}%")
+        for stage in self.stages:
+            busy = 100 * stage.busy_seconds / (elapsed * stage.workers)
+            lines.append(f"  {stage.name:<12} {stage.processed:>8} elem. {stage.processed / elapsed:>9.1f}/s"
+                         f"  zajętość {busy:5.1f}%  kolejka {stage.input.qsize()}/{stage.input.maxsize}"
+                         f"  wątki {stage.workers}")
+        return "\n".join(lines)
@@ -0,0 +1,4 @@
+# Kroki s_* uruchamia się z tego katalogu (python main.py - tak działa obraz Dockera), a moduły
+# importują się nawzajem bez prefiksu pakietu. Pakiet jest potrzebny warstwie modeli: czytniki
+# formatów danych (annotation_store, image_shards, manifest) importuje models.embedder.formats,
+# więc nie mogą one zależeć od config ani od kroków s_*.
@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import threading
+
+import numpy as np
+
+# Adnotacje całego podziału (bbox, landmarki, confidence z s_03_process) w jednym pliku
+# kolumnowym <split>/annotations.store zamiast pliku .json obok każdego zdjęcia:
+#   8 B   - długość nagłówka (uint64, little-endian),
+#   JSON  - nagłówek: liczba wierszy, szerokość klucza, przesunięcia kolumn,
+#   kolumny (wyrównane do 64 B): key (S, posortowane), bbox (N, 4), landmarks (N, 5, 2),
+#   confidence (N,) - float32.
+# Klucz = ścieżka zdjęcia względem podziału bez rozszerzenia, np. "0000045/001/001".
+# Plik jest otwierany jednym np.memmap; zapis przez plik tymczasowy + os.replace.
+# Moduł nie importuje config.py (torch) - korzystają z niego też ewaluatory w models/.
+STORE_FILE = "annotations.store"
+LANDMARK_KEYS = ("right_eye", "left_eye", "nose", "mouth_right", "mouth_left")
+COLUMNS = (("bbox", (4,)), ("landmarks", (5, 2)), ("confidence", ()))
+ALIGNMENT = 64
+
+
+def store_path(split_dir):
+    return os.path.join(split_dir, STORE_FILE)
+
+
+def annotation_key(path, split_dir):
+    """Klucz zdjęcia (albo jego .json): ścieżka względem podziału bez rozszerzenia, separator '/'."""
+    relative = os.path.relpath(os.path.splitext(path)[0], split_dir)
+    return relative.replace(os.sep, "/")
+
+
+def to_annotation(bbox, landmarks, confidence):
+    """Wiersz magazynu -> słownik w schemacie JSON z s_03_process."""
+    return {
+        "bbox": [float(val) for val in bbox],
+        "landmarks": {key: [float(coord[0]), float(coord[1])] for key, coord in zip(LANDMARK_KEYS, landmarks)},
+        "confidence": float(confidence)
+    }
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class AnnotationStore:
+    """Adnotacje podziału z pliku kolumnowego (memmap): get(klucz), rows(klucze), kolumny jako tablice."""
+
+    def __init__(self, split_dir):
+        self.split_dir = split_dir
+        path = store_path(split_dir)
+        with open(path, 'rb') as f:
+            header_size = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            header = json.loads(f.read(header_size))
+        self.count = header["count"]
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        key_offset = header["offsets"]["key"]
+        self.keys = np.ndarray((self.count,), dtype=f"S{header['key_width']}", buffer=data, offset=key_offset)
+        for name, shape in COLUMNS:
+            setattr(self, name, np.ndarray((self.count,) + shape, dtype='<f4', buffer=data,
+                                           offset=header["offsets"][name]))
+
+    def __len__(self):
+        return self.count
+
+    def rows(self, keys):
+        """Numery wierszy kluczy (-1, gdy brak adnotacji) - jedno searchsorted dla wszystkich."""
+        keys = np.asarray([key.encode() if isinstance(key, str) else key for key in keys], dtype=bytes)
+        if self.count == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.keys, keys), self.count - 1)
+        return np.where(self.keys[rows] == keys, rows, -1)
+
+    def __contains__(self, key):
+        return self.rows([key])[0] >= 0
+
+    def get(self, key):
+        """Adnotacja (schemat JSON) albo None."""
+        row = self.rows([key])[0]
+        if row < 0:
+            return None
+        return to_annotation(self.bbox[row], self.landmarks[row], self.confidence[row])
+
+    @staticmethod
+    def exists(split_dir):
+        return os.path.exists(store_path(split_dir))
+
+
+class AnnotationWriter:
+    """
+    Zbiera adnotacje podziału (add) i zapisuje cały magazyn (save) - razem z wierszami,
+    które już były w pliku, więc przerwane przetwarzanie można wznowić.
+    """
+
+    def __init__(self, split_dir):
+        self.split_dir = split_dir
+        self.keys = np.zeros(0, dtype='S1')
+        self.values = {name: np.zeros((0,) + shape, dtype='<f4') for name, shape in COLUMNS}
+        if AnnotationStore.exists(split_dir):
+            store = AnnotationStore(split_dir)
+            self.keys = np.array(store.keys)
+            self.values = {name: np.array(getattr(store, name)) for name, _ in COLUMNS}
+        self.known = set(key.decode() for key in self.keys)
+        self.new_rows = []
+
+    def __contains__(self, key):
+        return key in self.known
+
+    @property
+    def pending(self):
+        return len(self.new_rows)
+
+    def add(self, key, bbox, landmarks, confidence):
+        self.new_rows.append((key.encode(), bbox, landmarks, confidence))
+        self.known.add(key)
+
+    def _merge(self):
+        """Dołącza nowe wiersze; ostatnia adnotacja klucza wygrywa, wynik posortowany po kluczu."""
+        if not self.new_rows:
+            return
+        keys = np.concatenate([self.keys, np.array([row[0] for row in self.new_rows])])
+        values = {
+            name: np.concatenate([self.values[name],
+                                  np.asarray([row[column + 1] for row in self.new_rows], dtype='<f4').reshape((-1,) + shape)])
+            for column, (name, shape) in enumerate(COLUMNS)
+        }
+        _, last = np.unique(keys[::-1], return_index=True)
+        order = len(keys) - 1 - last
+        self.keys = keys[order]
+        self.values = {name: column[order] for name, column in values.items()}
+        self.new_rows = []
+
+    def save(self):
+        self._merge()
+        key_width = max(1, self.keys.dtype.itemsize)
+        blocks = [("key", self.keys.astype(f"S{key_width}"))] + [(name, self.values[name]) for name, _ in COLUMNS]
+        # Rozmiar nagłówka liczony z największymi możliwymi przesunięciami - potem dopełniany spacjami
+        header = {"count": int(len(self.keys)), "key_width": key_width, "offsets": {}}
+        header_size = len(json.dumps(dict(header, offsets={name: 2**62 for name, _ in blocks})).encode())
+        offset = _aligned(8 + header_size)
+        for name, block in blocks:
+            header["offsets"][name] = offset
+            offset = _aligned(offset + block.nbytes)
+
+        path = store_path(self.split_dir)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(np.array([header_size], dtype='<u8').tobytes())
+            f.write(json.dumps(header).encode().ljust(header_size))
+            for name, block in blocks:
+                f.seek(header["offsets"][name])
+                f.write(np.ascontiguousarray(block).tobytes())
+            f.truncate(offset)
+        os.replace(path + ".tmp", path)
+        return len(self.keys)
+
+
+# Magazyny otwarte przez lookup_annotation (katalog podziału -> AnnotationStore albo None)
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def split_dir_of(path):
+    """Katalog podziału dla split/<id>/<zdjęcie>/<plik> (układ z s_02b_restructure)."""
+    return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+
+
+def open_store(split_dir):
+    """Magazyn podziału (otwierany raz na proces) albo None, gdy go nie ma."""
+    with _stores_lock:
+        if split_dir not in _stores:
+            _stores[split_dir] = AnnotationStore(split_dir) if AnnotationStore.exists(split_dir) else None
+        return _stores[split_dir]
+
+
+def lookup_annotation(path):
+    """Adnotacja zdjęcia (ścieżka .jpg albo .json) z magazynu jego podziału albo None."""
+    split_dir = split_dir_of(path)
+    store = open_store(split_dir)
+    if store is None:
+        return None
+    return store.get(annotation_key(os.path.abspath(path), split_dir))
+
+
+def export_json(split_dir, indent=4):
+    """Opcjonalny eksport: plik .json obok każdego zdjęcia (jak dotąd zapisywał s_03_process)."""
+    store = AnnotationStore(split_dir)
+    for row, key in enumerate(store.keys):
+        json_path = os.path.join(split_dir, *key.decode().split("/")) + ".json"
+        with open(json_path, 'w') as f:
+            json.dump(to_annotation(store.bbox[row], store.landmarks[row], store.confidence[row]), f, indent=indent)
+    return len(store)
+
+
+if __name__ == "__main__":
+    # python annotation_store.py <katalog podziału> - eksport adnotacji do plików .json
+    if len(sys.argv) != 2:
+        print("Użycie: python annotation_store.py <katalog podziału, np. webface_112x112/test>")
+        sys.exit(1)
+    print(f"Zapisano {export_json(sys.argv[1])} plików .json.")
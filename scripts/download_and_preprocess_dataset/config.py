@@ -14,4 +14,43 @@ DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
 NUM_WORKERS = os.cpu_count() or 4
 
-IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
\ No newline at end of file
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Detekcja RetinaFace (s_03_process): liczba obrazów w jednym wywołaniu modelu.
+# DETECTION_UPSCALING jak allow_upscaling w RetinaFace.detect_faces - True skaluje obraz
+# 112x112 do 1024x1024 (jak dotąd); False liczy w natywnej rozdzielczości (dużo szybciej na CPU,
+# ale wykrycia mogą się nieznacznie różnić).
+DETECTION_BATCH_SIZE = 16
+DETECTION_UPSCALING = True
+
+# Adnotacje (bbox, landmarki, confidence) zapisywane są w jednym pliku kolumnowym na podział
+# (<split>/annotations.store, patrz annotation_store.py), co ANNOTATION_SAVE_EVERY nowych obrazów.
+# ANNOTATION_JSON_EXPORT = True zapisuje dodatkowo plik .json obok każdego zdjęcia (jak dawniej);
+# eksport z gotowego magazynu: python annotation_store.py webface_112x112/test
+ANNOTATION_JSON_EXPORT = False
+ANNOTATION_SAVE_EVERY = 10000
+
+# Pakowanie podziałów (s_03b_pack, image_shards.py): zdjęcia + adnotacje w archiwach tar
+# po ~PACK_SHARD_BYTES bajtów z indeksem w <split>/shards/ - duże sekwencyjne odczyty zamiast
+# setek tysięcy małych plików (lokalnie i w GCS). PACK_IMAGES = False pomija ten etap.
+PACK_IMAGES = True
+PACK_SHARD_BYTES = 1 << 30
+
+# Manifest podziału (s_03c_manifest, manifest.py): lista zdjęć z tożsamością, kluczem, ścieżką
+# i wierszem adnotacji w <split>/manifest.npy - ewaluatory nie przeszukują drzewa plików przy starcie.
+MANIFEST_SCAN_WORKERS = 32
+
+# Wysyłanie (s_04_upload, object_store.py): UPLOAD_DESTINATION - gs://bucket[/prefiks] albo katalog
+# (file:///ścieżka) jako lokalny zamiennik magazynu. Wysłane obiekty (nazwa, rozmiar, mtime, MD5)
+# są dopisywane do UPLOAD_LEDGER, więc przerwane wysyłanie wznawia się od brakujących plików.
+# Małe pliki idą w zadaniach po UPLOAD_BATCH_FILES / UPLOAD_BATCH_BYTES. UPLOAD_PACKED_ONLY = True:
+# ze spakowanych podziałów tylko archiwa, indeks, adnotacje i manifest, bez pojedynczych zdjęć
+# (evaluate_local_test czyta pojedyncze pliki .jpg z GCS, a adnotacje z annotations.store).
+UPLOAD_DESTINATION = f"gs://{BUCKET_NAME}"
+UPLOAD_LEDGER = "upload_ledger.jsonl"
+UPLOAD_WORKERS = 32
+UPLOAD_BATCH_FILES = 256
+UPLOAD_BATCH_BYTES = 64 << 20
+UPLOAD_RETRIES = 5
+UPLOAD_RETRY_DELAY = 1.0
+UPLOAD_PACKED_ONLY = False
@@ -0,0 +1,221 @@
+import os
+import io
+import json
+import tarfile
+import threading
+
+import numpy as np
+
+# Spakowany podział: zamiast drzewa <split>/<id>/<zdjęcie>/<zdjęcie>.jpg kilka dużych plików
+#   <split>/shards/shard-00000.tar - archiwa tar w stylu WebDataset: dla każdego zdjęcia
+#                                    <klucz>.jpg (bajty JPEG) i <klucz>.json (adnotacja, jeśli jest),
+#   <split>/shards/index.npy       - indeks (posortowany po kluczu): numer shardu, przesunięcie
+#                                    i rozmiar danych JPEG oraz JSON w archiwum (-1 = brak).
+# Tar da się czytać sekwencyjnie każdym narzędziem (tar, WebDataset, strumień z GCS), a indeks
+# pozwala czytać pojedyncze zdjęcia (os.pread) bez rozpakowywania.
+# Klucz = ścieżka zdjęcia względem podziału bez rozszerzenia (jak w annotation_store).
+# Moduł nie importuje config.py (torch) - korzystają z niego też ewaluatory w models/.
+SHARDS_DIR = "shards"
+INDEX_FILE = "index.npy"
+DEFAULT_SHARD_BYTES = 1 << 30
+# Rozmiar odczytu przy czytaniu sekwencyjnym
+READ_BLOCK_BYTES = 64 << 20
+INDEX_DTYPE = [("shard", "<i4"), ("offset", "<i8"), ("size", "<i8"),
+               ("annotation_offset", "<i8"), ("annotation_size", "<i8")]
+
+
+def shards_dir(split_dir):
+    return os.path.join(split_dir, SHARDS_DIR)
+
+
+def shard_path(split_dir, shard):
+    return os.path.join(shards_dir(split_dir), f"shard-{shard:05d}.tar")
+
+
+def image_key(path, split_dir):
+    relative = os.path.relpath(os.path.splitext(path)[0], split_dir)
+    return relative.replace(os.sep, "/")
+
+
+class ShardWriter:
+    """
+    Dopisuje zdjęcia (add) do kolejnych archiwów tar po ~shard_bytes bajtów;
+    close() zapisuje indeks - bez niego podział nie jest uznawany za spakowany
+    (przy wyjątku w bloku with indeks nie jest zapisywany).
+    """
+
+    def __init__(self, split_dir, shard_bytes=DEFAULT_SHARD_BYTES):
+        self.split_dir = split_dir
+        self.shard_bytes = shard_bytes
+        self.keys = []
+        self.rows = []
+        self.shard = -1
+        self.tar = None
+        os.makedirs(shards_dir(split_dir), exist_ok=True)
+        if os.path.exists(os.path.join(shards_dir(split_dir), INDEX_FILE)):
+            os.remove(os.path.join(shards_dir(split_dir), INDEX_FILE))
+        # Archiwa poprzedniego pakowania (mogło ich być więcej) - inaczej zostałyby wysłane
+        for name in os.listdir(shards_dir(split_dir)):
+            if name.startswith("shard-") and name.endswith(".tar"):
+                os.remove(os.path.join(shards_dir(split_dir), name))
+
+    def _member(self, name, data):
+        """Dopisuje plik do archiwum; zwraca (przesunięcie danych, rozmiar)."""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        # Dane kończą się przed dopełnieniem do 512 B, na którym stoi teraz tar.offset
+        padded = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        return self.tar.offset - padded, len(data)
+
+    def add(self, key, image_bytes, annotation=None):
+        if self.tar is None or self.tar.offset >= self.shard_bytes:
+            self._next_shard()
+        offset, size = self._member(key + ".jpg", image_bytes)
+        annotation_offset, annotation_size = -1, -1
+        if annotation is not None:
+            annotation_offset, annotation_size = self._member(key + ".json", json.dumps(annotation).encode())
+        self.keys.append(key.encode())
+        self.rows.append((self.shard, offset, size, annotation_offset, annotation_size))
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        self.shard += 1
+        self.tar = tarfile.open(shard_path(self.split_dir, self.shard), 'w', format=tarfile.GNU_FORMAT)
+        # Archiwum nie musi pamiętać nagłówków wszystkich plików (setki tysięcy TarInfo)
+        self.tar.members = _Discard()
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+        keys = np.array(self.keys, dtype=bytes) if self.keys else np.zeros(0, dtype='S1')
+        index = np.zeros(len(keys), dtype=[("key", keys.dtype)] + INDEX_DTYPE)
+        index["key"] = keys
+        for column, (name, _) in enumerate(INDEX_DTYPE):
+            index[name] = [row[column] for row in self.rows]
+        index.sort(order="key")
+        np.save(os.path.join(shards_dir(self.split_dir), INDEX_FILE), index)
+        return len(index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.tar is not None:
+            self.tar.close()
+
+
+class _Discard(list):
+    """Lista, która nic nie przechowuje (TarFile.members przy zapisie)."""
+
+    def append(self, item):
+        pass
+
+
+class ImageShards:
+    """
+    Odczyt spakowanego podziału: read(klucz) - bajty JPEG jednym os.pread, annotation(klucz) -
+    adnotacja z archiwum, iter_images() - wszystkie zdjęcia sekwencyjnie, shard po shardzie.
+    """
+
+    def __init__(self, split_dir):
+        self.split_dir = split_dir
+        self.index = np.load(os.path.join(shards_dir(split_dir), INDEX_FILE), mmap_mode='r')
+        self.keys = self.index["key"]
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def rows(self, keys):
+        """Numery wierszy indeksu (-1, gdy zdjęcia nie ma w archiwach)."""
+        keys = np.asarray([key.encode() if isinstance(key, str) else key for key in keys], dtype=bytes)
+        if len(self.index) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.keys, keys), len(self.index) - 1)
+        return np.where(self.keys[rows] == keys, rows, -1)
+
+    def _fd(self, shard):
+        with self._lock:
+            if shard not in self._files:
+                self._files[shard] = os.open(shard_path(self.split_dir, shard), os.O_RDONLY)
+            return self._files[shard]
+
+    def _read(self, shard, offset, size):
+        return os.pread(self._fd(int(shard)), int(size), int(offset))
+
+    def read(self, key):
+        """Bajty JPEG zdjęcia albo None."""
+        row = self.rows([key])[0]
+        if row < 0:
+            return None
+        entry = self.index[row]
+        return self._read(entry["shard"], entry["offset"], entry["size"])
+
+    def annotation(self, key):
+        row = self.rows([key])[0]
+        if row < 0 or self.index[row]["annotation_size"] < 0:
+            return None
+        entry = self.index[row]
+        return json.loads(self._read(entry["shard"], entry["annotation_offset"], entry["annotation_size"]))
+
+    def iter_images(self):
+        """
+        (klucz, bajty JPEG, adnotacja albo None) dla wszystkich zdjęć w kolejności zapisu -
+        każdy shard czytany po kolei blokami READ_BLOCK_BYTES.
+        """
+        order = np.lexsort((self.index["offset"], self.index["shard"]))
+        for shard in np.unique(self.index["shard"]):
+            rows = order[self.index["shard"][order] == shard]
+            with open(shard_path(self.split_dir, shard), 'rb') as f:
+                block, block_start = b"", 0
+                for row in rows:
+                    entry = self.index[row]
+                    end = max(entry["offset"] + entry["size"], entry["annotation_offset"] + entry["annotation_size"])
+                    if end > block_start + len(block):
+                        # Następny blok zaczyna się od początku bieżącego zdjęcia
+                        f.seek(entry["offset"])
+                        block_start = int(entry["offset"])
+                        block = f.read(max(READ_BLOCK_BYTES, int(end - block_start)))
+                    image_bytes = block[entry["offset"] - block_start:entry["offset"] - block_start + entry["size"]]
+                    annotation = None
+                    if entry["annotation_size"] >= 0:
+                        start = entry["annotation_offset"] - block_start
+                        annotation = json.loads(block[start:start + entry["annotation_size"]])
+                    yield entry["key"].decode(), image_bytes, annotation
+
+    def close(self):
+        with self._lock:
+            for fd in self._files.values():
+                os.close(fd)
+            self._files = {}
+
+    @staticmethod
+    def exists(split_dir):
+        return os.path.exists(os.path.join(shards_dir(split_dir), INDEX_FILE))
+
+
+# Archiwa otwarte przez read_packed (katalog podziału -> ImageShards albo None)
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def open_shards(split_dir):
+    """Archiwa podziału (otwierane raz na proces) albo None, gdy podział nie jest spakowany."""
+    with _packs_lock:
+        if split_dir not in _packs:
+            _packs[split_dir] = ImageShards(split_dir) if ImageShards.exists(split_dir) else None
+        return _packs[split_dir]
+
+
+def read_packed(path):
+    """Bajty zdjęcia split/<id>/<zdjęcie>/<plik>.jpg z archiwów jego podziału albo None."""
+    split_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+    shards = open_shards(split_dir)
+    if shards is None:
+        return None
+    return shards.read(image_key(os.path.abspath(path), split_dir))
@@ -1,13 +1,14 @@
-import os
 import sys
 import time
 import logging
-from config import KAGGLE_DATASET, BUCKET_NAME, DEVICE
+from config import KAGGLE_DATASET, BUCKET_NAME, DEVICE, PACK_IMAGES
 
 import s_01_download
 import s_02_prepare
 import s_02b_restructure
 import s_03_process
+import s_03b_pack
+import s_03c_manifest
 import s_04_upload
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -40,6 +41,15 @@ def main():
         # Krok 3: Przetwarzanie (RetinaFace)
         logging.info("="*50)
         s_03_process.run()
+
+        # Krok 3b: Pakowanie (archiwa tar + indeks)
+        if PACK_IMAGES:
+            logging.info("="*50)
+            s_03b_pack.run()
+
+        # Krok 3c: Manifest (lista zdjęć dla ewaluatorów)
+        logging.info("="*50)
+        s_03c_manifest.run()
         
         # Krok 4: Wysyłanie
         logging.info("="*50)
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+if __package__:
+    from .annotation_store import AnnotationStore, STORE_FILE
+    from .image_shards import ImageShards, SHARDS_DIR, INDEX_FILE
+else:
+    from annotation_store import AnnotationStore, STORE_FILE
+    from image_shards import ImageShards, SHARDS_DIR, INDEX_FILE
+
+# Manifest podziału - lista zdjęć zamiast glob + os.path.exists przy każdym starcie ewaluacji:
+#   <split>/manifest.npy  - tablica (posortowana po kluczu): tożsamość, klucz zdjęcia, ścieżka .jpg
+#                           względem podziału, wiersz w annotations.store (-1 = brak) i czy zdjęcie
+#                           ma adnotację (magazyn, archiwum albo plik .json),
+#   <split>/manifest.json - nagłówek: liczba zdjęć i znaczniki źródeł (foldery tożsamości z czasem
+#                           modyfikacji, czas modyfikacji annotations.store i indeksu archiwów).
+#                           Inne znaczniki niż obecne = manifest nieaktualny.
+# Każde zdjęcie ma własny folder (s_02b_restructure), więc dodanie / usunięcie zdjęcia zmienia czas
+# modyfikacji folderu tożsamości. Zmiany wewnątrz folderu zdjęcia (np. ręcznie dopisany plik .json)
+# nie są wykrywane - po nich trzeba przebudować manifest (s_03c_manifest albo python manifest.py).
+# Bez (aktualnego) manifestu zdjęcia są wyszukiwane równolegle przez os.scandir - albo brane
+# z indeksu archiwów, gdy podział jest spakowany i nie ma drzewa plików.
+MANIFEST_FILE = "manifest.npy"
+HEADER_FILE = "manifest.json"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def identity_names(split_dir):
+    """Foldery tożsamości podziału (jedno os.scandir)."""
+    with os.scandir(split_dir) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir() and entry.name != SHARDS_DIR)
+
+
+def _mtime(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def source_stamps(split_dir):
+    """Znaczniki, po których poznajemy, że manifest nie odpowiada już podziałowi."""
+    with os.scandir(split_dir) as entries:
+        identities = sorted(f"{entry.name}:{entry.stat().st_mtime_ns}" for entry in entries
+                            if entry.is_dir() and entry.name != SHARDS_DIR)
+    return {
+        "identities": [len(identities), zlib.crc32("\n".join(identities).encode())],
+        "annotations": _mtime(os.path.join(split_dir, STORE_FILE)),
+        "shards": _mtime(os.path.join(split_dir, SHARDS_DIR, INDEX_FILE)),
+    }
+
+
+def _scan_identity(args):
+    """Zdjęcia jednej tożsamości: (klucz, ścieżka .jpg, czy jest plik .json) - os.scandir zamiast glob."""
+    split_dir, identity = args
+    rows = []
+    try:
+        with os.scandir(os.path.join(split_dir, identity)) as folders:
+            folders = [entry.name for entry in folders if entry.is_dir()]
+    except OSError:
+        return rows
+    for folder in folders:
+        try:
+            with os.scandir(os.path.join(split_dir, identity, folder)) as entries:
+                names = [entry.name for entry in entries]
+        except OSError:
+            continue
+        present = set(names)
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                key = f"{identity}/{folder}/{stem}"
+                rows.append((key, f"{key}{ext}", stem + ".json" in present))
+    return rows
+
+
+def scan_split(split_dir, workers=8, identities=None):
+    """
+    Buduje manifest podziału bez zapisu: równoległy os.scandir po folderach tożsamości,
+    a dla spakowanego podziału bez drzewa plików - klucze z indeksu archiwów.
+    identities ogranicza manifest do podanych tożsamości.
+    """
+    listed = identity_names(split_dir) if identities is None else identities
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        rows = [row for identity_rows in executor.map(_scan_identity, [(split_dir, identity) for identity in listed])
+                for row in identity_rows]
+
+    packed_annotation = None
+    if not rows and ImageShards.exists(split_dir):
+        index = ImageShards(split_dir).index
+        if identities is not None:
+            index = index[np.isin(np.char.partition(index["key"], b"/")[:, 0], [name.encode() for name in identities])]
+        rows = [(key.decode(), key.decode() + ".jpg", False) for key in index["key"]]
+        packed_annotation = np.asarray(index["annotation_size"] >= 0)
+
+    keys = np.array([key.encode() for key, _, _ in rows], dtype=bytes) if rows else np.zeros(0, dtype='S1')
+    jpg_paths = np.array([path.encode() for _, path, _ in rows], dtype=bytes) if rows else np.zeros(0, dtype='S1')
+    has_json = np.array([json_present for _, _, json_present in rows], dtype=bool)
+    if AnnotationStore.exists(split_dir):
+        annotation_rows = AnnotationStore(split_dir).rows(keys)
+    else:
+        annotation_rows = np.full(len(keys), -1, dtype=np.int64)
+    annotated = (annotation_rows >= 0) | has_json
+    if packed_annotation is not None:
+        annotated |= packed_annotation
+
+    manifest = np.zeros(len(keys), dtype=[
+        ("identity", keys.dtype), ("key", keys.dtype), ("jpg", jpg_paths.dtype),
+        ("annotation_row", "<i8"), ("annotated", "?"),
+    ])
+    manifest["identity"] = [key.split(b"/", 1)[0] for key in keys]
+    manifest["key"] = keys
+    manifest["jpg"] = jpg_paths
+    manifest["annotation_row"] = annotation_rows
+    manifest["annotated"] = annotated
+    manifest.sort(order="key")
+    return manifest
+
+
+def write_manifest(split_dir, manifest):
+    """Zapisuje manifest i nagłówek (nagłówek na końcu - bez niego manifest jest nieważny)."""
+    header_path = os.path.join(split_dir, HEADER_FILE)
+    if os.path.exists(header_path):
+        os.remove(header_path)
+    path = os.path.join(split_dir, MANIFEST_FILE)
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, manifest)
+    os.replace(path + ".tmp", path)
+    header = {"count": int(len(manifest)), "sources": source_stamps(split_dir)}
+    with open(header_path, 'w') as f:
+        json.dump(header, f, indent=4)
+
+
+def read_manifest(split_dir):
+    """Manifest (memmap), jeśli istnieje i jest aktualny, w przeciwnym razie None."""
+    try:
+        with open(os.path.join(split_dir, HEADER_FILE), 'r') as f:
+            header = json.load(f)
+        if header["sources"] != json.loads(json.dumps(source_stamps(split_dir))):
+            return None
+        manifest = np.load(os.path.join(split_dir, MANIFEST_FILE), mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        return None
+    return manifest if len(manifest) == header["count"] else None
+
+
+def load_manifest(split_dir, workers=8, save=True):
+    """
+    Manifest podziału: z pliku, gdy jest aktualny, a w przeciwnym razie skanowany
+    (scan_split) i - jeśli się da - zapisywany, żeby kolejny start był szybki.
+    Zwraca (manifest, czy pochodzi z pliku).
+    """
+    manifest = read_manifest(split_dir)
+    if manifest is not None:
+        return manifest, True
+    manifest = scan_split(split_dir, workers)
+    if save:
+        try:
+            write_manifest(split_dir, manifest)
+        except OSError:
+            pass
+    return manifest, False
+
+
+if __name__ == "__main__":
+    # python manifest.py <katalog podziału> [wątki] - (ponowne) zbudowanie manifestu
+    if len(sys.argv) not in (2, 3):
+        print("Użycie: python manifest.py <katalog podziału, np. webface_112x112/test> [wątki]")
+        sys.exit(1)
+    manifest = scan_split(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else os.cpu_count() or 4)
+    write_manifest(sys.argv[1], manifest)
+    print(f"Zapisano manifest: {len(manifest)} zdjęć, {int(manifest['annotated'].sum())} z adnotacją.")
@@ -0,0 +1,74 @@
+import os
+import base64
+import shutil
+import hashlib
+import threading
+
+# Miejsca docelowe wysyłania (s_04_upload) - wspólny interfejs put(ścieżka, nazwa obiektu, md5):
+#   gs://bucket[/prefiks]        - Google Cloud Storage (google-cloud-storage),
+#   file:///katalog albo katalog - lokalny zamiennik magazynu obiektów (testy, dysk sieciowy,
+#                                  katalog podmontowany z MinIO itp.).
+# Obiekt jest zapisany w całości albo wcale, a suma MD5 jest sprawdzana po stronie magazynu.
+HASH_BLOCK_BYTES = 8 << 20
+
+
+def file_md5(path):
+    """MD5 pliku (hex), liczone blokami."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LocalBackend:
+    """Magazyn obiektów w katalogu: obiekt a/b/c -> <root>/a/b/c (plik tymczasowy + os.replace)."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def __str__(self):
+        return f"file://{os.path.abspath(self.root)}"
+
+    def put(self, path, name, md5):
+        target = os.path.join(self.root, *name.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.tmp-{threading.get_ident()}"
+        try:
+            shutil.copyfile(path, tmp_path)
+            # Jak magazyn obiektów: zapisana kopia musi mieć sumę podaną przez klienta
+            if file_md5(tmp_path) != md5:
+                raise IOError(f"Niezgodna suma MD5 obiektu {name}")
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class GCSBackend:
+    """Bucket GCS; MD5 wysyłane z obiektem, więc GCS odrzuca uszkodzony zapis."""
+
+    def __init__(self, bucket_name, prefix=""):
+        # Import tutaj - lokalny zamiennik nie wymaga google-cloud-storage
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix.strip("/")
+
+    def __str__(self):
+        return f"gs://{self.bucket.name}/{self.prefix}".rstrip("/")
+
+    def put(self, path, name, md5):
+        blob = self.bucket.blob(f"{self.prefix}/{name}" if self.prefix else name)
+        blob.md5_hash = base64.b64encode(bytes.fromhex(md5)).decode()
+        blob.upload_from_filename(path)
+
+
+def create_backend(destination):
+    """Backend dla adresu: gs://bucket[/prefiks], file:///katalog albo ścieżka katalogu."""
+    if destination.startswith("gs://"):
+        bucket_name, _, prefix = destination[len("gs://"):].partition("/")
+        return GCSBackend(bucket_name, prefix)
+    if destination.startswith("file://"):
+        destination = destination[len("file://"):]
+    return LocalBackend(destination)
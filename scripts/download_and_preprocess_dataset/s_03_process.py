@@ -6,80 +6,176 @@ import cv2
 import logging
 import numpy as np  # Musimy to zaimportować
 from retinaface import RetinaFace
+from retinaface.commons import preprocess, postprocess
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed 
+from concurrent.futures import ThreadPoolExecutor
 from config import BASE_DATA_DIR, PROCESSING_ORDER, DEVICE, NUM_WORKERS, IMAGE_EXTENSIONS
+from config import DETECTION_BATCH_SIZE, DETECTION_UPSCALING, ANNOTATION_JSON_EXPORT, ANNOTATION_SAVE_EVERY
+from annotation_store import AnnotationWriter, annotation_key, to_annotation, LANDMARK_KEYS
 
 # Konfiguracja logowania
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('RetinaFace').setLevel(logging.WARNING)
 
+# Stałe dekodowania wyjść RetinaFace - jak w RetinaFace.detect_faces (retina-face)
+DETECTION_THRESHOLD = 0.9
+NMS_THRESHOLD = 0.4
+FEAT_STRIDE_FPN = [32, 16, 8]
+ANCHORS_FPN = {
+    32: np.array([[-248.0, -248.0, 263.0, 263.0], [-120.0, -120.0, 135.0, 135.0]], dtype=np.float32),
+    16: np.array([[-56.0, -56.0, 71.0, 71.0], [-24.0, -24.0, 39.0, 39.0]], dtype=np.float32),
+    8: np.array([[-8.0, -8.0, 23.0, 23.0], [0.0, 0.0, 15.0, 15.0]], dtype=np.float32),
+}
+NUM_ANCHORS = 2
 
-def process_image(image_path, model):
+
+def load_image(image_path):
     """
-    Przetwarza pojedynczy obraz: wykrywa twarz i zapisuje plik JSON.
-    Model (funkcja) jest przekazywany jako argument.
+    Wczytuje obraz i przygotowuje tensor wejściowy RetinaFace (wątek roboczy).
+    Zwraca (image_path, (tensor, im_info, im_scale)) albo (image_path, status błędu).
     """
     try:
-        # 1. Obliczenie ścieżki wyjściowej JSON
-        base_name = os.path.splitext(image_path)[0]
-        json_path = base_name + ".json"
-
-        if os.path.exists(json_path):
-            return image_path, "Skipped (JSON exists)"
-
-        # 2. Wczytanie obrazu (BGR)
+        # Wczytanie obrazu (BGR)
         img_bgr = cv2.imread(image_path)
         if img_bgr is None:
             return image_path, "Failed to read image"
-        
+
         # Poprawka: Konwersja BGR -> RGB (aby widział twarze)
         img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        return image_path, preprocess.preprocess_image(img_rgb, DETECTION_UPSCALING)
+    except Exception as e:
+        return image_path, f"Error: {str(e)}"
 
-        # Poprawka: Przygotowanie obrazu dla surowego modelu TF
-        # Konwersja na float32
-        
 
-        # 3. Detekcja twarzy (WŁAŚCIWA METODA)
-        # Wywołujemy surową funkcję tf.function załadowaną w run()
-        # To jest bezpieczne dla wątków i omija blokadę GIL.
-        faces = RetinaFace.detect_faces(img_path=img_rgb, model=model)
-        
-        if not isinstance(faces, dict) or not faces:
-            return image_path, "No face detected"
+def decode_detections(net_out, im_info, im_scale):
+    """
+    Dekoduje wyjścia sieci jednego obrazu (wycinek batcha) na twarze - ten sam wynik
+    co RetinaFace.detect_faces: lista (score, facial_area, landmarks (5, 2)) po NMS.
+    """
+    proposals_list, scores_list, landmarks_list = [], [], []
+    for level, stride in enumerate(FEAT_STRIDE_FPN):
+        scores = net_out[3 * level][:, :, :, NUM_ANCHORS:].reshape((-1, 1))
+        bbox_deltas = net_out[3 * level + 1]
+        height, width = bbox_deltas.shape[1], bbox_deltas.shape[2]
+        anchors = postprocess.anchors_plane(height, width, stride, ANCHORS_FPN[stride])
+        anchors = anchors.reshape((height * width * NUM_ANCHORS, 4))
+
+        bbox_deltas = bbox_deltas.reshape((-1, bbox_deltas.shape[3] // NUM_ANCHORS))
+        proposals = postprocess.clip_boxes(postprocess.bbox_pred(anchors, bbox_deltas), im_info[:2])
+
+        order = np.where(scores.ravel() >= DETECTION_THRESHOLD)[0]
+        proposals = proposals[order, :]
+        proposals[:, 0:4] /= im_scale
+        proposals_list.append(proposals)
+        scores_list.append(scores[order])
+
+        landmark_deltas = net_out[3 * level + 2]
+        landmark_deltas = landmark_deltas.reshape((-1, 5, landmark_deltas.shape[3] // NUM_ANCHORS // 5))
+        landmarks = postprocess.landmark_pred(anchors, landmark_deltas)[order, :]
+        landmarks[:, :, 0:2] /= im_scale
+        landmarks_list.append(landmarks)
+
+    proposals = np.vstack(proposals_list)
+    if proposals.shape[0] == 0:
+        return []
+
+    scores = np.vstack(scores_list)
+    order = scores.ravel().argsort()[::-1]
+    proposals, scores = proposals[order, :], scores[order]
+    landmarks = np.vstack(landmarks_list)[order].astype(np.float32, copy=False)
+
+    pre_det = np.hstack((proposals[:, 0:4], scores)).astype(np.float32, copy=False)
+    keep = postprocess.cpu_nms(pre_det, NMS_THRESHOLD)
+    return [(pre_det[i, 4], pre_det[i, 0:4].astype(int), landmarks[i]) for i in keep]
+
+
+def detect_batch(model, loaded):
+    """
+    Detekcja dla listy (tensor, im_info, im_scale): obrazy o tym samym rozmiarze
+    (WebFace - wszystkie 112x112) są składane w jeden tensor i liczone jednym wywołaniem modelu.
+    """
+    detections = [None] * len(loaded)
+    groups = {}
+    for i, (im_tensor, _, _) in enumerate(loaded):
+        groups.setdefault(im_tensor.shape, []).append(i)
 
-        # 4. Wybór najlepszej twarzy (z najwyższym 'score')
-        best_face = None
-        best_score = -1.0
-        
-        for face_data in faces.values():
-            if face_data['score'] > best_score:
-                best_score = face_data['score']
-                best_face = face_data
-
-        if best_face is None:
-             return image_path, "Detection parsing error"
-
-        # 5. Poprawka: Konwersja typów numpy na float dla JSON
-        converted_landmarks = {
-            key: [float(coord[0]), float(coord[1])] 
-            for key, coord in best_face["landmarks"].items()
-        }
-        
-        output_data = {
-            "bbox": [float(val) for val in best_face["facial_area"]],
-            "landmarks": converted_landmarks,
-            "confidence": float(best_face["score"])
-        }
+    for rows in groups.values():
+        net_out = [elt.numpy() for elt in model(np.concatenate([loaded[i][0] for i in rows]))]
+        for position, i in enumerate(rows):
+            _, im_info, im_scale = loaded[i]
+            detections[i] = decode_detections([out[position:position + 1] for out in net_out], im_info, im_scale)
+    return detections
 
-        # 6. Zapis pliku JSON
-        with open(json_path, 'w') as f:
-            json.dump(output_data, f, indent=4)
 
-        return image_path, "Success"
-        
-    except Exception as e:
-        return image_path, f"Error: {str(e)}"
+def write_annotation(writer, image_path, faces):
+    """
+    Dodaje najlepszą twarz (z najwyższym 'score') do magazynu adnotacji podziału
+    (i do pliku .json obok zdjęcia, gdy ANNOTATION_JSON_EXPORT); zwraca status.
+    """
+    if not faces:
+        return "No face detected"
+
+    score, facial_area, landmarks = max(faces, key=lambda face: face[0])
+    writer.add(annotation_key(image_path, writer.split_dir), facial_area, landmarks, score)
+
+    if ANNOTATION_JSON_EXPORT:
+        json_path = os.path.splitext(image_path)[0] + ".json"
+        try:
+            with open(json_path, 'w') as f:
+                json.dump(to_annotation(facial_area, landmarks, score), f, indent=4)
+        except Exception as e:
+            return f"Error: {str(e)}"
+    return "Success"
+
+
+def import_json(writer, image_files):
+    """
+    Przenosi do magazynu adnotacje z plików .json zapisanych wcześniej obok zdjęć
+    (starsze przetwarzanie); zwraca zdjęcia, które nadal trzeba przetworzyć.
+    """
+    pending_files = []
+    for image_path in image_files:
+        key = annotation_key(image_path, writer.split_dir)
+        if key in writer:
+            continue
+        try:
+            with open(os.path.splitext(image_path)[0] + ".json", 'r') as f:
+                annotation = json.load(f)
+            landmarks = [annotation["landmarks"][name] for name in LANDMARK_KEYS]
+            writer.add(key, annotation["bbox"], landmarks, annotation["confidence"])
+        except (OSError, ValueError, KeyError):
+            pending_files.append(image_path)
+    return pending_files
+
+
+def process_batches(model, executor, image_files, writer):
+    """
+    Batche po DETECTION_BATCH_SIZE obrazów: wątki wczytują następny batch,
+    podczas gdy model liczy bieżący. Zwraca kolejne (image_path, status).
+    """
+    batches = [image_files[i:i + DETECTION_BATCH_SIZE] for i in range(0, len(image_files), DETECTION_BATCH_SIZE)]
+    pending = [executor.submit(load_image, path) for path in batches[0]] if batches else []
+
+    for batch_number in range(len(batches)):
+        loaded = [future.result() for future in pending]
+        if batch_number + 1 < len(batches):
+            pending = [executor.submit(load_image, path) for path in batches[batch_number + 1]]
+
+        ready = [(path, data) for path, data in loaded if not isinstance(data, str)]
+        for path, status in loaded:
+            if isinstance(status, str):
+                yield path, status
+        if not ready:
+            continue
+
+        try:
+            detections = detect_batch(model, [data for _, data in ready])
+        except Exception as e:
+            for path, _ in ready:
+                yield path, f"Error: {str(e)}"
+            continue
+        for (path, _), faces in zip(ready, detections):
+            yield path, write_annotation(writer, path, faces)
 
 # Ta funkcja jest poprawna
 def run():
@@ -122,25 +218,28 @@ def run():
             
         print(f"Znaleziono {len(image_files)} obrazów do przetworzenia.")
 
-        # 2. Używamy ThreadPoolExecutor (puli WĄTKÓW)
+        # Obrazy z adnotacją w magazynie pomijamy (wznowienie przerwanego przetwarzania)
+        writer = AnnotationWriter(split_dir)
+        pending_files = import_json(writer, image_files)
+        if len(pending_files) < len(image_files):
+            print(f"Pominięto {len(image_files) - len(pending_files)} obrazów z istniejącą adnotacją.")
+        writer.save()
+
+        # 2. Wątki (ThreadPoolExecutor) tylko wczytują obrazy; model liczy całe batche
+        #    w tym wątku - jedno wywołanie na DETECTION_BATCH_SIZE obrazów
         with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
-            
-            # Przekazujemy ten JEDEN model do wszystkich wątków
-            futures = [
-                executor.submit(process_image, img_path, model) 
-                for img_path in image_files
-            ]
-            
-            pbar = tqdm(total=len(futures), desc=f"Przetwarzanie {split}")
-            
+            pbar = tqdm(total=len(pending_files), desc=f"Przetwarzanie {split}")
+
             # Zbieranie wyników
-            for future in as_completed(futures):
+            for img_path, status in process_batches(model, executor, pending_files, writer):
                 pbar.update(1)
-                img_path, status = future.result()
-                if status != "Success" and status != "Skipped (JSON exists)":
+                if status != "Success":
                     logging.warning(f"Problem z {img_path}: {status}")
-            
+                if writer.pending >= ANNOTATION_SAVE_EVERY:
+                    writer.save()
+
             pbar.close()
+        print(f"Zapisano {writer.save()} adnotacji do magazynu podziału '{split}'.")
 
     print("--- Etap 3: Zakończony Pomyślnie ---")
 
@@ -0,0 +1,79 @@
+import os
+import glob
+import logging
+from collections import deque
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from config import BASE_DATA_DIR, PROCESSING_ORDER, NUM_WORKERS, IMAGE_EXTENSIONS, PACK_SHARD_BYTES
+from annotation_store import AnnotationStore, to_annotation
+from image_shards import ShardWriter, image_key
+
+logging.basicConfig(level=logging.INFO)
+
+# Liczba plików czytanych z wyprzedzeniem na wątek - w pamięci jest najwyżej
+# READ_AHEAD_PER_WORKER * NUM_WORKERS obrazów, niezależnie od wielkości podziału
+READ_AHEAD_PER_WORKER = 4
+
+
+def read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return path, f.read()
+    except OSError as e:
+        return path, e
+
+
+def read_files(executor, image_files, window):
+    """(ścieżka, bajty albo wyjątek) w kolejności image_files - najwyżej window odczytów naraz."""
+    pending = deque()
+    for path in image_files:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(read_file, path))
+    while pending:
+        yield pending.popleft().result()
+
+
+def run():
+    print(f"--- Etap 3b: Pakowanie obrazów i adnotacji do archiwów (shardów) ---")
+
+    for split in PROCESSING_ORDER:
+        split_dir = os.path.join(BASE_DATA_DIR, split)
+        if not os.path.exists(split_dir):
+            print(f"Folder podziału {split_dir} nie istnieje. Pomijanie.")
+            continue
+
+        image_files = []
+        for ext in IMAGE_EXTENSIONS:
+            image_files.extend(glob.glob(os.path.join(split_dir, "*", "*", f"*{ext}")))
+        if not image_files:
+            print(f"Nie znaleziono obrazów w {split_dir}.")
+            continue
+        # Kolejność kluczy - tożsamości leżą w archiwach obok siebie
+        image_files.sort()
+
+        store = AnnotationStore(split_dir) if AnnotationStore.exists(split_dir) else None
+        if store is None:
+            logging.warning(f"Brak magazynu adnotacji w {split_dir} - archiwa bez plików .json.")
+
+        print(f"Pakowanie {len(image_files)} obrazów z '{split}'...")
+        # Wątki czytają pliki z wyprzedzeniem, zapis do archiwum jest sekwencyjny
+        with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor, ShardWriter(split_dir, PACK_SHARD_BYTES) as writer:
+            files = read_files(executor, image_files, READ_AHEAD_PER_WORKER * NUM_WORKERS)
+            for path, image_bytes in tqdm(files, total=len(image_files), desc=f"Pakowanie {split}"):
+                if isinstance(image_bytes, Exception):
+                    logging.warning(f"Problem z {path}: {image_bytes}")
+                    continue
+                key = image_key(path, split_dir)
+                annotation = None
+                if store is not None:
+                    row = store.rows([key])[0]
+                    if row >= 0:
+                        annotation = to_annotation(store.bbox[row], store.landmarks[row], store.confidence[row])
+                writer.add(key, image_bytes, annotation)
+        print(f"Zapisano {writer.shard + 1} archiwów w {os.path.join(split_dir, 'shards')}.")
+
+    print("--- Etap 3b: Zakończony Pomyślnie ---")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,25 @@
+import os
+import time
+from config import BASE_DATA_DIR, PROCESSING_ORDER, MANIFEST_SCAN_WORKERS
+from manifest import scan_split, write_manifest, MANIFEST_FILE
+
+
+def run():
+    print(f"--- Etap 3c: Manifest podziałów (lista zdjęć dla ewaluacji) ---")
+
+    for split in PROCESSING_ORDER:
+        split_dir = os.path.join(BASE_DATA_DIR, split)
+        if not os.path.exists(split_dir):
+            print(f"Folder podziału {split_dir} nie istnieje. Pomijanie.")
+            continue
+
+        start = time.perf_counter()
+        manifest = scan_split(split_dir, MANIFEST_SCAN_WORKERS)
+        write_manifest(split_dir, manifest)
+        print(f"'{split}': {len(manifest)} zdjęć ({int(manifest['annotated'].sum())} z adnotacją) "
+              f"w {os.path.join(split_dir, MANIFEST_FILE)} - {time.perf_counter() - start:.1f} s.")
+
+    print("--- Etap 3c: Zakończony Pomyślnie ---")
+
+if __name__ == "__main__":
+    run()
@@ -1,58 +1,170 @@
 import os
 import sys
-import subprocess
-from config import BASE_DATA_DIR, BUCKET_NAME
+import json
+import time
+import logging
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import BASE_DATA_DIR, UPLOAD_DESTINATION, UPLOAD_LEDGER, UPLOAD_WORKERS
+from config import UPLOAD_BATCH_FILES, UPLOAD_BATCH_BYTES, UPLOAD_RETRIES, UPLOAD_RETRY_DELAY, UPLOAD_PACKED_ONLY
+from object_store import create_backend, file_md5
+from image_shards import ImageShards, SHARDS_DIR
+
+logging.basicConfig(level=logging.INFO)
+
+
+class UploadLedger:
+    """
+    Dziennik wysłanych obiektów (JSON lines, dopisywany po każdym zadaniu): plik jest pomijany,
+    jeśli dla tego miejsca docelowego wysłano już obiekt o tym samym rozmiarze i mtime.
+    """
+
+    def __init__(self, path, destination):
+        self.path = path
+        self.destination = destination
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # urwana ostatnia linia po przerwaniu
+                    if entry.get("destination") == destination:
+                        self.entries[entry["object"]] = entry
+        self.file = open(path, 'a')
+
+    def done(self, name, stat):
+        entry = self.entries.get(name)
+        return entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+    def record(self, entries):
+        for entry in entries:
+            entry["destination"] = self.destination
+            self.entries[entry["object"]] = entry
+            self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def packed_splits(base_dir):
+    """Podziały z archiwami (shards/index.npy) - wysyłane bez pojedynczych zdjęć."""
+    return {name for name in os.listdir(base_dir) if ImageShards.exists(os.path.join(base_dir, name))}
+
+
+def list_files(base_dir):
+    """(ścieżka, nazwa obiektu, stat) wszystkich plików do wysłania; nazwa jak przy gsutil cp -r."""
+    parent = os.path.dirname(os.path.abspath(base_dir))
+    skip_splits = packed_splits(base_dir) if UPLOAD_PACKED_ONLY else set()
+    files = []
+    for root, dirs, names in os.walk(base_dir):
+        relative = os.path.relpath(root, base_dir).split(os.sep)
+        if relative[0] in skip_splits and len(relative) == 1:
+            # Ze spakowanego podziału: pliki podziału (adnotacje, manifest) i katalog archiwów
+            dirs[:] = [name for name in dirs if name == SHARDS_DIR]
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            object_name = os.path.relpath(os.path.abspath(path), parent).replace(os.sep, "/")
+            files.append((path, object_name, os.stat(path)))
+    return files
+
+
+def make_batches(files):
+    """Zadania po UPLOAD_BATCH_FILES plików / UPLOAD_BATCH_BYTES bajtów (duże pliki - osobno)."""
+    batches, batch, batch_bytes = [], [], 0
+    for item in files:
+        size = item[2].st_size
+        if batch and (len(batch) >= UPLOAD_BATCH_FILES or batch_bytes + size > UPLOAD_BATCH_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def upload_batch(backend, batch):
+    """
+    Wysyła pliki zadania (wątek roboczy) z ponowieniami (UPLOAD_RETRIES, rosnące opóźnienie).
+    Zwraca (wpisy do dziennika, liczba ponowień, [(nazwa obiektu, błąd)]).
+    """
+    entries, retries, failures = [], 0, []
+    for path, name, stat in batch:
+        for attempt in range(UPLOAD_RETRIES + 1):
+            try:
+                md5 = file_md5(path)
+                backend.put(path, name, md5)
+                entries.append({"object": name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5})
+                break
+            except Exception as e:
+                if attempt == UPLOAD_RETRIES:
+                    failures.append((name, e))
+                    break
+                retries += 1
+                time.sleep(UPLOAD_RETRY_DELAY * 2 ** attempt)
+    return entries, retries, failures
+
 
 def run():
-    print("--- Etap 4: Wysyłanie do Google Cloud Storage ---")
+    print("--- Etap 4: Wysyłanie do magazynu obiektów ---")
 
-    if not BUCKET_NAME:
-        print("BŁĄD: Zmienna środowiskowa BUCKET_NAME nie jest ustawiona.")
+    if not UPLOAD_DESTINATION:
+        print("BŁĄD: Miejsce docelowe UPLOAD_DESTINATION nie jest ustawione.")
         sys.exit(1)
-        
+
     if not os.path.exists(BASE_DATA_DIR):
         print(f"BŁĄD: Folder '{BASE_DATA_DIR}' nie istnieje. Nic do wysłania.")
         sys.exit(1)
 
-    # 1. Weryfikacja dostępności gsutil
     try:
-        subprocess.run(["gsutil", "--version"], check=True, capture_output=True)
-    except FileNotFoundError:
-        print("BŁĄD: Komenda 'gsutil' nie znaleziona.")
-        print("Upewnij się, że Google Cloud SDK jest zainstalowane w kontenerze Docker.")
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        print(f"BŁĄD: Problem z gsutil: {e.stderr}")
+        backend = create_backend(UPLOAD_DESTINATION)
+    except Exception as e:
+        print(f"BŁĄD: Nie udało się połączyć z {UPLOAD_DESTINATION}. Sprawdź uwierzytelnienie.")
+        print(f"Error: {e}")
         sys.exit(1)
 
-    # 2. Przygotowanie komendy
-    # gsutil -m cp -r webface-112x112 gs://my-awesome-bucket/
-    source_path = BASE_DATA_DIR
-    destination_path = f"gs://{BUCKET_NAME}/"
-    
-    command = [
-        "gsutil",
-        "-m",       # Użyj wielowątkowości do kopiowania
-        "cp",       # Kopiuj
-        "-r",       # Rekursywnie
-        source_path,
-        destination_path
-    ]
-
-    print(f"Uruchamianie komendy: {' '.join(command)}")
-
-    # 3. Uruchomienie wysyłania
-    try:
-        subprocess.run(command, check=True)
-        print("Wysyłanie zakończone pomyślnie.")
-    except subprocess.CalledProcessError as e:
-        print(f"BŁĄD podczas wysyłania do GCS: {e}")
+    ledger = UploadLedger(UPLOAD_LEDGER, str(backend))
+    files = list_files(BASE_DATA_DIR)
+    pending = [item for item in files if not ledger.done(item[1], item[2])]
+    total_bytes = sum(item[2].st_size for item in pending)
+    print(f"Plików: {len(files)}, już wysłanych (wg {UPLOAD_LEDGER}): {len(files) - len(pending)}.")
+    print(f"Wysyłanie {len(pending)} plików ({total_bytes / 2**20:.1f} MB) do {backend} "
+          f"({UPLOAD_WORKERS} wątków)...")
+
+    start = time.perf_counter()
+    uploaded, uploaded_bytes, retries, failures = 0, 0, 0, []
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = {executor.submit(upload_batch, backend, batch): batch for batch in make_batches(pending)}
+        with tqdm(total=total_bytes, unit='B', unit_scale=True, desc="Wysyłanie") as pbar:
+            for future in as_completed(futures):
+                entries, batch_retries, batch_failures = future.result()
+                ledger.record(entries)
+                uploaded += len(entries)
+                uploaded_bytes += sum(entry["size"] for entry in entries)
+                retries += batch_retries
+                failures.extend(batch_failures)
+                pbar.update(sum(item[2].st_size for item in futures[future]))
+    ledger.close()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"Wysłano {uploaded} plików ({uploaded_bytes / 2**20:.1f} MB) w {elapsed:.1f} s: "
+          f"{uploaded_bytes / 2**20 / elapsed:.1f} MB/s, {uploaded / elapsed:.1f} plików/s, ponowień: {retries}.")
+
+    if failures:
+        for name, error in failures[:10]:
+            logging.warning(f"Nie udało się wysłać {name}: {error}")
+        print(f"BŁĄD: {len(failures)} plików nie zostało wysłanych. Ponowne uruchomienie wyśle tylko brakujące.")
         sys.exit(1)
 
     print("--- Etap 4: Zakończony Pomyślnie ---")
 
 if __name__ == "__main__":
-    # Wymaga ręcznego ustawienia zmiennych do testów:
-    # os.environ["BUCKET_NAME"] = "your-test-bucket"
-    # Oraz uwierzytelnienia gcloud (np. `gcloud auth login`)
-    run()
\ No newline at end of file
+    # Wymaga uwierzytelnienia gcloud (np. `gcloud auth application-default login`)
+    # albo UPLOAD_DESTINATION wskazującego lokalny katalog
+    run()